@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Batch netlist to KiCad schematic conversion
+
+Converts many netlists (e.g. board variants) with one SchComponent library - the
+templates are loaded once, then the jobs are spread over a pool of worker processes.
+
+Workers are forked after the library is loaded, so they share it copy-on-write
+instead of receiving it pickled with every job (where fork isn't available, each
+worker gets one pickled copy when it starts).
+
+Manifest formats, by file extension
+  .json         [{"netlist" : ..., "output" : ..., "grouping" : ...}, ...]  (grouping is optional)
+  .csv / .tsv   netlist, grouping, output rows (empty grouping for none, optional header row)
+Relative paths are relative to the manifest.
+
+Per job stats (time of each stage, components / s, ...) are printed, and can be
+appended to a JSON lines file with --stats.
+"""
+
+import argparse
+import csv
+import gc
+import json
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+from typing import Any, Optional
+
+from cache import CacheWarning, TemplateCache, user_cache_path, warn_cache_write
+from cluster import DEFAULT_MAX_FANOUT, auto_grouping
+from net import netlist_encoding
+from placer import PLACERS
+from pipeline import (
+    Conversion, ConversionError, ConversionOptions, TemplateLibrary,
+    load_component_grouping, load_netlist
+)
+
+# (netlist path, grouping path or None, output path)
+Job = tuple[str, Optional[str], str]
+
+# Library + settings of the worker processes, set before the pool is forked
+_library : Optional[TemplateLibrary] = None
+_settings : Optional[dict[str, Any]] = None
+
+
+class ManifestFormatError(Exception):
+    """
+    Malformed batch manifest
+    """
+    def __init__(self, manifest_path: str, msg: str) -> None:
+        super().__init__(f'{manifest_path}: {msg}')
+
+
+def read_manifest(manifest_path: str) -> list[Job]:
+    """
+    Jobs of a manifest, in manifest order
+    """
+    base = os.path.dirname(manifest_path)
+
+    def job(netlist: str, grouping: Optional[str], output: str) -> Job:
+        return (
+            os.path.join(base, netlist),
+            os.path.join(base, grouping) if grouping else None,
+            os.path.join(base, output)
+        )
+
+    jobs = []
+    # No context managers, let it fail fast
+    if manifest_path.lower().endswith('.json'):
+        fd = open(manifest_path, mode='r', encoding='utf-8')
+        entries = json.load(fd)
+        fd.close()
+
+        if not isinstance(entries, list):
+            raise ManifestFormatError(manifest_path, 'expected a list of {"netlist", "output", "grouping"} objects')
+        for i, entry in enumerate(entries):
+            if not isinstance(entry, dict) or not entry.get('netlist') or not entry.get('output'):
+                raise ManifestFormatError(manifest_path, f'entry {i}: expected netlist and output, got {entry!r}')
+            jobs.append(job(entry['netlist'], entry.get('grouping'), entry['output']))
+    else:
+        delimiter = '\t' if manifest_path.lower().endswith('.tsv') else ','
+        fd = open(manifest_path, mode='r', newline='', encoding='utf-8-sig')
+        rows = csv.reader(fd, delimiter=delimiter, skipinitialspace=True)
+
+        for row in rows:
+            if not row or not row[0] or row[0].startswith('#'):
+                continue
+            if rows.line_num == 1 and [cell.strip().lower() for cell in row[:3]] == ['netlist', 'grouping', 'output']:
+                continue
+            if len(row) < 3 or not row[2]:
+                raise ManifestFormatError(manifest_path, f'line {rows.line_num}: expected netlist{delimiter} grouping{delimiter} output, got {row!r}')
+            jobs.append(job(row[0], row[1], row[2]))
+
+        fd.close()
+
+    # Jobs writing the same output would overwrite each other
+    outputs = {}
+    for netlist_path, grouping_path, output_path in jobs:
+        output_path = os.path.abspath(output_path)
+        if output_path in outputs:
+            raise ManifestFormatError(manifest_path, f'{output_path} is the output of both {outputs[output_path]} and {netlist_path}')
+        outputs[output_path] = netlist_path
+
+    return jobs
+
+
+def init_worker(library: TemplateLibrary, settings: dict[str, Any]) -> None:
+    """
+    Worker process initializer, where the pool isn't forked
+    """
+    global _library, _settings
+    _library, _settings = library, settings
+
+
+def run_job(indexed_job: tuple[int, Job]) -> dict[str, Any]:
+    """
+    Convert one netlist with the worker's library, returns the job stats
+    """
+    job_no, (netlist_path, grouping_path, output_path) = indexed_job
+    settings = _settings
+
+    stats : dict[str, Any] = {
+        'job' : job_no,
+        'netlist' : netlist_path,
+        'grouping' : grouping_path,
+        'output' : output_path,
+        'pid' : os.getpid(),
+    }
+    times = stats['times_s'] = {}
+    start = stage_start = time.perf_counter()
+
+    def stage(name: str) -> None:
+        nonlocal stage_start
+        now = time.perf_counter()
+        times[name] = round(now - stage_start, 6)
+        stage_start = now
+
+    try:
+        netlist = load_netlist(netlist_path, settings['netlist_backend'], settings['netlist_encoding'])
+        stage('netlist')
+
+        # Cache warnings are job warnings
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            grouping = load_component_grouping(grouping_path, settings['grouping_cache']) if grouping_path else None
+        stats['warnings'] = [f'WARN: {warning.message}' for warning in caught]
+        if settings['auto_grouping_max_fanout']:
+            grouping = auto_grouping(netlist, grouping, settings['auto_grouping_max_fanout'])
+        stage('grouping')
+
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        conversion = Conversion(_library, netlist, grouping, settings['options'])
+        try:
+            for _ in conversion.match():
+                pass
+        finally:
+            stage('match')
+            stats['warnings'] += [str(issue) for issue in conversion.issues if not issue.fatal]
+
+        conversion.write(output_path)
+        stage('write')
+
+        if settings['verify']:
+            mismatches, net_mismatches = conversion.verify(output_path)
+            stage('verify')
+            stats['verify_mismatches'] = len(mismatches) + len(net_mismatches)
+
+        stats['status'] = 'ok' if not stats.get('verify_mismatches') else 'mismatch'
+
+        conversion_stats = conversion.stats
+        stats['components'] = conversion_stats.netlist_components
+        stats['nets'] = len(netlist.nets)
+        stats['matched'] = conversion_stats.matched
+        stats['skipped'] = len(conversion_stats.skipped)
+        stats['missing_pins'] = conversion_stats.missing_pins
+        stats['bytes_written'] = conversion_stats.bytes_written
+        if settings['options'].compact:
+            stats['no_connects'] = conversion_stats.no_connects
+            stats['local_labels'] = conversion_stats.local_labels
+            stats['compact_bytes_saved'] = conversion_stats.compact_bytes_saved
+
+    except ConversionError as e:
+        stats['status'] = 'failed'
+        stats['errors'] = [str(issue) for issue in e.issues if issue.fatal]
+    except Exception as e:
+        # One broken board shouldn't stop the batch
+        stats['status'] = 'failed'
+        stats['errors'] = [f'ERROR: {type(e).__name__}: {e}']
+
+    stats['total_s'] = round(time.perf_counter() - start, 6)
+    if 'components' in stats:
+        stats['components_per_s'] = round(stats['components'] / stats['total_s'], 1) if stats['total_s'] else 0
+    return stats
+
+
+def job_summary(stats: dict[str, Any]) -> str:
+    """
+    One line description of a finished job
+    """
+    name = os.path.basename(stats['output'])
+    if stats['status'] == 'failed':
+        return f'  {name} : FAILED in {stats["total_s"]:.2f} s\n' + '\n'.join(f'    {error}' for error in stats['errors'])
+
+    times = ', '.join(f'{stage} {t:.3f}' for stage, t in stats['times_s'].items())
+    summary = (
+        f'  {name} : {stats["components"]} components, {stats["nets"]} nets in {stats["total_s"]:.2f} s '
+        f'({stats["components_per_s"]:.0f} components/s; {times}), {len(stats["warnings"])} warnings'
+    )
+    if stats['status'] == 'mismatch':
+        summary += f', {stats["verify_mismatches"]} VERIFY MISMATCHES'
+    return summary
+
+
+def show_warning(message, category, filename, lineno, file=None, line=None) -> None:
+    # Pipeline warnings (cache.CacheWarning, ...) as WARN: lines, like the Issues
+    print(f'WARN: {message}')
+
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+
+    parser.add_argument(
+        'manifest_path',
+        help='Batch manifest (JSON, CSV or TSV) listing the netlist, grouping, output of each job'
+    )
+    parser.add_argument(
+        'component_root',
+        help='SchComponent root, will be recursively scanned for .kicad_sch describing SchComponents'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of worker processes (0 = number of CPUs)',
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        '--stats',
+        help='JSON lines file to append the per job stats to',
+        default=None
+    )
+    parser.add_argument(
+        '-ac', '--allow-missing-components',
+        help='Skip NetComponent with no SchComponent matches',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-ap', '--allow-missing-pins',
+        help='Allow SchComponents with missing pins',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--template-cache',
+        help='File to cache parsed SchComponents in, defaults to a file per component_root in the user cache directory ($XDG_CACHE_HOME/nl2sch)',
+        default=None
+    )
+    parser.add_argument(
+        '--no-template-cache',
+        help='Always parse all SchComponents, don\'t read or write the template cache',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--no-grouping-cache',
+        help='Always read XLS/ODS component groupings, don\'t read or write their compiled grouping caches',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--auto-grouping',
+        help='Group the components not in the job\'s component grouping (all of them, without one) by connectivity',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--auto-grouping-max-fanout',
+        help=f'Nets with more nodes (power, ground, ...) are ignored by --auto-grouping, default {DEFAULT_MAX_FANOUT}',
+        type=int,
+        default=DEFAULT_MAX_FANOUT
+    )
+    parser.add_argument(
+        '--sym-lib-table',
+        help='sym-lib-table resolving the library nicknames of symbols not embedded in templates, can be given multiple times',
+        action='append',
+        default=[]
+    )
+    parser.add_argument(
+        '--deterministic',
+        help='Derive symbol uuids from designators, so that same inputs produce the same schematic',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--netlist-backend',
+        help='In-memory netlist representation, see nl2sch.py',
+        choices=['dict', 'compact'],
+        default='dict'
+    )
+    parser.add_argument(
+        '--netlist-encoding',
+        help='Netlist file encoding, see nl2sch.py',
+        type=netlist_encoding,
+        default=None
+    )
+    parser.add_argument(
+        '--hierarchical',
+        help='Write one sub-sheet per component group, referenced from the job output',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--compact',
+        help='Mark pins of single node nets with no_connect flags instead of global labels',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--compact-local-labels',
+        help='Compact output, also connecting two node nets with local labels (within a sub-sheet with --hierarchical)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--placer',
+        help='Placement engine, see nl2sch.py',
+        choices=list(PLACERS.keys()),
+        default='rows'
+    )
+    parser.add_argument(
+        '--verify',
+        help='Read each written schematic back and check its connectivity against the netlist',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--width',
+        help='Maximum width of a component group in schematic',
+        type=int,
+        default=450
+    )
+    parser.add_argument(
+        '--spacing',
+        help='Spacing between groups of components',
+        type=int,
+        default=7
+    )
+
+    args = parser.parse_args(arguments)
+    warnings.showwarning = show_warning
+    warnings.simplefilter('always', CacheWarning)
+
+    if args.jobs < 1:
+        args.jobs = os.cpu_count() or 1
+
+    try:
+        jobs = read_manifest(args.manifest_path)
+    except ManifestFormatError as e:
+        print(f'ERROR: {e}')
+        return 1
+    print(f'{len(jobs)} jobs in {args.manifest_path}')
+
+    # Load SchComponents, once for all jobs
+    start = time.perf_counter()
+
+    template_cache = None
+    template_cache_path = args.template_cache or user_cache_path(args.component_root, 'templates')
+    if not args.no_template_cache:
+        template_cache = TemplateCache.loadFromFile(template_cache_path)
+
+    try:
+        library = TemplateLibrary.load(args.component_root, template_cache, args.jobs, args.sym_lib_table)
+    except ConversionError as e:
+        for issue in e.issues:
+            print(issue)
+        return 1
+
+    if template_cache:
+        try:
+            template_cache.saveToFile(template_cache_path)
+        except OSError as e:
+            warn_cache_write('template cache', e)
+
+    print(
+        f'Loaded {len(library.sch_comps)} SchComponents in {time.perf_counter() - start:.2f} s' +
+        (f' ({template_cache.hits} cached, {template_cache.misses} parsed)' if template_cache else '')
+    )
+
+    settings = {
+        'options' : ConversionOptions(
+            allow_missing_components = args.allow_missing_components,
+            allow_missing_pins = args.allow_missing_pins,
+            placer = args.placer,
+            width = args.width,
+            spacing = args.spacing,
+            deterministic = args.deterministic,
+            hierarchical = args.hierarchical,
+            jobs = 1,       # sub-sheets are written by the job's worker, jobs are the unit of parallelism
+            compact = args.compact or args.compact_local_labels,
+            local_labels = args.compact_local_labels
+        ),
+        'netlist_backend' : args.netlist_backend,
+        'netlist_encoding' : args.netlist_encoding,
+        'grouping_cache' : not args.no_grouping_cache,
+        'auto_grouping_max_fanout' : args.auto_grouping_max_fanout if args.auto_grouping else None,
+        'verify' : args.verify,
+    }
+
+    # Convert
+    start = time.perf_counter()
+    workers = min(args.jobs, len(jobs))
+    print(f'Converting with {workers} worker process(es)...')
+
+    global _library, _settings
+    _library, _settings = library, settings
+
+    if workers > 1:
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Workers inherit the library - keep the garbage collector from touching
+            # (and so copying) the inherited objects
+            gc.freeze()
+            pool = multiprocessing.get_context('fork').Pool(workers)
+        else:
+            pool = multiprocessing.Pool(workers, init_worker, (library, settings))
+        results = pool.imap_unordered(run_job, enumerate(jobs))
+    else:
+        pool = None
+        results = map(run_job, enumerate(jobs))
+
+    all_stats = []
+    stats_fd = open(args.stats, 'a') if args.stats else None
+    for stats in results:
+        print(job_summary(stats))
+        all_stats.append(stats)
+        if stats_fd:
+            stats_fd.write(json.dumps(stats) + '\n')
+            stats_fd.flush()
+
+    if stats_fd:
+        stats_fd.close()
+    if pool:
+        pool.close()
+        pool.join()
+
+    elapsed = time.perf_counter() - start
+    failed = [stats for stats in all_stats if stats['status'] != 'ok']
+    components = sum(stats.get('components', 0) for stats in all_stats)
+    job_time = sum(stats['total_s'] for stats in all_stats)
+
+    print(
+        f'Converted {len(all_stats) - len(failed)} / {len(all_stats)} netlists in {elapsed:.2f} s: '
+        f'{len(all_stats) / elapsed:.1f} netlists/s, {components / elapsed:.0f} components/s, '
+        f'{job_time / elapsed if elapsed else 0:.1f} s of job time per second'
+    )
+    if failed:
+        print(f'FAILED: {", ".join(os.path.basename(stats["output"]) for stats in failed)}')
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+"""
+nl2sch benchmark suite
+
+  generate  - synthetic Protel netlist + matching SchComponent library, at any scale
+  run       - time + memory profile each nl2sch phase over a generated benchmark
+  compare   - compare two result files, per phase (of the same benchmark + run options)
+
+Results are JSON (one object per run, appended to the results file), so that
+regressions in a phase can be tracked over time.
+
+Example:
+  ./bench.py generate /tmp/bench_100k --components 100000 --rules 200
+  ./bench.py run /tmp/bench_100k --results bench_results.jsonl
+  ./bench.py compare old_results.jsonl bench_results.jsonl
+"""
+
+from array import array
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Any, Callable
+
+import sexpr
+
+# Designator prefixes of generated component families
+_PREFIXES = ('R', 'C', 'L', 'D', 'Q', 'U', 'J', 'TP')
+
+# Namespace for generated template uuids
+_BENCH_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/tpecar/nl2sch/bench')
+
+# Template geometry (mm), pins are on the 2.54 grid on both sides of the symbol body
+_PITCH = 2.54
+_LABEL_ROOM = 20.32     # room for labels left / right of the symbol
+_PIN_X = 7.62           # pin endpoint x offset from symbol origin
+
+
+def template_pin_counts(no_rules: int, max_pins: int, rng: random.Random) -> list[int]:
+    """
+    Pin counts of generated templates - mostly passives, some mid size parts, a few large ICs
+    """
+    counts = []
+    for _ in range(no_rules):
+        r = rng.random()
+        if r < 0.5:
+            counts.append(2)
+        elif r < 0.8:
+            counts.append(rng.randint(3, min(8, max_pins)))
+        else:
+            counts.append(rng.randint(min(9, max_pins), max_pins))
+    return counts
+
+
+def template_rule(k: int, rule_style: str) -> tuple[str, str, str]:
+    """
+    (Designator, Footprint, Value) patterns of template k.
+
+    The footprint pattern decides which matcher bucket the rule lands in -
+    mixed style cycles through exact, literal prefix and wildcard patterns.
+    """
+    prefix = _PREFIXES[k % len(_PREFIXES)]
+    style = rule_style if rule_style != 'mixed' else ('exact', 'prefix', 'wild')[k % 3]
+    footprint = {
+        'exact' : f'FP{k}',
+        'prefix' : f'FP{k}_.*',
+        'wild' : f'.*_FP{k}'
+    }[style]
+    return (f'{prefix}.*', footprint, '.*')
+
+
+def netlist_footprint(k: int, rule_style: str, variant: int) -> str:
+    """
+    Netlist footprint matched by the footprint pattern of template k
+    """
+    style = rule_style if rule_style != 'mixed' else ('exact', 'prefix', 'wild')[k % 3]
+    return {
+        'exact' : f'FP{k}',
+        'prefix' : f'FP{k}_{variant}',
+        'wild' : f'PKG{variant}_FP{k}'
+    }[style]
+
+
+def template_sch(k: int, no_pins: int, rule: tuple[str, str, str]) -> str:
+    """
+    SchComponent template with a box symbol, no_pins pins split between its sides
+    and a global label on each pin endpoint
+    """
+    lib_id = f'Bench:PART{k}'
+    left = (no_pins + 1) // 2
+    sym_x = _LABEL_ROOM + _PIN_X
+    sym_y = 2 * _PITCH
+    width = 2 * sym_x
+    height = round(sym_y + left * _PITCH + _PITCH, 4)
+    sym_uuid = uuid.uuid5(_BENCH_NAMESPACE, f'{k}')
+
+    pins = []
+    labels = []
+    for pin in range(no_pins):
+        side = 0 if pin < left else 1
+        row = pin if side == 0 else pin - left
+        lx = -_PIN_X if side == 0 else _PIN_X
+        ly = round(-row * _PITCH, 4)
+        pins.append(
+            f'        (pin passive line (at {lx} {ly} {0 if side == 0 else 180}) (length 2.54)\n'
+            f'          (name "P{pin + 1}" (effects (font (size 1.27 1.27))))\n'
+            f'          (number "{pin + 1}" (effects (font (size 1.27 1.27))))\n'
+            f'        )\n'
+        )
+        labels.append(
+            f'  (global_label "{pin + 1}" (shape input) (at {round(sym_x + lx, 4)} {round(sym_y - ly, 4)} {180 if side == 0 else 0})\n'
+            f'    (effects (font (size 1.27 1.27)) (justify {"right" if side == 0 else "left"}))\n'
+            f'  )\n'
+        )
+
+    body_top = _PITCH
+    body_bottom = round(-left * _PITCH, 4)
+    bounding_box = ''.join(
+        f'  (polyline (pts (xy {x0} {y0}) (xy {x1} {y1}))\n'
+        f'    (stroke (width 0) (type dash) (color 0 0 0 0))\n'
+        f'  )\n'
+        for x0, y0, x1, y1 in ((0, 0, 0, height), (0, 0, width, 0), (0, height, width, height), (width, height, width, 0))
+    )
+    rule_text = sexpr.quote('D {}\nF {}\nV {}'.format(*rule))
+
+    return f"""(kicad_sch (version 20201015) (generator eeschema)
+
+  (paper "A4")
+
+  (lib_symbols
+    (symbol "{lib_id}" (in_bom yes) (on_board yes)
+      (property "Reference" "U" (id 0) (at 0 {body_top + 1.27} 0)
+        (effects (font (size 1.27 1.27)))
+      )
+      (property "Value" "PART{k}" (id 1) (at 0 {round(body_bottom - 1.27, 4)} 0)
+        (effects (font (size 1.27 1.27)))
+      )
+      (symbol "PART{k}_0_1"
+        (rectangle (start -5.08 {body_top}) (end 5.08 {body_bottom})
+          (stroke (width 0.254)) (fill (type background))
+        )
+      )
+      (symbol "PART{k}_1_1"
+{''.join(pins)}      )
+    )
+  )
+
+{bounding_box}
+  (text {rule_text} (at 0 0 0)
+    (effects (font (size 1.27 1.27)) (justify left bottom))
+  )
+
+{''.join(labels)}
+  (symbol (lib_id "{lib_id}") (at {sym_x} {sym_y} 0) (unit 1)
+    (in_bom yes) (on_board yes)
+    (uuid "{sym_uuid}")
+    (property "Reference" "U?" (id 0) (at {sym_x} {round(sym_y - body_top - 1.27, 4)} 0)
+      (effects (font (size 1.27 1.27)))
+    )
+    (property "Value" "PART{k}" (id 1) (at {sym_x} {round(sym_y - body_bottom + 1.27, 4)} 0)
+      (effects (font (size 1.27 1.27)))
+    )
+  )
+
+  (sheet_instances
+    (path "/" (page "1"))
+  )
+
+  (symbol_instances
+    (path "/{sym_uuid}"
+      (reference "U?") (unit 1) (value "PART{k}") (footprint "")
+    )
+  )
+)
+"""
+
+
+def generate(
+    out_dir         : str,
+    no_comps        : int,
+    no_rules        : int,
+    max_pins        : int,
+    fanout          : float,    # average number of nodes on a (narrow) net
+    wide_nets       : int,      # number of wide (power / ground like) nets
+    wide_fraction   : float,    # fraction of pins connected to wide nets
+    rule_style      : str,
+    seed            : int
+) -> dict[str, Any]:
+    """
+    Write out_dir/bench.Net, out_dir/components/*.kicad_sch and out_dir/bench.json (parameters)
+    """
+    rng = random.Random(seed)
+    comp_dir = os.path.join(out_dir, 'components')
+    os.makedirs(comp_dir, exist_ok=True)
+
+    # Templates (rules)
+    pin_counts = template_pin_counts(no_rules, max_pins, rng)
+    for k, no_pins in enumerate(pin_counts):
+        with open(os.path.join(comp_dir, f'T{k:06d}.kicad_sch'), 'w') as f:
+            f.write(template_sch(k, no_pins, template_rule(k, rule_style)))
+
+    # Component -> template, small parts are more common
+    weights = [1 / no_pins for no_pins in pin_counts]
+    comp_templates = array('i', rng.choices(range(no_rules), weights=weights, k=no_comps))
+
+    # Pin -> net assignment, nodes are numbered in component, pin order
+    # Nets 0 .. wide_nets-1 are wide, the rest narrow
+    no_nodes = sum(pin_counts[k] for k in comp_templates)
+    no_narrow = max(1, round(no_nodes * (1 - wide_fraction) / fanout))
+    node_net = array('i', [
+        rng.randrange(wide_nets) if wide_nets and rng.random() < wide_fraction else wide_nets + rng.randrange(no_narrow)
+        for _ in range(no_nodes)
+    ])
+
+    nl_path = os.path.join(out_dir, 'bench.Net')
+    with open(nl_path, 'w', newline='\r\n') as nl:
+        designators = []
+        for i, k in enumerate(comp_templates):
+            designator = f'{_PREFIXES[k % len(_PREFIXES)]}{i + 1}'
+            designators.append(designator)
+            nl.write(f'[\n{designator}\n{netlist_footprint(k, rule_style, i % 7)}\nV{rng.randrange(100)}\n\n\n\n]\n')
+
+        # Group nodes by net (counting sort), nets are written in net order
+        no_nets = wide_nets + no_narrow
+        net_offsets = array('i', [0]) * (no_nets + 1)
+        for net in node_net:
+            net_offsets[net + 1] += 1
+        for net in range(no_nets):
+            net_offsets[net + 1] += net_offsets[net]
+        fill = array('i', net_offsets)
+        net_nodes = array('i', [0]) * no_nodes
+        for node, net in enumerate(node_net):
+            net_nodes[fill[net]] = node
+            fill[net] += 1
+        del fill, node_net
+
+        # node -> (component, pin)
+        node_comp = array('i', [0]) * no_nodes
+        node_pin = array('i', [0]) * no_nodes
+        node = 0
+        for i, k in enumerate(comp_templates):
+            for pin in range(pin_counts[k]):
+                node_comp[node] = i
+                node_pin[node] = pin + 1
+                node += 1
+
+        no_written_nets = 0
+        for net in range(no_nets):
+            start, end = net_offsets[net], net_offsets[net + 1]
+            if start == end:
+                continue
+            name = f'PWR{net}' if net < wide_nets else f'N{net}'
+            nl.write(f'(\n{name}\n')
+            nl.write(''.join(f'{designators[node_comp[n]]}-{node_pin[n]}\n' for n in net_nodes[start:end]))
+            nl.write(')\n')
+            no_written_nets += 1
+
+    params = {
+        'components' : no_comps,
+        'rules' : no_rules,
+        'max_pins' : max_pins,
+        'fanout' : fanout,
+        'wide_nets' : wide_nets,
+        'wide_fraction' : wide_fraction,
+        'rule_style' : rule_style,
+        'seed' : seed,
+        'nodes' : no_nodes,
+        'nets' : no_written_nets
+    }
+    with open(os.path.join(out_dir, 'bench.json'), 'w') as f:
+        json.dump(params, f, indent=2)
+
+    return params
+
+
+class PhaseTimer:
+    """
+    Wall / CPU time and (optionally) peak traced memory of named phases
+    """
+
+    def __init__(self, trace_memory: bool) -> None:
+        self.trace_memory = trace_memory
+        self.phases : dict[str, dict[str, Any]] = {}
+
+    def run(self, name: str, fn: Callable[[], Any], **info) -> Any:
+        gc.collect()
+        if self.trace_memory:
+            tracemalloc.start()
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        result = fn()
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+
+        phase = {'wall_s' : round(wall, 6), 'cpu_s' : round(cpu, 6)}
+        if self.trace_memory:
+            phase['peak_bytes'] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        phase.update(info)
+        self.phases[name] = phase
+        return result
+
+
+def run_phases(bench_dir: str, netlist_backend: str, placer_name: str, trace_memory: bool) -> dict[str, dict[str, Any]]:
+    """
+    Run the nl2sch phases on a generated benchmark, one PhaseTimer entry per phase
+    """
+    # Imported here, so that 'generate' works without the rest of nl2sch
+    from cache import MatchCache
+    from comp import SchComponent, Text
+    from match import SchComponentMatcher
+    from net import CompactNetlist, Netlist
+    from placer import PLACERS
+    from writer import SchWriter
+
+    timer = PhaseTimer(trace_memory)
+    netlist_cls = CompactNetlist if netlist_backend == 'compact' else Netlist
+
+    # Netlist.loadFromFile
+    netlist = timer.run('netlist', lambda: netlist_cls.loadFromFile(os.path.join(bench_dir, 'bench.Net')))
+    timer.phases['netlist'].update(components=len(netlist.comps), nets=len(netlist.nets))
+
+    # Template loading (no template cache)
+    comp_dir = os.path.join(bench_dir, 'components')
+    sch_comp_files = sorted(os.path.join(comp_dir, f) for f in os.listdir(comp_dir) if f.endswith('.kicad_sch'))
+    sch_comps = timer.run('templates', lambda: [SchComponent.loadFromFile(f) for f in sch_comp_files], templates=len(sch_comp_files))
+
+    # Matching, grouped by template as nl2sch does
+    def match() -> dict[SchComponent, list]:
+        match_cache = MatchCache(SchComponentMatcher(sch_comps), '')
+        matched = {}
+        for net_comp in netlist.comps.values():
+            m = match_cache.match(net_comp)
+            if m:
+                matched.setdefault(m.sch_comp, []).append(m)
+        timer.phases.setdefault('match', {}).update(cache_hits=match_cache.hits, cache_misses=match_cache.misses)
+        return matched
+
+    matched = timer.run('match', match)
+    group = list(matched.items())
+
+    # place() - placement + rendering, results dropped
+    def place() -> int:
+        placer = PLACERS[placer_name](450, 7)
+        rendered_bytes = 0
+        for placeable, pos in placer.place_group('Bench', group):
+            placed = placeable.place(pos)
+            rendered_bytes += len(placed.rendered_labels) + len(placed.rendered_symbol) + len(placed.rendered_symbol_inst)
+        timer.phases.setdefault('place', {}).update(fill_ratio=round(placer.fill_ratio, 4))
+        return rendered_bytes
+
+    rendered_bytes = timer.run('place', place)
+    timer.phases['place']['rendered_bytes'] = rendered_bytes
+
+    # Writing - only the SchWriter calls are timed, rendering is done again in between
+    def write() -> tuple[float, float]:
+        wall = cpu = 0
+
+        def timed(fn: Callable[[], Any]) -> Any:
+            nonlocal wall, cpu
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            result = fn()
+            wall += time.perf_counter() - start_wall
+            cpu += time.process_time() - start_cpu
+            return result
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            placer = PLACERS[placer_name](450, 7)
+            sch_writer = timed(lambda: SchWriter(os.path.join(tmp_dir, 'bench.kicad_sch'), [c.lib_symbol for c in matched]))
+
+            for placeable, pos in placer.place_group('Bench', group):
+                placed = placeable.place(pos)
+                timed(lambda: sch_writer.add(placed))
+
+            timed(lambda: sch_writer.close(placer.paper))
+            timer.phases.setdefault('write', {}).update(bytes_written=sch_writer.bytes_written)
+        return wall, cpu
+
+    wall, cpu = timer.run('write', write)
+    write_phase = timer.phases['write']
+    write_phase.update(
+        wall_s=round(wall, 6), cpu_s=round(cpu, 6),
+        # Including the rendering in between
+        total_wall_s=write_phase['wall_s'], total_cpu_s=write_phase['cpu_s']
+    )
+
+    return timer.phases
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def run(bench_dir: str, netlist_backend: str, placer_name: str, repeat: int, trace_memory: bool) -> dict[str, Any]:
+    """
+    Benchmark result - best wall / CPU time of repeat runs, peak memory from a separate
+    traced run (tracing slows everything down, so it's not mixed with the timing)
+    """
+    with open(os.path.join(bench_dir, 'bench.json')) as f:
+        params = json.load(f)
+
+    phases = None
+    for _ in range(repeat):
+        run_phases_result = run_phases(bench_dir, netlist_backend, placer_name, False)
+        if phases is None:
+            phases = run_phases_result
+        else:
+            for name, phase in run_phases_result.items():
+                for metric in ('wall_s', 'cpu_s', 'total_wall_s', 'total_cpu_s'):
+                    if metric in phase:
+                        phases[name][metric] = min(phases[name][metric], phase[metric])
+
+    if trace_memory:
+        for name, phase in run_phases(bench_dir, netlist_backend, placer_name, True).items():
+            phases[name]['peak_bytes'] = phase['peak_bytes']
+
+    return {
+        'timestamp' : datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'commit' : git_commit(),
+        'python' : platform.python_version(),
+        'platform' : platform.platform(),
+        'bench' : os.path.abspath(bench_dir),
+        'params' : params,
+        'options' : {'netlist_backend' : netlist_backend, 'placer' : placer_name, 'repeat' : repeat},
+        'phases' : phases
+    }
+
+
+def print_result(result: dict[str, Any]) -> None:
+    params = result['params']
+    print(f"{params['components']} components, {params['nodes']} nodes, {params['nets']} nets, {params['rules']} rules")
+    print(f"{'phase':<10} {'wall s':>10} {'cpu s':>10} {'peak MB':>10}")
+    for name, phase in result['phases'].items():
+        peak = f"{phase['peak_bytes'] / 1e6:.1f}" if 'peak_bytes' in phase else '-'
+        print(f"{name:<10} {phase['wall_s']:>10.3f} {phase['cpu_s']:>10.3f} {peak:>10}")
+
+
+def load_results(path: str) -> list[dict[str, Any]]:
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def run_differences(old: dict[str, Any], new: dict[str, Any]) -> list[str]:
+    """
+    Differences of the benchmark parameters / run options of two results, which make
+    their times incomparable (the repeat count only changes how the best time is picked)
+    """
+    differences = []
+    for section, ignored in (('params', ()), ('options', ('repeat',))):
+        old_values, new_values = old.get(section, {}), new.get(section, {})
+        for key in sorted(old_values.keys() | new_values.keys()):
+            if key not in ignored and old_values.get(key) != new_values.get(key):
+                differences.append(f'{key}: {old_values.get(key)} -> {new_values.get(key)}')
+    return differences
+
+
+def compare(old: dict[str, Any], new: dict[str, Any], threshold: float) -> bool:
+    """
+    Print per phase new / old ratios, returns False if any phase regressed by more than threshold
+    """
+    ok = True
+    print(f"{'phase':<10} {'old s':>10} {'new s':>10} {'ratio':>8} {'old MB':>8} {'new MB':>8}")
+    for name, new_phase in new['phases'].items():
+        old_phase = old['phases'].get(name)
+        if not old_phase:
+            continue
+        ratio = new_phase['wall_s'] / old_phase['wall_s'] if old_phase['wall_s'] else 1
+        mem = [
+            f"{p['peak_bytes'] / 1e6:.1f}" if 'peak_bytes' in p else '-'
+            for p in (old_phase, new_phase)
+        ]
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            ok = False
+        print(f"{name:<10} {old_phase['wall_s']:>10.3f} {new_phase['wall_s']:>10.3f} {ratio:>8.2f} {mem[0]:>8} {mem[1]:>8}{flag}")
+    return ok
+
+
+def main(arguments):
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    gen = subparsers.add_parser('generate', help='Generate a synthetic benchmark')
+    gen.add_argument('out_dir', help='Benchmark directory')
+    gen.add_argument('--components', help='Number of netlist components', type=int, default=1000)
+    gen.add_argument('--rules', help='Number of SchComponent templates (rules)', type=int, default=50)
+    gen.add_argument('--max-pins', help='Maximum number of template pins', type=int, default=64)
+    gen.add_argument('--fanout', help='Average number of nodes on a narrow net', type=float, default=3)
+    gen.add_argument('--wide-nets', help='Number of wide (power / ground like) nets', type=int, default=4)
+    gen.add_argument('--wide-fraction', help='Fraction of pins connected to wide nets', type=float, default=0.2)
+    gen.add_argument(
+        '--rule-style',
+        help='Footprint pattern style of the rules (exact, literal prefix, wildcard or mixed)',
+        choices=['exact', 'prefix', 'wild', 'mixed'],
+        default='mixed'
+    )
+    gen.add_argument('--seed', type=int, default=0)
+
+    run_parser = subparsers.add_parser('run', help='Run a generated benchmark')
+    run_parser.add_argument('bench_dir', help='Benchmark directory')
+    run_parser.add_argument('--netlist-backend', choices=['dict', 'compact'], default='dict')
+    run_parser.add_argument('--placer', choices=['rows', 'skyline'], default='skyline')
+    run_parser.add_argument('--repeat', help='Number of timed runs, best time is reported', type=int, default=1)
+    run_parser.add_argument('--no-memory', help='Skip the traced (peak memory) run', action='store_true')
+    run_parser.add_argument('--results', help='JSON lines file to append the result to', default=None)
+
+    cmp_parser = subparsers.add_parser('compare', help='Compare the last results of two result files')
+    cmp_parser.add_argument('old', help='Baseline results file')
+    cmp_parser.add_argument('new', help='New results file')
+    cmp_parser.add_argument('--threshold', help='Allowed slowdown of a phase (0.1 = 10%%)', type=float, default=0.1)
+    cmp_parser.add_argument('--force', help='Compare results of different benchmarks / run options', action='store_true')
+
+    args = parser.parse_args(arguments)
+
+    if args.command == 'generate':
+        start = time.perf_counter()
+        params = generate(
+            args.out_dir, args.components, args.rules, args.max_pins, args.fanout,
+            args.wide_nets, args.wide_fraction, args.rule_style, args.seed
+        )
+        print(f"Generated {params['components']} components, {params['nodes']} nodes, {params['nets']} nets, "
+              f"{params['rules']} rules in {time.perf_counter() - start:.1f} s")
+
+    elif args.command == 'run':
+        result = run(args.bench_dir, args.netlist_backend, args.placer, args.repeat, not args.no_memory)
+        print_result(result)
+        if args.results:
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+
+    elif args.command == 'compare':
+        old, new = load_results(args.old)[-1], load_results(args.new)[-1]
+        differences = run_differences(old, new)
+        if differences:
+            print(f"{'WARN' if args.force else 'ERROR'}: results of different runs ({', '.join(differences)})")
+            if not args.force:
+                return 1
+        if not compare(old, new, args.threshold):
+            return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,373 @@
+"""
+On-disk caches, so that repeated runs over the same inputs can skip work.
+
+Caches are plain pickles tagged with a fingerprint of the inputs they were
+derived from - a cache with a stale fingerprint is discarded, never patched.
+
+Loading a pickle runs whatever it says, so caches are only read from where the user
+said, or from the per-user cache directory ($XDG_CACHE_HOME/nl2sch) - never from
+the input trees (template libraries, symbol libraries, groupings), which may be
+shared or checked out.
+"""
+
+import hashlib
+import os
+import pickle
+import warnings
+from typing import Any, Optional
+
+from comp import MatchedSchComponent, PlacedSchComponent, SchComponent
+from match import SchComponentMatcher
+from net import NetComponent
+
+# Bump when the layout of any cache changes
+CACHE_VERSION = 7
+
+
+class CacheWarning(UserWarning):
+    """
+    A cache could not be written - the run goes on without it
+    """
+
+
+def warn_cache_write(what: str, e: OSError) -> None:
+    warnings.warn(f'could not write {what}: {e}', CacheWarning, stacklevel=3)
+
+
+def user_cache_dir() -> str:
+    """
+    Per-user cache directory, $XDG_CACHE_HOME/nl2sch (~/.cache/nl2sch by default)
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'nl2sch')
+
+
+def user_cache_path(input_path: str, kind: str) -> str:
+    """
+    Cache file of an input file / directory in the per-user cache directory, named after
+    the input + a hash of its absolute path (so that equally named inputs don't collide)
+    """
+    input_path = os.path.abspath(input_path)
+    path_hash = hashlib.sha1(input_path.encode()).hexdigest()[:12]
+    return os.path.join(user_cache_dir(), f'{os.path.basename(input_path)}.{path_hash}.{kind}.cache')
+
+
+def files_fingerprint(paths: list[str]) -> str:
+    """
+    Fingerprint of a set of files - changes if any file is added, removed or modified
+    """
+    h = hashlib.sha1()
+    for path in paths:
+        st = os.stat(path)
+        h.update(f'{path}\0{st.st_size}\0{st.st_mtime_ns}\n'.encode())
+    return h.hexdigest()
+
+
+def load_pickle(path: str, fingerprint: str = '') -> Optional[Any]:
+    """
+    Load cached data, None if there is no cache or it was made from different inputs
+    """
+    try:
+        with open(path, 'rb') as f:
+            version, cached_fingerprint, data = pickle.load(f)
+    except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+        return None
+
+    if version != CACHE_VERSION or cached_fingerprint != fingerprint:
+        return None
+    return data
+
+
+def save_pickle(path: str, fingerprint: str, data: Any) -> None:
+    """
+    Persist data, tagged with the fingerprint of the inputs it was made from
+    """
+    # Cache directories are private, the caches are code
+    cache_dir = os.path.dirname(path)
+    if cache_dir:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+
+    # Write + rename, so that an interrupted run doesn't leave a truncated cache
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        pickle.dump((CACHE_VERSION, fingerprint, data), f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+class MatchCache:
+    """
+    Memoized SchComponentMatcher results.
+
+    Keyed on (designator class, footprint, value) - the designator class being the set of
+    rules whose Designator pattern matches (see SchComponentMatcher.designator_class),
+    so e.g. all C* with the same footprint and value share one entry.
+    """
+
+    def __init__(
+        self,
+
+        matcher     : SchComponentMatcher,
+        fingerprint : str,                                  # fingerprint of the rule templates
+        entries     : dict[tuple[int, str, str], Optional[int]] = None  # key to rule index (None = no match)
+    ) -> None:
+        self.matcher = matcher
+        self.fingerprint = fingerprint
+        self.entries = entries if entries is not None else {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def match(self, net_comp: NetComponent) -> Optional[MatchedSchComponent]:
+        key = (
+            self.matcher.designator_class(net_comp.designator),
+            net_comp.footprint,
+            net_comp.value
+        )
+
+        if key in self.entries:
+            self.hits += 1
+            rule_no = self.entries[key]
+        else:
+            self.misses += 1
+            rule_no = self.entries[key] = self.matcher.match_class_rule(*key)
+
+        if rule_no is None:
+            return None
+        return MatchedSchComponent(self.matcher.sch_comps[rule_no], net_comp)
+
+    @classmethod
+    def loadFromFile(cls, cache_path: str, matcher: SchComponentMatcher, fingerprint: str) -> Any:
+        """
+        Load persisted entries, starting empty if the cache is missing or stale
+        """
+        return cls(matcher, fingerprint, load_pickle(cache_path, fingerprint))
+
+    def saveToFile(self, cache_path: str) -> None:
+        save_pickle(cache_path, self.fingerprint, self.entries)
+
+
+class TemplateCache:
+    """
+    Parsed SchComponents, keyed by template path.
+
+    An entry is reused while the template size + mtime are unchanged, or, if they did change,
+    while the content hash is the same (e.g. file touched / checked out again) - and while
+    the symbol libraries the template was resolved from are unchanged.
+    All entries are read from disk in one go, only changed templates are parsed.
+    """
+
+    def __init__(
+        self,
+
+        entries : dict[str, tuple[int, int, str, SchComponent]] = None  # path to (size, mtime_ns, sha1, SchComponent)
+    ) -> None:
+        self.entries = entries if entries is not None else {}
+
+        # Entries used in this run - others belong to removed templates and are dropped on save
+        self.used : dict[str, tuple[int, int, str, SchComponent]] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, sch_file_path: str, symbol_libs = None) -> SchComponent:
+        """
+        SchComponent.loadFromFile() through the cache
+        """
+        sch_comp = self.lookup(sch_file_path)
+        if sch_comp is None:
+            sch_comp = self.store(sch_file_path, self.parse(sch_file_path, symbol_libs))
+        return sch_comp
+
+    def lookup(self, sch_file_path: str) -> Optional[SchComponent]:
+        """
+        Cached SchComponent for the template, None if it needs to be (re)parsed
+        """
+        entry = self.entries.get(sch_file_path, None)
+        if not entry:
+            self.misses += 1
+            return None
+
+        st = os.stat(sch_file_path)
+        if entry[:2] != (st.st_size, st.st_mtime_ns):
+            with open(sch_file_path, 'rb') as f:
+                digest = hashlib.sha1(f.read()).hexdigest()
+            if entry[2] != digest:
+                self.misses += 1
+                return None
+            entry = (st.st_size, st.st_mtime_ns, digest, entry[3])
+
+        for lib_path, lib_stat in entry[3].lib_sources.items():
+            try:
+                st = os.stat(lib_path)
+            except FileNotFoundError:
+                st = None
+            if st is None or lib_stat != (st.st_size, st.st_mtime_ns):
+                self.misses += 1
+                return None
+
+        self.hits += 1
+        self.used[sch_file_path] = entry
+        return entry[3]
+
+    def store(self, sch_file_path: str, entry: tuple[int, int, str, SchComponent]) -> SchComponent:
+        """
+        Add entry returned by parse()
+        """
+        self.used[sch_file_path] = entry
+        return entry[3]
+
+    @staticmethod
+    def parse(sch_file_path: str, symbol_libs = None) -> tuple[int, int, str, SchComponent]:
+        """
+        Parse template into a cache entry.
+        Doesn't touch the cache, so it can be run in a worker process.
+        """
+        st = os.stat(sch_file_path)
+        with open(sch_file_path, 'rb') as f:
+            sch = f.read()
+
+        # Same newline handling as the text mode read in SchComponent.loadFromFile
+        sch_comp = SchComponent.loadFromString(sch.decode().replace('\r\n', '\n'), symbol_libs)
+
+        return (st.st_size, st.st_mtime_ns, hashlib.sha1(sch).hexdigest(), sch_comp)
+
+    @classmethod
+    def loadFromFile(cls, cache_path: str) -> Any:
+        return cls(load_pickle(cache_path))
+
+    def saveToFile(self, cache_path: str) -> None:
+        # Nothing changed, don't rewrite
+        if self.used == self.entries:
+            return
+        save_pickle(cache_path, '', self.used)
+
+
+class RenderCache:
+    """
+    Rendered (placed) component blocks, keyed by a hash of the template, the netlist
+    component (designator, value, connections) and the position.
+
+    Placement is done with deterministic uuids, so a cached block is exactly what
+    place() would render again. Only blocks used in this run are persisted.
+
+    Blocks are not held in memory - they're kept in a block file next to the cache
+    (<cache>.blocks), the cache itself is the key -> block span index. Blocks of the
+    last run are read from its block file when used, blocks used in this run are
+    streamed to a new block file as they're produced, which replaces the old one on
+    saveToFile().
+    """
+
+    def __init__(
+        self,
+
+        cache_path  : str,
+        index       : dict[bytes, tuple[int, int]] = None   # key to (offset, length) in the block file
+    ) -> None:
+        self.cache_path = cache_path
+        self.blocks_path = f'{cache_path}.blocks'
+        self.index = index if index is not None else {}
+
+        # Block file of the last run, if there is anything to read
+        self.blocks = None
+        if self.index:
+            # No context managers, open until saveToFile(). Blocks are read as needed, not
+            # mapped, so the blocks read don't stay resident.
+            self.blocks = open(self.blocks_path, mode='rb')
+
+        # Block file of this run, opened on first use
+        self.used : dict[bytes, tuple[int, int]] = {}
+        self.new_blocks = None
+        self.new_blocks_size = 0
+
+        self.reused = 0
+        self.rendered = 0
+
+    @staticmethod
+    def key(match: MatchedSchComponent, pos: tuple[float, float], path_prefix: str = '', compact_nets: dict[str, int] = None) -> bytes:
+        net_comp = match.net_comp
+        h = hashlib.sha1(f'{match.sch_comp.digest}\0{net_comp.designator}\0{net_comp.value}\0{pos[0]!r}\0{pos[1]!r}'.encode())
+        if path_prefix:
+            h.update(f'\0{path_prefix}'.encode())
+        compact_nets = compact_nets or {}
+        for pin, net in sorted(net_comp.connections.items()):
+            h.update(f'\0{pin}\0{net}'.encode())
+            # Compact markers (same key as before for global labels)
+            if net in compact_nets:
+                h.update(f'\0{compact_nets[net]}'.encode())
+        return h.digest()
+
+    def _use(self, key: bytes, block: bytes) -> None:
+        # Append a block used in this run to the new block file
+        if key in self.used:
+            return
+        if self.new_blocks is None:
+            self.new_blocks = open(f'{self.blocks_path}.tmp', mode='wb')
+        self.new_blocks.write(block)
+        self.used[key] = (self.new_blocks_size, len(block))
+        self.new_blocks_size += len(block)
+
+    def get(self, key: bytes) -> Optional[tuple[str, str, str]]:
+        """
+        Cached (labels, symbol, symbol_inst) for the key, None if it needs to be rendered
+        """
+        span = self.index.get(key, None)
+        if span is None:
+            return None
+
+        # Blocks are the three sections, NUL separated (s-exprs have no NULs)
+        self.blocks.seek(span[0])
+        block = self.blocks.read(span[1])
+        self.reused += 1
+        self._use(key, block)
+        return tuple(block.decode('utf-8').split('\0'))
+
+    def put(self, key: bytes, rendered: tuple[str, str, str]) -> None:
+        """
+        Add a block rendered on a cache miss
+        """
+        self.rendered += 1
+        self._use(key, '\0'.join(rendered).encode('utf-8'))
+
+    def place(self, match: MatchedSchComponent, pos: tuple[float, float], path_prefix: str = '', compact_nets: dict[str, int] = None) -> PlacedSchComponent:
+        """
+        match.place(pos, deterministic=True, path_prefix=path_prefix, compact_nets=compact_nets), through the cache
+        """
+        key = self.key(match, pos, path_prefix, compact_nets)
+
+        rendered = self.get(key)
+        if rendered is not None:
+            return PlacedSchComponent(
+                match,
+                rendered_labels=rendered[0],
+                rendered_symbol=rendered[1],
+                rendered_symbol_inst=rendered[2],
+                pos=pos
+            )
+
+        placed = match.place(pos, deterministic=True, path_prefix=path_prefix, compact_nets=compact_nets)
+        self.put(key, (placed.rendered_labels, placed.rendered_symbol, placed.rendered_symbol_inst))
+        return placed
+
+    @classmethod
+    def loadFromFile(cls, cache_path: str) -> Any:
+        """
+        Index of the cache, valid while its block file is the one it was saved with
+        """
+        index = None
+        if os.path.exists(f'{cache_path}.blocks'):
+            index = load_pickle(cache_path, files_fingerprint([f'{cache_path}.blocks']))
+        return cls(cache_path, index)
+
+    def saveToFile(self) -> None:
+        """
+        Replace the cache with the blocks used in this run
+        """
+        if self.blocks is not None:
+            self.blocks.close()
+            self.blocks = None
+        if self.new_blocks is None:
+            self.new_blocks = open(f'{self.blocks_path}.tmp', mode='wb')
+        self.new_blocks.close()
+
+        os.replace(f'{self.blocks_path}.tmp', self.blocks_path)
+        save_pickle(self.cache_path, files_fingerprint([self.blocks_path]), self.used)
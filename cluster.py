@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+Connectivity based automatic component grouping
+
+Without a grouping file, components that belong together (an IC + its passives, a
+connector + its protection, a regulator + its capacitors) can still be found from the
+netlist - they share signal nets with each other, more than with the rest of the board.
+
+Components are clustered by label propagation over the component graph: every component
+starts in a cluster of its own, then repeatedly joins the cluster most of its neighbours
+are in (neighbour = component on a shared net), until no component moves.
+
+High fanout nets (power, ground, resets, ...) connect everything to everything and say
+nothing about what belongs together - nets with more nodes than max_fanout are left out.
+A net of n nodes weighs 1 / (n - 1) per neighbour, so that a component is pulled
+equally by each of its nets, whatever their fanout.
+
+The component graph is built in CSR arrays straight from the netlist connectivity
+(CompactNetlist CSR arrays, or ones built from a Netlist), so one propagation pass is a
+linear walk over flat arrays - 100k+ component netlists cluster in seconds.
+"""
+
+import argparse
+import csv
+import sys
+import time
+from array import array
+from typing import Union
+
+from net import CompactNetlist, Netlist
+from grouping import Grouping
+
+# Nets with more nodes are left out of the component graph
+DEFAULT_MAX_FANOUT = 12
+
+# Propagation passes, labels usually settle after a handful
+DEFAULT_MAX_ITERATIONS = 20
+
+# Smaller clusters are not groups, their components are left ungrouped
+DEFAULT_MIN_CLUSTER_SIZE = 2
+
+
+class ClusterStats:
+    """
+    Clustering counters, for the progress output
+    """
+
+    def __init__(self) -> None:
+        self.components = 0
+        self.edges = 0
+        self.excluded_nets : list[tuple[str, int]] = [] # (net, fanout) of the left out nets
+        self.iterations = 0
+        self.clusters = 0
+        self.ungrouped = 0
+
+
+def connectivity(netlist: Union[Netlist, CompactNetlist]) -> tuple[list[str], list[str], array, array]:
+    """
+    (designators, net names, net_offsets, node_comp) - net -> component id CSR arrays
+    of a netlist. The tables / arrays of a CompactNetlist are used as they are.
+    """
+    if isinstance(netlist, CompactNetlist):
+        return list(netlist.designators), netlist.net_names, netlist.net_offsets, netlist.node_comp
+
+    designators = list(netlist.comps)
+    comp_ids = {id(net_comp) : i for i, net_comp in enumerate(netlist.comps.values())}
+
+    net_offsets, node_comp = array('l', [0]), array('l')
+    for nodes in netlist.nets.values():
+        node_comp.extend(comp_ids[id(net_comp)] for net_comp, pin in nodes)
+        net_offsets.append(len(node_comp))
+
+    return designators, list(netlist.nets), net_offsets, node_comp
+
+
+def component_graph(
+    no_comps: int,
+    net_offsets: array,
+    node_comp: array,
+    max_fanout: int
+) -> tuple[array, array, array, list[int]]:
+    """
+    Component graph CSR arrays (offsets, neighbours, weights) - each net of at most
+    max_fanout nodes links each of its components to the others, weighing 1 / (n - 1).
+    + the ids of the left out nets.
+
+    Parallel edges (components sharing several nets) are kept, as are self edges (a
+    component with several pins on a net) - propagation only sums the edge weights.
+    """
+    # Edge count per component
+    degree = array('l', bytes(array('l').itemsize * (no_comps + 1)))
+    excluded = []
+    for net_id in range(len(net_offsets) - 1):
+        start, end = net_offsets[net_id], net_offsets[net_id + 1]
+        fanout = end - start
+        if fanout > max_fanout:
+            excluded.append(net_id)
+        elif fanout > 1:
+            for comp_id in node_comp[start:end]:
+                degree[comp_id + 1] += fanout - 1
+
+    offsets = degree
+    for comp_id in range(no_comps):
+        offsets[comp_id + 1] += offsets[comp_id]
+
+    # Fill the rows, net by net
+    neighbours = array('l', bytes(array('l').itemsize * offsets[no_comps]))
+    weights = array('d', bytes(array('d').itemsize * offsets[no_comps]))
+    fill = array('l', offsets[:-1])
+    for net_id in range(len(net_offsets) - 1):
+        start, end = net_offsets[net_id], net_offsets[net_id + 1]
+        fanout = end - start
+        if fanout > max_fanout or fanout < 2:
+            continue
+
+        comps = node_comp[start:end]
+        weight = 1.0 / (fanout - 1)
+        for i, comp_id in enumerate(comps):
+            j = fill[comp_id]
+            others = comps[:i] + comps[i + 1:]
+            neighbours[j:j + fanout - 1] = array('l', others)
+            weights[j:j + fanout - 1] = array('d', [weight]) * (fanout - 1)
+            fill[comp_id] = j + fanout - 1
+
+    return offsets, neighbours, weights, excluded
+
+
+def propagate_labels(offsets: array, neighbours: array, weights: array, max_iterations: int) -> tuple[array, int]:
+    """
+    Label propagation - (label per component, passes made).
+
+    Components are visited in netlist order and take the label with the highest
+    neighbour weight right away (asynchronous updates converge, where synchronous ones
+    may oscillate). A component keeps its label on a tie, otherwise the smallest tied
+    label wins - so the result only depends on the netlist.
+    """
+    no_comps = len(offsets) - 1
+    labels = array('l', range(no_comps))
+
+    # Components without edges never change
+    active = [comp_id for comp_id in range(no_comps) if offsets[comp_id + 1] > offsets[comp_id]]
+
+    # Only components with a neighbour that changed label since their last visit can change
+    dirty = bytearray(b'\x01') * no_comps
+
+    iteration = 0
+    while iteration < max_iterations:
+        iteration += 1
+        changed = 0
+
+        for comp_id in active:
+            if not dirty[comp_id]:
+                continue
+            dirty[comp_id] = 0
+
+            scores : dict[int, float] = {}
+            start, end = offsets[comp_id], offsets[comp_id + 1]
+            for neighbour, weight in zip(neighbours[start:end], weights[start:end]):
+                label = labels[neighbour]
+                scores[label] = scores.get(label, 0.0) + weight
+
+            label = labels[comp_id]
+            best = max(scores.values())
+            if scores.get(label, 0.0) < best:
+                labels[comp_id] = min(l for l, score in scores.items() if score == best)
+                changed += 1
+                for neighbour in neighbours[start:end]:
+                    dirty[neighbour] = 1
+
+        if not changed:
+            break
+
+    return labels, iteration
+
+
+def auto_grouping(
+    netlist: Union[Netlist, CompactNetlist],
+    grouping: Grouping = None,
+    max_fanout: int = DEFAULT_MAX_FANOUT,
+    max_iterations: int = DEFAULT_MAX_ITERATIONS,
+    min_cluster_size: int = DEFAULT_MIN_CLUSTER_SIZE,
+    stats: ClusterStats = None
+) -> Grouping:
+    """
+    Grouping of the netlist components by cluster, + the given grouping.
+
+    Components already in the given grouping keep their group and are clustered
+    with the rest, only the ungrouped ones are assigned to clusters. Clusters are
+    named after their component with the most pins, and ordered by size, after the
+    groups of the given grouping.
+    """
+    component_grouping, group_order = grouping if grouping is not None else ({}, [])
+    stats = stats if stats is not None else ClusterStats()
+
+    designators, net_names, net_offsets, node_comp = connectivity(netlist)
+    offsets, neighbours, weights, excluded = component_graph(len(designators), net_offsets, node_comp, max_fanout)
+    labels, stats.iterations = propagate_labels(offsets, neighbours, weights, max_iterations)
+
+    stats.components = len(designators)
+    stats.edges = len(neighbours)
+    stats.excluded_nets = [(net_names[net_id], net_offsets[net_id + 1] - net_offsets[net_id]) for net_id in excluded]
+
+    # Ungrouped components by cluster, in netlist order
+    clusters : dict[int, list[int]] = {}
+    for comp_id, designator in enumerate(designators):
+        if designator not in component_grouping:
+            clusters.setdefault(labels[comp_id], []).append(comp_id)
+
+    # Largest first, ties in netlist order (of the first component)
+    clustered = sorted(
+        (comp_ids for comp_ids in clusters.values() if len(comp_ids) >= min_cluster_size),
+        key=lambda comp_ids: (-len(comp_ids), comp_ids[0])
+    )
+
+    # Pin count of a component = its node count
+    comp_pins = array('l', bytes(array('l').itemsize * len(designators)))
+    for comp_id in node_comp:
+        comp_pins[comp_id] += 1
+
+    new_grouping = dict(component_grouping)
+    new_order = list(group_order)
+    group_names = set(new_order)
+    for comp_ids in clustered:
+        anchor = min(comp_ids, key=lambda comp_id: (-comp_pins[comp_id], comp_id))
+        group = f'{designators[anchor]} cluster'
+        while group in group_names:
+            group += '+'
+
+        new_order.append(group)
+        group_names.add(group)
+        for comp_id in comp_ids:
+            new_grouping[designators[comp_id]] = group
+
+    stats.clusters = len(clustered)
+    stats.ungrouped = sum(len(comp_ids) for comp_ids in clusters.values() if len(comp_ids) < min_cluster_size)
+
+    return new_grouping, new_order
+
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'netlist_path',
+        help='Existing Protel netlist file'
+    )
+    parser.add_argument(
+        'grouping_path',
+        help='CSV file to write the component grouping to (designator, group rows), usable as nl2sch -cg'
+    )
+    parser.add_argument(
+        '--max-fanout',
+        help=f'Leave out nets with more nodes than this (power, ground, ...), default {DEFAULT_MAX_FANOUT}',
+        type=int,
+        default=DEFAULT_MAX_FANOUT
+    )
+    parser.add_argument(
+        '--min-cluster-size',
+        help=f'Leave components of smaller clusters ungrouped, default {DEFAULT_MIN_CLUSTER_SIZE}',
+        type=int,
+        default=DEFAULT_MIN_CLUSTER_SIZE
+    )
+    parser.add_argument(
+        '--netlist-backend',
+        help='Netlist representation, compact keeps connectivity in flat arrays (large netlists)',
+        choices=['dict', 'compact'],
+        default='compact'
+    )
+    args = parser.parse_args(arguments)
+
+    start = time.perf_counter()
+    netlist = (CompactNetlist if args.netlist_backend == 'compact' else Netlist).loadFromFile(args.netlist_path)
+    print(f'Netlist parsed, {len(netlist.comps)} components, {len(netlist.nets)} nets in {time.perf_counter() - start:.2f} s')
+
+    start = time.perf_counter()
+    stats = ClusterStats()
+    component_grouping, group_order = auto_grouping(
+        netlist,
+        max_fanout=args.max_fanout,
+        min_cluster_size=args.min_cluster_size,
+        stats=stats
+    )
+    print(
+        f'{stats.clusters} clusters of {stats.components - stats.ungrouped} components, {stats.ungrouped} ungrouped, '
+        f'{len(stats.excluded_nets)} nets left out, {stats.iterations} passes in {time.perf_counter() - start:.2f} s'
+    )
+
+    # No context managers, let it fail fast
+    fd = open(args.grouping_path, mode='w', newline='', encoding='utf-8')
+    rows = csv.writer(fd)
+    rows.writerow(['designator', 'group'])
+    by_group = {group : [] for group in group_order}
+    for designator, group in component_grouping.items():
+        by_group[group].append(designator)
+    for group, designators in by_group.items():
+        rows.writerows([designator, group] for designator in designators)
+    fd.close()
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -4,11 +4,21 @@ Used in rules.py
 """
 
 from dataclasses import dataclass
+import hashlib
+import os
 from net import NetComponent
 import re
-from typing import Any
+import sexpr
+from typing import Any, Callable
 import uuid
 
+# Namespace for deterministic (designator, template uuid) derived uuids
+UUID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'https://github.com/tpecar/nl2sch')
+
+# Pin markers of compact output, instead of a global label (see MatchedSchComponent.place)
+NO_CONNECT = 1      # single node net - nothing to connect to, no_connect flag
+LOCAL_LABEL = 2     # two node net within a sheet - local label
+
 class SchComponent:
     """
     Netlist / Schematic component
@@ -45,10 +55,14 @@ class SchComponent:
         symbol_inst_tpls : dict[str, str],      # uuid to symbol_instances entry
             # Symbol instance.
 
-        bounds          : tuple[float, float]   # bounding box for component with labels
+        bounds          : tuple[float, float],  # bounding box for component with labels
             # The engine will advance the global position (at which the current component is placed)
             # based on these bounds
 
+        lib_sources     : dict[str, tuple[int, int]] = None # symbol library files to (size, mtime_ns)
+            # Files the lib_symbol was resolved from (if not embedded in the template),
+            # the SchComponent is stale when any of them changes
+
     ) -> None:
         super().__init__()
 
@@ -60,6 +74,38 @@ class SchComponent:
         self.symbol_tpls = symbol_tpls
         self.symbol_inst_tpls = symbol_inst_tpls
         self.bounds = bounds
+        self.lib_sources = lib_sources if lib_sources is not None else {}
+
+        # Placement templates, compiled once so that place() doesn't need to touch the trees
+        self.label_segs = {
+            pin : SegmentedTemplate.compileLabel(label_tpl)
+            for pin, label_tpl in label_tpls.items()
+        }
+        # Compact output variants of the labels
+        self.no_connect_segs = {
+            pin : SegmentedTemplate.compileNoConnect(label_tpl)
+            for pin, label_tpl in label_tpls.items()
+        }
+        self.local_label_segs = {
+            pin : SegmentedTemplate.compileLocalLabel(label_tpl)
+            for pin, label_tpl in label_tpls.items()
+        }
+        self.symbol_segs = [
+            SegmentedTemplate.compileSymbol(symbol_tpl)
+            for symbol_tpl in symbol_tpls.values()
+        ]
+        self.symbol_inst_segs = [
+            SegmentedTemplate.compileSymbolInst(symbol_inst_tpl)
+            for symbol_inst_tpl in symbol_inst_tpls.values()
+        ]
+
+        # Content hash of everything place() renders from, identifies the template in render caches
+        digest = hashlib.sha1(repr((
+            lib_symbol,
+            [(pin, seg.literals, seg.slots) for pin, seg in self.label_segs.items()],
+            [(seg.literals, seg.slots) for seg in self.symbol_segs + self.symbol_inst_segs]
+        )).encode())
+        self.digest = digest.hexdigest()
 
     def match(self, net_comp: NetComponent):
         if (
@@ -73,14 +119,14 @@ class SchComponent:
     
     @property
     def symbol_lib_name(self):
-        return re.findall('\(symbol \"([^"]*)" ', self.lib_symbol)
+        return re.findall('^    \(symbol \"([^"]*)"', self.lib_symbol, re.MULTILINE)
 
     def __str__(self):
         # Quick and dirty description of the object
         return f'{self.symbol_lib_name} Rules [Designator "{self.designator.pattern}" Footprint "{self.footprint.pattern}" Value "{self.value.pattern}"] Bounds {self.bounds}'
 
     @classmethod
-    def loadFromFile(cls, sch_file_path : str) -> Any:
+    def loadFromFile(cls, sch_file_path : str, symbol_libs = None) -> Any:
         """
         Extracts component information from a specifically crafted
         KiCad schematic and creates a SchComponent instance.
@@ -95,43 +141,77 @@ class SchComponent:
         sch = sch_fd.read()
         sch_fd.close()
 
+        return cls.loadFromString(sch, symbol_libs)
+
+    @classmethod
+    def loadFromString(cls, sch : str, symbol_libs = None) -> Any:
+        """
+        loadFromFile(), for schematic contents already read
+
+        Symbols without a lib_symbols entry in the template are resolved by their lib_id
+        through symbol_libs (symlib.SymbolLibraries).
+        """
+        sch = sexpr.loads(sch)
+
         # Extract component matching rules (Designator, Footprint, Value)
-        rule = re.findall('\n  \(text "([^"]*)"[\s\S]+?(?:\n  \))', sch)
+        rule = list(sexpr.children(sch, 'text'))
         if not rule or len(rule) > 1:
             raise Exception(f'Expected one rules instance, found {len(rule)}')
-        rule = re.findall('D\s*(.+?)\\\\nF\s(.+?)\\\\nV (.+)', rule[0].replace('\\\\', '\\'))[0]
-        
+        rule = re.findall('D\s*(.+?)\nF\s(.+?)\nV (.+)', sexpr.unquote(rule[0][1]))[0]
+
 
         # Extract lib_symbols entries
         # We expect one component here (can be multi-unit)
-        lib_symbol = re.search('\(lib_symbols\n(    [\s\S]+?)(?:\n  \))', sch).group(1)
+        lib_symbols = sexpr.find(sch, 'lib_symbols/symbol')
 
         # Extract labels, will be used as a template
-        labels = re.findall('\n(  \(global_label[\s\S]+?(?:\n  \)))', sch)
-        label_tpls = {re.search('global_label "(\S+)"', label).group(1) : label for label in labels}
+        label_tpls = {
+            sexpr.unquote(label[1]) : label
+            for label in sexpr.children(sch, 'global_label')
+        }
 
         # Extract symbol(s), will be used as a template
         # Allow for multiple symbols in case of multi-unit components
-        symbol_tpls = re.findall('\n(  \(symbol [\s\S]+?(?:\n  \)))', sch)
+        symbol_tpls = list(sexpr.children(sch, 'symbol'))
         if not symbol_tpls:
             raise Exception(f'No symbol found')
         # Use symbol uuid it as key
         symbol_tpls = {
-            re.search('\(uuid \"([^"]*)\"\)', symbol).group(1) : symbol
+            sexpr.unquote(sexpr.child(symbol, 'uuid')[1]) : symbol
             for symbol in symbol_tpls
         }
 
+        # Symbols not embedded in lib_symbols are taken from their library (lib:name lib_id)
+        embedded = {sexpr.unquote(symbol[1]) for symbol in lib_symbols}
+        lib_sources = {}
+        for symbol in symbol_tpls.values():
+            lib_id = sexpr.unquote(sexpr.child(symbol, 'lib_id')[1])
+            if lib_id in embedded:
+                continue
+            if symbol_libs is None:
+                raise Exception(f'Symbol {lib_id} not in lib_symbols, and no symbol libraries given')
+
+            lib_symbol, sources = symbol_libs.resolve(lib_id)
+            lib_symbols.append(lib_symbol)
+            embedded.add(lib_id)
+            for path in sources:
+                st = os.stat(path)
+                lib_sources[path] = (st.st_size, st.st_mtime_ns)
+
+        lib_symbol = '\n'.join([
+            '    ' + sexpr.dumps(symbol, 4)
+            for symbol in lib_symbols
+        ])
+
         # Extract symbol_instances entry(ies), will be used as a template
-        symbol_inst_tpls = re.search('\(symbol_instances\n(    [\s\S]+?)(?:\n  \))', sch).group(1)
-        symbol_inst_tpls = re.findall('(    \(path [\s\S]+?(?:\n    \)))', symbol_inst_tpls)
         # Use path uuid as key (note the slash)
         symbol_inst_tpls = {
-            re.search('\(path \"\/([^"]*)\"', symbol_inst).group(1) : symbol_inst
-            for symbol_inst in symbol_inst_tpls
+            sexpr.unquote(symbol_inst[1])[1:] : symbol_inst
+            for symbol_inst in sexpr.find(sch, 'symbol_instances/path')
         }
 
         # Sanity check that we got all symbols / instances
-        # Should pass unless the schematic is malformed / regexes failed
+        # Should pass unless the schematic is malformed
         for uuid in symbol_tpls.keys():
             if uuid not in symbol_inst_tpls:
                 raise Exception(f'Internal: symbol uuid {uuid} missing in symbol_insts')
@@ -141,9 +221,14 @@ class SchComponent:
                 raise Exception(f'Internal: symbol_insts uuid {uuid} missing in symbol')
 
         # Extract bounds
-        # Find bounding box vertex coordinates, select max x,y (bottom right corner)
+        # Find bounding box vertex coordinates (4 top level two point polylines),
+        # select max x,y (bottom right corner)
         # We assume the top left corner is at (0,0)
-        bounding_box = re.findall('\n  \(polyline \(pts \(xy [\d.]+ [\d.]+\) \(xy ([\d.]+) ([\d.]+)\)\)', sch)
+        bounding_box = [
+            pts[2][1:]
+            for pts in sexpr.find(sch, 'polyline/pts')
+            if len(pts) == 3
+        ]
         if len(bounding_box) != 4:
             raise Exception(f'Expected bounding box')
         bounds = max([(float(x), float(y)) for x,y in bounding_box])
@@ -155,25 +240,173 @@ class SchComponent:
             label_tpls = label_tpls,
             symbol_tpls = symbol_tpls,
             symbol_inst_tpls = symbol_inst_tpls,
-            bounds = bounds
+            bounds = bounds,
+            lib_sources = lib_sources
         )
 
+def transform(node: sexpr.Node, handlers: dict[str, Callable[[sexpr.Node], sexpr.Node]]) -> sexpr.Node:
+    """
+    Copy of the s-expr tree, with nodes named in handlers replaced by the handler result
+    """
+    return [
+        child if not isinstance(child, list) else
+        handlers[child[0]](child) if child[0] in handlers else
+        transform(child, handlers)
+        for child in node
+    ]
+
+
+class SegmentedTemplate:
+    """
+    Serialized s-expr template, split into literal text and typed slots.
+
+    Rendering is a join of the literals with the slot values, so placing an instance
+    needs no parsing, regexes or tree copies.
+    """
+
+    # Slot types
+    X           = 0     # x coordinate, arg = template coordinate (translated by pos)
+    Y           = 1     # y coordinate, arg = template coordinate (translated by pos)
+    NET         = 2     # label net name
+    UUID        = 3     # symbol uuid, arg = template uuid
+    PATH        = 4     # symbol_instances path, arg = template uuid
+    REFERENCE   = 5     # designator
+    VALUE       = 6     # value
+
+    __slots__ = ('literals', 'slots')
+
+    def __init__(self, node: sexpr.Node, indent: int) -> None:
+        """
+        Node is a template tree with slot atoms created by _slot()
+        """
+        slots = []
+
+        def slot_atom(slot: tuple[int, Any]) -> str:
+            slots.append(slot)
+            return f'\0{len(slots) - 1}\0'
+
+        node = self._slots(node, slot_atom)
+        text = ' ' * indent + sexpr.dumps(node, indent)
+
+        # re.split alternates literals with the captured slot indexes
+        parts = re.split('\0(\\d+)\0', text)
+        self.literals : list[str] = parts[0::2]
+        self.slots : list[tuple[int, Any]] = [slots[int(i)] for i in parts[1::2]]
+
+    @staticmethod
+    def _slots(node: sexpr.Node, slot_atom: Callable[[tuple[int, Any]], str]) -> sexpr.Node:
+        # Replace node placeholders ('\0', type, arg) atoms with slot atoms
+        return [
+            slot_atom(child[1:]) if isinstance(child, tuple) else
+            SegmentedTemplate._slots(child, slot_atom) if isinstance(child, list) else
+            child
+            for child in node
+        ]
+
+    @staticmethod
+    def _at(at: sexpr.Node) -> sexpr.Node:
+        # (at x y [angle]) - translated by place() position
+        return ['at', ('\0', SegmentedTemplate.X, float(at[1])), ('\0', SegmentedTemplate.Y, float(at[2])), *at[3:]]
+
+    @classmethod
+    def compileLabel(cls, label_tpl: sexpr.Node) -> Any:
+        label = transform(label_tpl, {'at' : cls._at})
+        label[1] = ('\0', cls.NET, None)
+        return cls(label, 2)
+
+    @classmethod
+    def compileNoConnect(cls, label_tpl: sexpr.Node) -> Any:
+        # no_connect flag on the label position (the pin endpoint), it has no angle
+        return cls(['no_connect', cls._at(sexpr.child(label_tpl, 'at')[:3])], 2)
+
+    @classmethod
+    def compileLocalLabel(cls, label_tpl: sexpr.Node) -> Any:
+        # Same label, without the global label shape and intersheet references
+        label = transform(
+            [child for child in label_tpl if not isinstance(child, list) or child[0] not in ('shape', 'property')],
+            {'at' : cls._at}
+        )
+        label[0] = 'label'
+        label[1] = ('\0', cls.NET, None)
+        return cls(label, 2)
+
+    @classmethod
+    def compileSymbol(cls, symbol_tpl: sexpr.Node) -> Any:
+        return cls(
+            transform(symbol_tpl, {
+                'at' : cls._at,
+                'uuid' : lambda node: ['uuid', ('\0', cls.UUID, sexpr.unquote(node[1]))]
+            }),
+            2
+        )
+
+    @classmethod
+    def compileSymbolInst(cls, symbol_inst_tpl: sexpr.Node) -> Any:
+        # Path uuid (without the slash) refers to the symbol uuid
+        path = ['path', ('\0', cls.PATH, sexpr.unquote(symbol_inst_tpl[1])[1:]), *symbol_inst_tpl[2:]]
+        return cls(
+            transform(path, {
+                'reference' : lambda node: ['reference', ('\0', cls.REFERENCE, None)],
+                'value' : lambda node: ['value', ('\0', cls.VALUE, None)]
+            }),
+            4
+        )
+
+    def render(
+        self,
+        pos         : tuple[float, float],
+        net         : str = None,
+        uuids       : dict[str, uuid.UUID] = None,
+        reference   : str = None,
+        value       : str = None,
+        path_prefix : str = ''          # sheet path the symbol instance is in, eg. '/<sheet uuid>'
+    ) -> str:
+        x, y = pos
+        X, Y, NET, UUID, PATH, REFERENCE = self.X, self.Y, self.NET, self.UUID, self.PATH, self.REFERENCE
+
+        values = [
+            # KiCad schematic resolution is 0.1 um
+            ('%.4f' % (arg + x)).rstrip('0').rstrip('.') if kind == X else
+            ('%.4f' % (arg + y)).rstrip('0').rstrip('.') if kind == Y else
+            sexpr.quote(net) if kind == NET else
+            f'"{uuids[arg]}"' if kind == UUID else
+            f'"{path_prefix}/{uuids[arg]}"' if kind == PATH else
+            sexpr.quote(reference) if kind == REFERENCE else
+            sexpr.quote(value)
+            for kind, arg in self.slots
+        ]
+
+        # Interleave literals and slot values
+        parts = [None] * (2 * len(values) + 1)
+        parts[0::2] = self.literals
+        parts[1::2] = values
+        return ''.join(parts)
+
+
 @dataclass
 class MatchedSchComponent:
 
     sch_comp : SchComponent  # SchComponent (template) which matched
     net_comp : NetComponent  # NetComponent (instance) which matched
 
-    def place(self, pos: tuple[float, float]):
+    def place(
+        self,
+        pos             : tuple[float, float],
+        deterministic   : bool = False,
+        path_prefix     : str = '',
+        compact_nets    : dict[str, int] = None     # net -> NO_CONNECT / LOCAL_LABEL, global label for other nets
+    ):
         """
         Place component (translate, set designator + value, set labels to nets)
+
+        In deterministic mode the uuids are derived from the designator and template uuid,
+        so that the same inputs always produce the same schematic.
+
+        path_prefix is the sheet path for symbol instances of components placed in a
+        sub-sheet ('/<sheet uuid>'), empty for the root sheet.
+
+        Pins on compact_nets get a no_connect flag / local label instead of a global label.
         """
-        
-        # The component symbol instances (which we assume were placed relative to (0,0))
-        # are translated by (x, y).
-        pos_re = re.compile('\(at\s+(\S+)\s+(\S+)')
-        def move(match):
-            return f'(at {float(match.group(1)) + pos[0]} {float(match.group(2)) + pos[1]}'
 
         # The symbol entry does not contain the actual designator, value
         # (this is specified by symbol_instance) but contains the actual coordinate!
@@ -183,49 +416,47 @@ class MatchedSchComponent:
         # We need to generate a new, unique uuids per each place() call,
         # since the schematic can have multiple instances of the same component.
         #
-        uuids = {id : uuid.uuid4() for id in self.sch_comp.symbol_tpls.keys()}
-
-        # Label pin to actual net (specified in netlist) replacement
-        label_re = re.compile('\(global_label \"[^"]*\"')
+        if deterministic:
+            uuids = {
+                id : uuid.uuid5(UUID_NAMESPACE, f'{self.net_comp.designator}/{id}')
+                for id in self.sch_comp.symbol_tpls.keys()
+            }
+        else:
+            uuids = {id : uuid.uuid4() for id in self.sch_comp.symbol_tpls.keys()}
+
+        connections = self.net_comp.connections
+        compact_nets = compact_nets or {}
+        label_segs = {
+            None : self.sch_comp.label_segs,
+            NO_CONNECT : self.sch_comp.no_connect_segs,
+            LOCAL_LABEL : self.sch_comp.local_label_segs
+        }
 
         rendered_labels = "\n".join([
-            label_re.sub(f'(global_label \"{self.net_comp.connections[pin]}\"',
-                pos_re.sub(move, label_tpl)
-            )
-            for pin, label_tpl
-            in self.sch_comp.label_tpls.items()
+            label_segs[compact_nets.get(connections[pin])][pin].render(pos, net=connections[pin])
+            for pin
+            in self.sch_comp.label_segs
 
             # We generate the label only if its pin is connected to a net
-            if pin in self.net_comp.connections
+            if pin in connections
         ])
 
-        uuid_re = re.compile('\(uuid \"([^"]*)\"')
-        def uuid_replace(match):
-            return f'(uuid "{uuids[match.group(1)]}"'
-
         rendered_symbol = "\n".join([
-            uuid_re.sub(uuid_replace,
-                pos_re.sub(move, symbol_tpl)
-            )
-            for symbol_tpl
-            in self.sch_comp.symbol_tpls.values()
+            symbol_seg.render(pos, uuids=uuids)
+            for symbol_seg
+            in self.sch_comp.symbol_segs
         ])
 
-        path_re = re.compile('\(path \"\/([^"]*)\"')
-        def path_replace(match):
-            return f'(path "/{uuids[match.group(1)]}"'
-        
-        designator_re = re.compile('\(reference \"[^"]*\"\)')
-        value_re = re.compile('\(value \"[^"]*\"\)')
-
         rendered_symbol_inst = "\n".join([
-            value_re.sub(f'(value \"{self.net_comp.value}\")',
-                designator_re.sub(f'(reference \"{self.net_comp.designator}\")',
-                    path_re.sub(path_replace, symbol_instance)
-                )
+            symbol_inst_seg.render(
+                pos,
+                uuids=uuids,
+                reference=self.net_comp.designator,
+                value=self.net_comp.value,
+                path_prefix=path_prefix
             )
-            for symbol_instance
-            in self.sch_comp.symbol_inst_tpls.values()
+            for symbol_inst_seg
+            in self.sch_comp.symbol_inst_segs
         ])
 
         return PlacedSchComponent(
@@ -5,66 +5,257 @@ Generate footprint library from KiCad v6 pcb symbols + associate them.
 
 import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import os
 import re
+from typing import Iterator, Optional
 
-if __name__ == '__main__':
+import sexpr
 
-    parser = argparse.ArgumentParser(
-        description=__doc__,
-        formatter_class=argparse.RawDescriptionHelpFormatter
-    )
-    parser.add_argument(
-        'src_pcb',
-        help='Source KiCad PCB'
-    )
-    parser.add_argument(
-        'target_pcb',
-        help='Target KiCad PCB which will have footprints associated to generated lib'
-    )
-    parser.add_argument(
-        'lib_path',
-        help='Generated library folder path'
-    )
+# Footprint instance on the board - from the footprint line to its closing paren at the same indent
+_FOOTPRINT_RE = re.compile(r'  \(footprint [\s\S]+?(?:\n  \))')
+_REFERENCE_RE = re.compile(r'\(fp_text reference "([^"]*)"')
+_LIB_ID_RE = re.compile(r'  \(footprint "[^"]*"')
+
+# Buffer size of library file writes
+_WRITE_BUFFER = 1 << 16
+
+
+def footprint_spans(pcb: str) -> Iterator[tuple[int, int, str]]:
+    """
+    (start, end, reference) of each footprint instance, located in one scan over the board
+    """
+    for match in _FOOTPRINT_RE.finditer(pcb):
+        ref = _REFERENCE_RE.search(pcb, match.start(), match.end())
+        yield match.start(), match.end(), ref.group(1) if ref else ''
+
+
+# Per-instance nodes, dropped anywhere in the footprint for dedup
+_INSTANCE_NODES = {'tstamp', 'uuid', 'tedit', 'path', 'net', 'property', 'sheetname', 'sheetfile'}
+
+
+def _fmt(value: float) -> str:
+    return ('%.4f' % value).rstrip('0').rstrip('.')
+
+
+def canonical_footprint(fp: str) -> sexpr.Node:
+    """
+    Footprint instance with everything specific to the instance stripped:
+    reference, value, position, rotation, uuids / timestamps and pad nets.
+
+    Footprint items are in footprint coordinates, but their angles include the footprint
+    rotation - it is subtracted, so that rotated instances of the same geometry are equal.
+    """
+    node = sexpr.loads(fp)
+
+    at = sexpr.child(node, 'at')
+    rotation = float(at[3]) if at and len(at) > 3 else 0
+
+    def strip(node: sexpr.Node, top: bool) -> sexpr.Node:
+        stripped = []
+        for child in node:
+            if not isinstance(child, list):
+                stripped.append(child)
+                continue
+            head = child[0] if child else None
+            if head in _INSTANCE_NODES or (top and head == 'at'):
+                continue
+
+            child = strip(child, False)
+            if head == 'at' and len(child) > 3:
+                # Item angle, relative to the footprint
+                angle = (float(child[3]) - rotation) % 360
+                child[3:4] = [_fmt(angle)] if angle else []
+            elif head == 'fp_text' and len(child) > 2 and child[1] in ('reference', 'value'):
+                child[2] = '"REF**"' if child[1] == 'reference' else '""'
+            stripped.append(child)
+        return stripped
+
+    return strip(node, True)
+
+
+def dedup_entry(fp: str) -> tuple[str, str]:
+    """
+    (library entry name, library entry) shared by all geometrically identical footprints.
+
+    The name is the footprint name the instance was placed from, suffixed with the hash
+    of its canonical form.
+    """
+    node = canonical_footprint(fp)
+    digest = hashlib.sha1(sexpr.dumps(node).encode()).hexdigest()
+
+    lib_id = sexpr.unquote(node[1]) if len(node) > 1 and not isinstance(node[1], list) else ''
+    base = re.sub(r'[^\w.+-]+', '_', lib_id.split(':')[-1]) or 'FP'
+    name = f'{base}_{digest[:8]}'
+
+    # Library footprints carry their name as id + value
+    node[1] = sexpr.quote(name)
+    for fp_text in sexpr.children(node, 'fp_text'):
+        if fp_text[1] == 'value':
+            fp_text[2] = sexpr.quote(name)
+
+    return name, sexpr.dumps(node) + '\n'
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """
+    Write data to path, unless the file already has this content.
+    Returns True if the file was written.
+    """
+    # Only files of the same size need their content compared
+    try:
+        if os.stat(path).st_size == len(data):
+            with open(path, 'rb') as f:
+                if f.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, 'wb', buffering=_WRITE_BUFFER) as f:
+        f.write(data)
+    return True
 
-    args = parser.parse_args(sys.argv[1:])
 
+def fp_lib_gen(
+    src_pcb_path    : str,
+    target_pcb_path : str,
+    lib_path        : str,
+    jobs            : int = 8,
+    verbose         : bool = True,     # print each library file
+    dedup           : bool = False,
+    stats           : Optional[dict[str, int]] = None
+) -> tuple[int, int]:
+    """
+    Generate a footprint library entry (.kicad_mod file) for each footprint instance of the
+    source pcb and write the target pcb, with each instance associated to its generated entry.
+
+    In dedup mode, geometrically identical footprints (see canonical_footprint) share one entry.
+    stats, if given, is filled with the number of footprint instances and the library size
+    with and without dedup.
+
+    Returns (number of library entries, number of entries written - the rest were unchanged)
+    """
     # Get target folder name (library name) from path
-    lib_name = os.path.basename(args.lib_path).split('.')[0]
+    lib_name = os.path.basename(lib_path).split('.')[0]
+    os.makedirs(lib_path, exist_ok=True)
+
+    # No context managers, let it fail fast
+    src_pcb = open(src_pcb_path)
+    pcb = src_pcb.read()
+    src_pcb.close()
 
     # Number of footprint instances with no reference
     # Such instances get UNKNOWN_xxx footprint name
     unk_count = 0
 
-    with open(args.src_pcb) as src_pcb:
-        src_pcb = src_pcb.read()
-
-        # "Replace" lambda that generates a footprint library entry (.kicad_mod file)
-        # and returns pcb footprint instance that is associated with the generated entry
-        def fp_lib_gen(match):
-            global unk_count
-
-            fp = match.group(0)
+    # Library entries, name -> footprint (with duplicate references, the last instance wins)
+    lib_entries : dict[str, str] = {}
 
-            ref = re.search('\(fp_text reference "([^"]*)"', fp).group(1)
+    # Library size without dedup, ref -> size
+    ref_sizes : dict[str, int] = {}
+    no_instances = 0
 
+    # The target pcb is streamed out as the footprints are found, so that the
+    # board isn't built up in memory once more
+    with open(target_pcb_path, 'w', buffering=_WRITE_BUFFER) as target_pcb:
+        pos = 0
+        for start, end, ref in footprint_spans(pcb):
             if not ref:
                 # No reference
                 ref = f'UNKNOWN_{unk_count}'
                 unk_count += 1
 
-            fp_path = f'{args.lib_path}/{ref}.kicad_mod'
-            print(fp_path)
+            fp = pcb[start:end]
+            no_instances += 1
+            ref_sizes[ref] = len(fp)
+
+            name = ref
+            if dedup:
+                name, entry = dedup_entry(fp)
+                lib_entries.setdefault(name, entry)
+            else:
+                lib_entries[ref] = fp
 
-            with open(fp_path, 'w') as outfile:
-                outfile.write(fp)
-            
             # Reassociate all footprints (even if they are already associated to a lib)
             # to our generated lib
-            return re.sub('  \(footprint "[^"]*"', f'  (footprint "{lib_name}:{ref}"', fp)
+            target_pcb.write(pcb[pos:start])
+            target_pcb.write(_LIB_ID_RE.sub(f'  (footprint "{lib_name}:{name}"', fp))
+            pos = end
+
+        target_pcb.write(pcb[pos:])
+
+    # Library files are written from a pool of threads, unchanged files are skipped
+    def write_entry(entry: tuple[str, str]) -> tuple[str, bool]:
+        name, fp = entry
+        fp_path = f'{lib_path}/{name}.kicad_mod'
+        return fp_path, write_if_changed(fp_path, fp.encode())
+
+    # Printed in library order, as the files are done
+    no_written = 0
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        for fp_path, written in executor.map(write_entry, lib_entries.items()):
+            no_written += written
+            if verbose:
+                print(f'{fp_path}{"" if written else " (unchanged)"}')
+
+    if stats is not None:
+        stats['instances'] = no_instances
+        stats['ref_entries'] = len(ref_sizes)
+        stats['ref_bytes'] = sum(ref_sizes.values())
+        stats['lib_bytes'] = sum(len(fp) for fp in lib_entries.values())
 
-        pcb = re.sub('  \(footprint [\s\S]+?(?:\n  \))', fp_lib_gen, src_pcb)
+    return len(lib_entries), no_written
 
-        print(args.target_pcb)
-        with open(args.target_pcb, 'w') as target_pcb:
-            target_pcb.write(pcb)
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'src_pcb',
+        help='Source KiCad PCB'
+    )
+    parser.add_argument(
+        'target_pcb',
+        help='Target KiCad PCB which will have footprints associated to generated lib'
+    )
+    parser.add_argument(
+        'lib_path',
+        help='Generated library folder path'
+    )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of threads writing library files',
+        type=int,
+        default=8
+    )
+    parser.add_argument(
+        '--dedup',
+        help='One library entry per unique footprint geometry instead of one per reference',
+        action='store_true'
+    )
+    parser.add_argument(
+        '-q', '--quiet',
+        help='Don\'t print each library file, only the totals',
+        action='store_true'
+    )
+
+    args = parser.parse_args(arguments)
+
+    stats = {}
+    no_entries, no_written = fp_lib_gen(args.src_pcb, args.target_pcb, args.lib_path, args.jobs, not args.quiet, args.dedup, stats)
+
+    print(f'{args.lib_path}: {no_entries} footprints, {no_written} written, {no_entries - no_written} unchanged')
+    if args.dedup:
+        print(
+            f'Dedup: {stats["instances"]} instances -> {no_entries} footprints '
+            f'(ratio {stats["ref_entries"] / max(1, no_entries):.1f}), '
+            f'{stats["ref_bytes"] - stats["lib_bytes"]} bytes saved ({stats["ref_bytes"]} -> {stats["lib_bytes"]})'
+        )
+    print(args.target_pcb)
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
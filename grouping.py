@@ -0,0 +1,162 @@
+"""
+Component grouping file readers
+
+A grouping assigns netlist components (by designator) to named groups, which become
+the schematic sections (or sub-sheets), in the order the groups are listed.
+
+Supported formats, by file extension
+  .csv / .tsv           one row per component: designator, group
+                        (an optional 'designator, group' header row)
+  .json                 {"group" : ["designator", ...], ...}
+                        (or rows, [["designator", ...], ...] - as a spreadsheet saved by pyexcel)
+  .ods / .xls / .xlsx   one sheet per group, designators in the first column,
+  (anything else)       read with pyexcel. The 'Info' sheet is ignored.
+
+pyexcel (+ its plugins) is only imported for spreadsheets, and its result is cached
+(in the per-user cache directory) until the spreadsheet changes, so that it is usually not
+imported at all.
+"""
+
+import csv
+import json
+import os
+from typing import Callable, Union
+
+from cache import files_fingerprint, load_pickle, save_pickle, user_cache_path, warn_cache_write
+
+# Group name -> designators, in group order
+Book = dict[str, list[str]]
+
+# (designator -> group, groups in order)
+Grouping = tuple[dict[str, str], list[str]]
+
+
+class GroupingFormatError(Exception):
+    """
+    Malformed or inconsistent grouping file
+    """
+    def __init__(self, grouping_path: str, msg: str) -> None:
+        super().__init__(f'{grouping_path}: {msg}')
+
+
+def _first_cell(row: Union[str, list]) -> str:
+    # Designator entry - a plain string or a row of cells
+    if isinstance(row, list):
+        row = row[0] if row else ''
+    return str(row)
+
+
+def read_rows(grouping_path: str, delimiter: str) -> Book:
+    """
+    CSV / TSV - designator, group rows
+    """
+    book : Book = {}
+
+    # No context managers, let it fail fast
+    fd = open(grouping_path, mode='r', newline='', encoding='utf-8-sig')
+    rows = csv.reader(fd, delimiter=delimiter, skipinitialspace=True)
+
+    for row in rows:
+        if not row or not row[0]:
+            continue
+        if rows.line_num == 1 and [cell.strip().lower() for cell in row[:2]] == ['designator', 'group']:
+            continue
+        if len(row) < 2 or not row[1]:
+            raise GroupingFormatError(grouping_path, f'line {rows.line_num}: expected designator{delimiter} group, got {row!r}')
+        book.setdefault(row[1], []).append(row[0])
+
+    fd.close()
+    return book
+
+
+def read_json(grouping_path: str) -> Book:
+    """
+    JSON - group to designator list object
+    """
+    fd = open(grouping_path, mode='r', encoding='utf-8')
+    sheets = json.load(fd)
+    fd.close()
+
+    if not isinstance(sheets, dict):
+        raise GroupingFormatError(grouping_path, 'expected an object of group : [designator, ...]')
+
+    sheets.pop('Info', None)
+    return {group : [_first_cell(row) for row in rows] for group, rows in sheets.items()}
+
+
+def read_spreadsheet(grouping_path: str) -> Book:
+    """
+    Spreadsheet - sheet per group, through pyexcel
+    """
+    # Heavy (plugin discovery + format backends), imported only when needed
+    import pyexcel
+
+    sheets = pyexcel.get_book(file_name=grouping_path).to_dict()
+
+    # Ignore Info sheet, if it exists
+    sheets.pop('Info', None)
+    return {group : [_first_cell(row) for row in rows] for group, rows in sheets.items()}
+
+
+# File extension -> reader, readers with cached results are the slow ones
+READERS : dict[str, tuple[Callable[[str], Book], bool]] = {
+    '.csv' : (lambda path: read_rows(path, ','), False),
+    '.tsv' : (lambda path: read_rows(path, '\t'), False),
+    '.json' : (read_json, False),
+    '.ods' : (read_spreadsheet, True),
+    '.xls' : (read_spreadsheet, True),
+    '.xlsx' : (read_spreadsheet, True),
+}
+
+
+def compile_grouping(grouping_path: str, book: Book) -> Grouping:
+    """
+    designator -> group map + group order of a grouping.
+    A component can only be in one group.
+    """
+    grouping : dict[str, str] = {}
+
+    for group, designators in book.items():
+        for designator in designators:
+            # Empty cells / rows
+            if not designator:
+                continue
+            if designator in grouping:
+                raise GroupingFormatError(grouping_path, f'component {designator} in {group} was already defined in {grouping[designator]}')
+            grouping[designator] = group
+
+    return grouping, list(book.keys())
+
+
+def grouping_cache_path(grouping_path: str) -> str:
+    # Not next to the grouping file, which may be shared, see cache.py
+    return user_cache_path(grouping_path, 'grouping')
+
+
+def load_grouping(grouping_path: str, use_cache: bool = True) -> Grouping:
+    """
+    Read + compile the grouping file with the reader for its extension.
+
+    Compiled groupings of slow (spreadsheet) formats are cached, the cache is
+    invalidated when the grouping file size or mtime changes.
+    """
+    # Anything else is left to pyexcel, which supports more formats
+    ext = os.path.splitext(grouping_path)[1].lower()
+    reader, cached = READERS.get(ext, (read_spreadsheet, True))
+
+    if not (cached and use_cache):
+        return compile_grouping(grouping_path, reader(grouping_path))
+
+    cache_path = grouping_cache_path(grouping_path)
+    fingerprint = files_fingerprint([grouping_path])
+
+    grouping = load_pickle(cache_path, fingerprint)
+    if grouping is None:
+        grouping = compile_grouping(grouping_path, reader(grouping_path))
+        try:
+            save_pickle(cache_path, fingerprint, grouping)
+        except OSError as e:
+            warn_cache_write('grouping cache', e)
+
+    return grouping
+
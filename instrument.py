@@ -0,0 +1,229 @@
+"""
+Built-in phase profiling
+
+Records wall time, CPU time, peak RSS and object counts of named phases, plus
+hot-path counters, and reports them as a summary table or as a Chrome trace-event
+JSON file (load in chrome://tracing or https://ui.perfetto.dev).
+
+Phases are sequential, begin() ends the previous phase. Sub phases that are
+interleaved (e.g. place / render / write of each component) are accumulated over
+the calls of wrap()-ed functions instead.
+
+A disabled Profiler costs nothing - wrap() / iter() hand back what they were given
+and begin() / end() don't measure anything.
+"""
+
+from contextlib import contextmanager
+import gc
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident set size of this process in bytes (since the last reset_peak_rss())
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    # kB on Linux, bytes on macOS
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def reset_peak_rss() -> bool:
+    """
+    Reset the peak RSS, so that it can be measured per phase (Linux only)
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+class Profiler:
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+
+        self.start_wall = time.perf_counter()
+
+        # name -> {wall_s, cpu_s, peak_rss, objects, ...}, in phase order
+        self.phases : dict[str, dict[str, Any]] = {}
+
+        # Hot path counters, name -> count
+        self.counters : dict[str, int] = {}
+
+        # Chrome trace events
+        self.events : list[dict[str, Any]] = []
+
+        self.pid = os.getpid()
+
+        # (name, start ts, start CPU time, peak RSS was reset) of the running phase
+        self._current : Optional[tuple[str, float, float, bool]] = None
+
+    def _ts(self) -> float:
+        # Trace timestamp in us, relative to profiler creation
+        return (time.perf_counter() - self.start_wall) * 1e6
+
+    def begin(self, name: str) -> None:
+        """
+        Start phase name, ending the current phase (phases don't nest)
+        """
+        if not self.enabled:
+            return
+        self.end()
+
+        self._current = (name, self._ts(), time.process_time(), reset_peak_rss())
+
+    def end(self) -> None:
+        """
+        End the current phase, if any
+        """
+        if not self.enabled or self._current is None:
+            return
+
+        name, start_ts, start_cpu, rss_reset = self._current
+        self._current = None
+
+        cpu = time.process_time() - start_cpu
+        end_ts = self._ts()
+
+        phase = self.phases.setdefault(name, {'wall_s' : 0, 'cpu_s' : 0})
+        phase['wall_s'] += (end_ts - start_ts) / 1e6
+        phase['cpu_s'] += cpu
+        phase['peak_rss'] = peak_rss()
+        phase['peak_rss_reset'] = rss_reset
+        phase['objects'] = len(gc.get_objects())
+
+        self.events.append({
+            'name' : name, 'cat' : 'phase', 'ph' : 'X',
+            'ts' : start_ts, 'dur' : end_ts - start_ts,
+            'pid' : self.pid, 'tid' : threading.get_ident(),
+            'args' : {
+                'cpu_ms' : round(cpu * 1000, 3),
+                'peak_rss' : phase['peak_rss'],
+                'objects' : phase['objects']
+            }
+        })
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        """
+        Time the enclosed block as phase name
+        """
+        self.begin(name)
+        try:
+            yield
+        finally:
+            self.end()
+
+    def wrap(self, name: str, fn: Callable) -> Callable:
+        """
+        fn, with its time accumulated into (sub) phase name
+        """
+        if not self.enabled:
+            return fn
+
+        phase = self.phases.setdefault(name, {'wall_s' : 0, 'cpu_s' : 0, 'calls' : 0})
+        perf_counter, process_time = time.perf_counter, time.process_time
+
+        def timed(*args, **kwargs):
+            wall, cpu = perf_counter(), process_time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                phase['wall_s'] += perf_counter() - wall
+                phase['cpu_s'] += process_time() - cpu
+                phase['calls'] += 1
+
+        return timed
+
+    def iter(self, name: str, iterable: Iterable) -> Iterable:
+        """
+        iterable, with the time spent producing items accumulated into (sub) phase name
+        """
+        if not self.enabled:
+            return iterable
+        return self._timed_iter(iter(iterable), self.wrap(name, next))
+
+    @staticmethod
+    def _timed_iter(it: Iterator, timed_next: Callable) -> Iterator:
+        while True:
+            try:
+                item = timed_next(it)
+            except StopIteration:
+                return
+            yield item
+
+    def set_counter(self, name: str, value: int) -> None:
+        """
+        Set counter to a value kept track of elsewhere (e.g. SchComponentMatcher statistics),
+        recorded as a trace counter event
+        """
+        if not self.enabled:
+            return
+        self.counters[name] = value
+        self.events.append({
+            'name' : name, 'cat' : 'counter', 'ph' : 'C',
+            'ts' : self._ts(), 'pid' : self.pid,
+            'args' : {name : value}
+        })
+
+    def summary(self) -> str:
+        """
+        Summary table of phases + counters
+        """
+        lines = [f"{'phase':<20} {'wall s':>9} {'cpu s':>9} {'peak RSS MB':>12} {'objects':>10} {'calls':>9}"]
+
+        # Accumulated sub phases (they have call counts) after the phases they ran in
+        phases = [(name, phase) for name, phase in self.phases.items() if 'calls' not in phase]
+        phases += [('  ' + name, phase) for name, phase in self.phases.items() if 'calls' in phase]
+
+        for name, phase in phases:
+            rss = phase.get('peak_rss')
+            rss = f'{rss / 1e6:.1f}' if rss is not None else '-'
+            if rss != '-' and not phase.get('peak_rss_reset', True):
+                # Process peak, not the phase peak
+                rss = '<=' + rss
+            objects = phase.get('objects', '-')
+            calls = phase.get('calls', '-')
+            lines.append(f"{name:<20} {phase['wall_s']:>9.3f} {phase['cpu_s']:>9.3f} {rss:>12} {objects:>10} {calls:>9}")
+
+        if self.counters:
+            lines.append('')
+            width = max(len(name) for name in self.counters)
+            lines.extend(f'{name:<{width}} {value:>12}' for name, value in self.counters.items())
+
+        return '\n'.join(lines)
+
+    def write_trace(self, trace_path: str) -> None:
+        """
+        Write Chrome trace-event JSON
+        """
+        # Accumulated sub phases have no single span, they go into the metadata
+        accumulated = {
+            name : {'wall_s' : round(phase['wall_s'], 6), 'cpu_s' : round(phase['cpu_s'], 6), 'calls' : phase['calls']}
+            for name, phase in self.phases.items() if 'calls' in phase
+        }
+        with open(trace_path, 'w') as f:
+            json.dump({
+                'traceEvents' : self.events,
+                'displayTimeUnit' : 'ms',
+                'otherData' : {'accumulated' : accumulated, 'counters' : self.counters}
+            }, f)
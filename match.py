@@ -0,0 +1,269 @@
+"""
+Indexed SchComponent rule matcher.
+
+Replaces the linear scan over SchComponent.match with an index over the literal
+prefixes of the Designator, Footprint and Value rule patterns. Only the rules that
+can still match a NetComponent are evaluated, in the original (file) order, so the
+"first matching rule wins" semantics are kept exactly.
+"""
+
+import copy
+import re
+from typing import Any, Optional
+
+from comp import MatchedSchComponent, SchComponent
+from net import NetComponent
+
+# Characters which end the literal part of a pattern
+_META = '.^$*+?{}[]\\|()'
+
+
+def literal_prefix(pattern: str) -> tuple[str, bool]:
+    """
+    Longest literal prefix every string matching the pattern starts with.
+
+    Returns (prefix, exact) where exact means the whole pattern is a literal
+    (fullmatch is then a plain string comparison).
+    """
+    # Top level alternation (A|B) - no common prefix we could cheaply get
+    depth = 0
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            i += 1
+        elif in_class:
+            in_class = c != ']'
+        elif c == '[':
+            in_class = True
+        elif c == '(':
+            depth += 1
+        elif c == ')':
+            depth -= 1
+        elif c == '|' and not depth:
+            return '', False
+        i += 1
+
+    prefix = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\':
+            # Escaped metacharacter is a literal, \d, \w, backreferences etc. are not
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            lit, step = pattern[i + 1], 2
+        elif c in _META:
+            break
+        else:
+            lit, step = c, 1
+
+        # A quantifier makes the preceding character optional / repeated
+        quantifier = pattern[i + step : i + step + 1]
+        if quantifier and quantifier in '*?{+':
+            if quantifier == '+':
+                prefix.append(lit)
+            break
+
+        prefix.append(lit)
+        i += step
+    else:
+        return ''.join(prefix), True
+
+    return ''.join(prefix), False
+
+
+class _FieldIndex:
+    """
+    Index over one rule field (Designator, Footprint or Value) of all rules.
+
+    Each rule is put into one of the buckets below, candidates() returns a bitmask
+    (bit n = rule n) of rules whose field pattern may match the given string.
+    Rules in the any / exact buckets don't need the regex to be evaluated.
+    """
+
+    # Patterns that match any (newline free) string
+    ANY_PATTERNS = ('.*', '(.*)', '.*?', '(?:.*)')
+
+    def __init__(self, patterns: list[str]) -> None:
+        self.any = 0                            # always matching rules
+        self.exact : dict[str, int] = {}        # literal pattern -> rules
+        self.prefix : dict[str, int] = {}       # literal prefix -> rules
+        self.prefix_lens : list[int] = []       # distinct prefix lengths, for lookup
+        self.wild = 0                           # no literal prefix, prefiltered by self.wild_re
+        self.unfiltered = 0                     # no literal prefix, can't be combined into wild_re
+
+        # Rules whose pattern needs to be evaluated to confirm the match
+        self.needs_eval = 0
+
+        wild_patterns = []
+
+        for rule_no, pattern in enumerate(patterns):
+            bit = 1 << rule_no
+
+            if pattern in self.ANY_PATTERNS:
+                self.any |= bit
+                continue
+
+            prefix, exact = literal_prefix(pattern)
+            if exact:
+                self.exact[prefix] = self.exact.get(prefix, 0) | bit
+                continue
+
+            self.needs_eval |= bit
+            if prefix:
+                self.prefix[prefix] = self.prefix.get(prefix, 0) | bit
+            elif re.search(r'\\\d|\(\?P[<=]', pattern):
+                # Backreferences / named groups would break (or be broken by) the combined regex
+                self.unfiltered |= bit
+            else:
+                self.wild |= bit
+                wild_patterns.append(pattern)
+
+        self.prefix_lens = sorted({len(p) for p in self.prefix})
+
+        # Combined alternation of all wildcard patterns - if it doesn't match,
+        # none of the wildcard rules can
+        self.wild_re = None
+        if wild_patterns:
+            try:
+                self.wild_re = re.compile('|'.join(f'(?:{p})' for p in wild_patterns))
+            except re.error:
+                self.unfiltered |= self.wild
+                self.wild = 0
+
+    def candidates(self, s: str) -> tuple[int, int]:
+        """
+        Returns (candidate rule bitmask, number of regex evaluations done)
+        """
+        mask = self.any | self.unfiltered | self.exact.get(s, 0)
+
+        for prefix_len in self.prefix_lens:
+            if prefix_len > len(s):
+                break
+            mask |= self.prefix.get(s[:prefix_len], 0)
+
+        if self.wild_re is not None:
+            if self.wild_re.fullmatch(s):
+                mask |= self.wild
+            return mask, 1
+
+        return mask, 0
+
+
+class SchComponentMatcher:
+    """
+    Compiled matcher over all loaded SchComponent rules.
+
+    match() returns the same MatchedSchComponent (or None) as trying
+    SchComponent.match for each rule in order would.
+    """
+
+    def __init__(self, sch_comps: list[SchComponent]) -> None:
+        self.sch_comps = sch_comps
+
+        self.designator = _FieldIndex([c.designator.pattern for c in sch_comps])
+        self.footprint = _FieldIndex([c.footprint.pattern for c in sch_comps])
+        self.value = _FieldIndex([c.value.pattern for c in sch_comps])
+
+        # Statistics
+        self.rule_evaluations = 0   # candidate rules checked
+        self.regex_evaluations = 0  # fullmatch calls (including the combined wildcard regexes)
+
+    def fork(self) -> Any:
+        """
+        Matcher sharing these (read-only) rule indices, with its own statistics -
+        so that one set of rules can be used by concurrent conversions
+        """
+        matcher = copy.copy(self)
+        matcher.rule_evaluations = 0
+        matcher.regex_evaluations = 0
+        return matcher
+
+    def match(self, net_comp: NetComponent) -> Optional[MatchedSchComponent]:
+        rule_no = self.match_rule(net_comp)
+        if rule_no is None:
+            return None
+        return MatchedSchComponent(self.sch_comps[rule_no], net_comp)
+
+    def match_rule(self, net_comp: NetComponent) -> Optional[int]:
+        """
+        Index (in sch_comps) of the first rule that matches net_comp, None if none does
+        """
+        d, f, v = net_comp.designator, net_comp.footprint, net_comp.value
+
+        # Intersect the field candidates, bailing out early if nothing is left
+        candidates = self._candidates(self.designator, d)
+        if candidates:
+            candidates &= self._candidates(self.footprint, f)
+        if candidates:
+            candidates &= self._candidates(self.value, v)
+
+        # Confirm the candidates in rule order, lowest bit first
+        while candidates:
+            low = candidates & -candidates
+            candidates ^= low
+            rule_no = low.bit_length() - 1
+            sch_comp = self.sch_comps[rule_no]
+
+            self.rule_evaluations += 1
+            if self._fullmatch(self.designator, low, sch_comp.designator, d) and \
+               self._fullmatch(self.footprint, low, sch_comp.footprint, f) and \
+               self._fullmatch(self.value, low, sch_comp.value, v):
+                return rule_no
+
+        return None
+
+    def designator_class(self, designator: str) -> int:
+        """
+        Bitmask of all rules whose Designator pattern matches the designator.
+
+        Designators of the same class are indistinguishable to the rules, so the
+        match result only depends on (class, footprint, value).
+        """
+        candidates = self._candidates(self.designator, designator)
+
+        matching = candidates & ~self.designator.needs_eval
+        candidates &= self.designator.needs_eval
+        while candidates:
+            low = candidates & -candidates
+            candidates ^= low
+            if self._fullmatch(self.designator, low, self.sch_comps[low.bit_length() - 1].designator, designator):
+                matching |= low
+
+        return matching
+
+    def match_class_rule(self, designator_class: int, footprint: str, value: str) -> Optional[int]:
+        """
+        match_rule() for a NetComponent with the given designator class
+        """
+        candidates = designator_class
+        if candidates:
+            candidates &= self._candidates(self.footprint, footprint)
+        if candidates:
+            candidates &= self._candidates(self.value, value)
+
+        while candidates:
+            low = candidates & -candidates
+            candidates ^= low
+            sch_comp = self.sch_comps[low.bit_length() - 1]
+
+            self.rule_evaluations += 1
+            if self._fullmatch(self.footprint, low, sch_comp.footprint, footprint) and \
+               self._fullmatch(self.value, low, sch_comp.value, value):
+                return low.bit_length() - 1
+
+        return None
+
+    def _candidates(self, index: _FieldIndex, s: str) -> int:
+        mask, evals = index.candidates(s)
+        self.regex_evaluations += evals
+        return mask
+
+    def _fullmatch(self, index: _FieldIndex, bit: int, pattern: re.Pattern, s: str) -> bool:
+        if not index.needs_eval & bit:
+            # Rule was put into candidates by an exact / any match
+            return True
+        self.regex_evaluations += 1
+        return pattern.fullmatch(s) is not None
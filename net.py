@@ -14,8 +14,24 @@ Altium Designer PCB Netlist Manager exports in Standard Protel format.
 ----------------------------------------------------------------------
 """
 
+import argparse
+from array import array
+from bisect import bisect_right
+import codecs
+from collections.abc import Mapping
+import io
+import mmap
 import re
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional, Union
+
+# Netlists are read as bytes, fields are decoded when they're used.
+# With no encoding given, a netlist is decoded as UTF-8 if it is valid UTF-8, and
+# otherwise in the Windows code page Altium exports in (bytes it doesn't define are
+# replaced).
+FALLBACK_ENCODING = 'cp1252'
+
+# Encoding detection reads (non-ASCII) netlists in chunks of this size
+_DETECT_CHUNK = 1 << 20
 
 class NetComponent:
     def __init__(self, designator: str, footprint: str, value: str) -> None:
@@ -26,6 +42,32 @@ class NetComponent:
         self.connections: dict[str, str] = {} # pin to netlist (global label) map
 
 
+class _EncodedNetComponent(NetComponent):
+    """
+    NetComponent of a loaded Netlist - the footprint and value stay undecoded until used
+    """
+
+    def __init__(self, designator: str, footprint: bytes, value: bytes, strings: '_DecodedFields') -> None:
+        self.designator = designator
+        self.raw_footprint = footprint
+        self.raw_value = value
+        self.strings = strings      # shared by the components of the netlist
+
+        self.connections: dict[str, str] = {}
+
+    @property
+    def footprint(self) -> str:
+        return self.strings[self.raw_footprint]
+
+    @property
+    def value(self) -> str:
+        return self.strings[self.raw_value]
+
+    def __reduce__(self):
+        # Pickled as a plain NetComponent, without the netlist strings
+        return (_detached_net_component, (self.designator, self.footprint, self.value, self.connections))
+
+
 class Netlist:
     def __init__(
         self,
@@ -37,59 +79,640 @@ class Netlist:
         self.nets = nets
 
     @classmethod
-    def loadFromFile(cls, nl_file_path: str) -> Any:
+    def loadFromFile(cls, nl_file_path: str, encoding: Optional[str] = None) -> Any:
 
-        # No context managers, let it fail fast
-        nl_fd = open(nl_file_path, mode='r')
-        nl = nl_fd.read()
-        nl_fd.close()
+        comps : dict[str, NetComponent] = {}
+        nets  : dict[str, list[(NetComponent, str)]] = {}
 
-        # Extract NetComponents
+        # Components by undecoded designator, nodes are resolved without being decoded
+        raw_comps : dict[bytes, NetComponent] = {}
+
+        encoding, tokens = read_protel(nl_file_path, encoding)
+
+        # Footprints, values and pins repeat a lot - each distinct one is decoded once
+        # (and shared by all components using it). Footprints and values are only
+        # decoded when used, designators, nets and pins are the keys of the netlist.
+        strings = _DecodedFields(encoding)
+
+        # Single pass over the file - components and nets are built as the
+        # tokenizer yields them
+        for line_no, kind, *fields in tokens:
+            if kind == 'component':
+                designator, footprint, value = fields
+                comp = _EncodedNetComponent(decode_field(designator, encoding), footprint, value, strings)
+                comps[comp.designator] = raw_comps[designator] = comp
+            else:
+                net, nodes = fields
+                net = decode_field(net, encoding)
+                net_nodes = nets.setdefault(net, [])
+
+                for node_line_no, (designator, pin) in enumerate(nodes, line_no + 2):
+                    comp = raw_comps.get(designator, None)
+                    if comp is None:
+                        raise NetlistFormatError(
+                            nl_file_path, node_line_no,
+                            f'node references unknown component {decode_field(designator, encoding)}'
+                        )
+                    pin = strings[pin]
+
+                    # Set up net to connected pin (NetComponent, component pin) mapping
+                    # and component connections (pin to net mapping) in NetComponents
+                    net_nodes.append((comp, pin))
+                    comp.connections[pin] = net
+
+        return cls(
+            comps = comps,
+            nets = nets
+        )
+
+    def fanout(self, net: str) -> int:
+        """
+        Number of nodes (component pins) connected to the net
         """
-        The first section describes each component.
-        Each component description is enclosed in square brackets. 
+        return len(self.nets[net])
+
+
+class StringTable:
+    """
+    Immutable table of strings packed into one buffer, addressed by integer id.
+
+    Costs roughly the string length + 4 bytes per entry instead of a str object per entry.
+    The reverse (string to id) index is only built if a lookup by name is requested.
+    """
+
+    def __init__(self, strings: list[str]) -> None:
+        self.buffer = ''.join(strings)
+        self.offsets = array('I', [0])
+        end = 0
+        for s in strings:
+            end += len(s)
+            self.offsets.append(end)
+        self._ids = None
+
+    def __getitem__(self, i: int) -> str:
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]]
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self) -> Iterator[str]:
+        buffer, offsets = self.buffer, self.offsets
+        return (buffer[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1))
+
+    def id(self, s: str) -> int:
+        if self._ids is None:
+            self._ids = {s : i for i, s in enumerate(self)}
+        return self._ids[s]
+
+
+class EncodedStringTable(StringTable):
+    """
+    StringTable of undecoded (netlist file) strings - decoded on access,
+    so that strings which are never looked at are never decoded.
+    The reverse index (by decoded string) is built on the first lookup by name.
+    """
+
+    def __init__(self, strings: list[bytes], encoding: Optional[str] = None) -> None:
+        self.buffer = b''.join(strings)
+        self.offsets = array('I', [0])
+        end = 0
+        for s in strings:
+            end += len(s)
+            self.offsets.append(end)
+        self.encoding = encoding
+        self._ids = None
+
+    def __getitem__(self, i: int) -> str:
+        return decode_field(self.buffer[self.offsets[i]:self.offsets[i + 1]], self.encoding)
+
+    def __iter__(self) -> Iterator[str]:
+        buffer, offsets, encoding = self.buffer, self.offsets, self.encoding
+        return (decode_field(buffer[offsets[i]:offsets[i + 1]], encoding) for i in range(len(offsets) - 1))
+
+
+class CompactNetlist:
+    """
+    Memory compact alternative to Netlist, intended for large (1M+ node) netlists.
 
-        - The first line of the description is the component designator.
+    Designators, footprints, values, pins and net names are interned into integer ids
+    (StringTable), connectivity is kept in compressed sparse row (CSR) arrays:
 
-        - The second line is the footprint that was assigned to that component (in the Part dialog box).
-        There must be a matching component pattern in the PCB design file, which must have pin numbers
-        that match the pin numbers of the component in the schematic.
+        net  -> nodes   net_offsets[net]   .. net_offsets[net + 1]   index node_comp / node_pin
+        comp -> nodes   comp_offsets[comp] .. comp_offsets[comp + 1] index comp_nodes -> node
 
-        - The third line is the information in the Part Type field.
+    The comps / nets / connections views mimic the Netlist interface, NetComponents are
+    materialized on access (CompactNetComponent).
+    """
+
+    def __init__(
+        self,
+
+        strings         : StringTable,  # interned footprints and values
+        pins            : StringTable,  # interned pins
+        designators     : StringTable,  # component id to designator
+        comp_footprint  : array,        # component id to footprint string id
+        comp_value      : array,        # component id to value string id
+        net_names       : StringTable,  # net id to net name
+        net_offsets     : array,        # net CSR row offsets (len(net_names) + 1)
+        node_comp       : array,        # node to component id
+        node_pin        : array,        # node to pin id
+        comp_offsets    : array,        # component CSR row offsets (len(designators) + 1)
+        comp_nodes      : array         # component CSR columns (nodes, in net id order)
+    ) -> None:
+        self.strings = strings
+        self.pins = pins
+        self.designators = designators
+        self.comp_footprint = comp_footprint
+        self.comp_value = comp_value
+        self.net_names = net_names
+        self.net_offsets = net_offsets
+        self.node_comp = node_comp
+        self.node_pin = node_pin
+        self.comp_offsets = comp_offsets
+        self.comp_nodes = comp_nodes
+
+        self.comps = _CompactComps(self)
+        self.nets = _CompactNets(self)
+
+    def fanout(self, net: str) -> int:
         """
-        comps = {d : NetComponent(d, f, v) for d,f,v in re.findall('\[\n(.*)\n(.*)\n(.*)\n\n\n\n\]', nl)}
+        Number of nodes (component pins) connected to the net
+        """
+        net_id = self.net_names.id(net)
+        return self.net_offsets[net_id + 1] - self.net_offsets[net_id]
 
-        # Extract nets
-        # Set up net to connected pin (NetComponent, component pin) mapping
+    def comp_pins(self, comp_id: int) -> Iterator[tuple[str, str]]:
+        """
+        (pin, net) pairs of the component, in net id order (the order their nets appear in the file), not pin order
         """
-        - The second section describes each net. Each net is enclosed in rounded brackets.
+        pins, net_names, net_offsets = self.pins, self.net_names, self.net_offsets
+        for i in range(self.comp_offsets[comp_id], self.comp_offsets[comp_id + 1]):
+            node = self.comp_nodes[i]
+            # Nodes are sorted by net, so the net is found from the net CSR offsets
+            yield pins[self.node_pin[node]], net_names[bisect_right(net_offsets, node) - 1]
 
-        - The first line is the name of the net. If the net has no net label then a name will be assigned
-        during netlist creation.
-        
-        - The following lines show each node in the net. The component designator and pin number will
-        define each node (eg. U7-3, component U7, pin 3).
+    def net_nodes(self, net_id: int) -> Iterator[tuple[int, str]]:
         """
-        nets = {
-            net :
-                [
-                    (comps[d], pin)
-                    for d, pin in
-                    [conn.split('-') for conn in conns.split('\n')]
-                ]
-            for net, conns in re.findall('\(\n(.*)\n([\s\S]+?)\n\)', nl)
-        }
-
-        # Set up component connections (pin to net mapping) in NetComponents
-        for net, conns in nets.items():
-            for comp, pin in conns:
-                comp.connections[pin] = net
-        
+        (component id, pin) pairs connected to the net, in file order
+        """
+        pins = self.pins
+        for node in range(self.net_offsets[net_id], self.net_offsets[net_id + 1]):
+            yield self.node_comp[node], pins[self.node_pin[node]]
+
+    @classmethod
+    def loadFromFile(cls, nl_file_path: str, encoding: Optional[str] = None) -> Any:
+
+        # Load time only indexes, dropped once the tables are packed.
+        # Strings stay undecoded bytes in the tables, they're decoded on access.
+        string_ids : dict[bytes, int] = {}
+        pin_ids : dict[bytes, int] = {}
+        comp_ids : dict[bytes, int] = {}
+        net_ids : dict[bytes, int] = {}
+
+        def intern(ids: dict[bytes, int], s: bytes) -> int:
+            i = ids.get(s, None)
+            if i is None:
+                i = ids[s] = len(ids)
+            return i
+
+        comp_footprint, comp_value = array('i'), array('i')
+
+        # Nodes in file order, sorted into CSR rows afterwards
+        # (a net is usually contiguous, but nothing in the format guarantees it)
+        file_net, file_comp, file_pin = array('i'), array('i'), array('i')
+
+        encoding, tokens = read_protel(nl_file_path, encoding)
+        for line_no, kind, *fields in tokens:
+            if kind == 'component':
+                designator, footprint, value = fields
+                comp_id = comp_ids.get(designator, None)
+                if comp_id is None:
+                    comp_ids[designator] = len(comp_ids)
+                    comp_footprint.append(intern(string_ids, footprint))
+                    comp_value.append(intern(string_ids, value))
+                else:
+                    # Same as Netlist - the last definition wins
+                    comp_footprint[comp_id] = intern(string_ids, footprint)
+                    comp_value[comp_id] = intern(string_ids, value)
+            else:
+                net, nodes = fields
+                net_id = intern(net_ids, net)
+
+                for node_line_no, (designator, pin) in enumerate(nodes, line_no + 2):
+                    comp_id = comp_ids.get(designator, None)
+                    if comp_id is None:
+                        raise NetlistFormatError(
+                            nl_file_path, node_line_no,
+                            f'node references unknown component {decode_field(designator, encoding)}'
+                        )
+
+                    file_net.append(net_id)
+                    file_comp.append(comp_id)
+                    file_pin.append(intern(pin_ids, pin))
+
+        # Net CSR - counting sort of the file order nodes by net
+        net_offsets = cls._offsets(file_net, len(net_ids))
+        fill = array(net_offsets.typecode, net_offsets[:-1])
+        node_comp = cls._ids(len(comp_ids), len(file_net))
+        node_pin = cls._ids(len(pin_ids), len(file_net))
+        for net_id, comp_id, pin_id in zip(file_net, file_comp, file_pin):
+            node = fill[net_id]
+            fill[net_id] += 1
+            node_comp[node] = comp_id
+            node_pin[node] = pin_id
+        del file_net, file_comp, file_pin, fill
+
+        # Component CSR - counting sort of the nodes by component
+        comp_offsets = cls._offsets(node_comp, len(comp_ids))
+        fill = array(comp_offsets.typecode, comp_offsets[:-1])
+        comp_nodes = cls._ids(len(node_comp), len(node_comp))
+        for node, comp_id in enumerate(node_comp):
+            comp_nodes[fill[comp_id]] = node
+            fill[comp_id] += 1
+
+        # dicts preserve insertion order, which is the id order
         return cls(
-            comps = comps,
-            nets = nets
+            strings = EncodedStringTable(list(string_ids), encoding),
+            pins = EncodedStringTable(list(pin_ids), encoding),
+            designators = EncodedStringTable(list(comp_ids), encoding),
+            comp_footprint = comp_footprint,
+            comp_value = comp_value,
+            net_names = EncodedStringTable(list(net_ids), encoding),
+            net_offsets = net_offsets,
+            node_comp = node_comp,
+            node_pin = node_pin,
+            comp_offsets = comp_offsets,
+            comp_nodes = comp_nodes
         )
 
+    @staticmethod
+    def _ids(no_ids: int, length: int) -> array:
+        """
+        Zeroed array of given length, with the smallest item type able to hold no_ids ids
+        """
+        for typecode in 'BHIL':
+            if no_ids <= 1 << (8 * array(typecode).itemsize):
+                break
+        return array(typecode, bytes(array(typecode).itemsize * length))
+
+    @classmethod
+    def _offsets(cls, keys: array, no_rows: int) -> array:
+        """
+        CSR row offsets for the given per-node row keys
+        """
+        offsets = cls._ids(len(keys) + 1, no_rows + 1)
+        for key in keys:
+            offsets[key + 1] += 1
+        for row in range(no_rows):
+            offsets[row + 1] += offsets[row]
+        return offsets
+
+
+class CompactNetComponent:
+    """
+    NetComponent view into a CompactNetlist
+    """
+    __slots__ = ('netlist', 'comp_id', '_connections')
+
+    def __init__(self, netlist: CompactNetlist, comp_id: int) -> None:
+        self.netlist = netlist
+        self.comp_id = comp_id
+        self._connections = None
+
+    @property
+    def designator(self) -> str:
+        return self.netlist.designators[self.comp_id]
+
+    @property
+    def footprint(self) -> str:
+        return self.netlist.strings[self.netlist.comp_footprint[self.comp_id]]
+
+    @property
+    def value(self) -> str:
+        return self.netlist.strings[self.netlist.comp_value[self.comp_id]]
+
+    @property
+    def connections(self) -> dict[str, str]:
+        # pin to netlist (global label) map, built on first access
+        if self._connections is None:
+            self._connections = dict(self.netlist.comp_pins(self.comp_id))
+        return self._connections
+
+    def __reduce__(self):
+        # Pickled (eg. sent to a worker process) as a detached NetComponent,
+        # not together with the whole netlist
+        return (_detached_net_component, (self.designator, self.footprint, self.value, self.connections))
+
+
+def _detached_net_component(designator: str, footprint: str, value: str, connections: dict[str, str]) -> NetComponent:
+    net_comp = NetComponent(designator, footprint, value)
+    net_comp.connections = connections
+    return net_comp
+
+
+class _CompactComps(Mapping):
+    # designator -> CompactNetComponent view
+    def __init__(self, netlist: CompactNetlist) -> None:
+        self.netlist = netlist
+
+    def __getitem__(self, designator: str) -> CompactNetComponent:
+        return CompactNetComponent(self.netlist, self.netlist.designators.id(designator))
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.netlist.designators)
+
+    def __len__(self) -> int:
+        return len(self.netlist.designators)
+
+    def items(self):
+        # Avoid the per-key lookup of the Mapping mixin
+        netlist = self.netlist
+        return ((d, CompactNetComponent(netlist, i)) for i, d in enumerate(netlist.designators))
+
+
+class _CompactNets(Mapping):
+    # net -> [(CompactNetComponent, pin)] view
+    def __init__(self, netlist: CompactNetlist) -> None:
+        self.netlist = netlist
+
+    def __getitem__(self, net: str) -> list[(CompactNetComponent, str)]:
+        netlist = self.netlist
+        return [
+            (CompactNetComponent(netlist, comp_id), pin)
+            for comp_id, pin in netlist.net_nodes(netlist.net_names.id(net))
+        ]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.netlist.net_names)
+
+    def __len__(self) -> int:
+        return len(self.netlist.net_names)
+
+
+class NetlistFormatError(Exception):
+    """
+    Malformed section in a Protel netlist, reported with its line number
+    """
+    def __init__(self, nl_file_path: str, line_no: int, msg: str) -> None:
+        super().__init__(f'{nl_file_path}:{line_no}: {msg}')
+        self.line_no = line_no
+
+
+def decode_field(field: bytes, encoding: Optional[str] = None) -> str:
+    """
+    Netlist field as str - in the given encoding, or UTF-8 with the FALLBACK_ENCODING fallback
+    """
+    if encoding:
+        return field.decode(encoding, errors='replace' if encoding == FALLBACK_ENCODING else 'strict')
+    try:
+        return field.decode('utf-8')
+    except UnicodeDecodeError:
+        return field.decode(FALLBACK_ENCODING, errors='replace')
+
+
+class _DecodedFields(dict):
+    """
+    Undecoded field -> decoded field, decoding each distinct field on first lookup
+    """
+    def __init__(self, encoding: Optional[str] = None) -> None:
+        super().__init__()
+        self.encoding = encoding
+
+    def __missing__(self, field: bytes) -> str:
+        s = self[field] = decode_field(field, self.encoding)
+        return s
+
+
+def ascii_compatible(encoding: str) -> bool:
+    """
+    Whether ASCII text is encoded as is - netlists are tokenized as bytes, on ASCII
+    brackets, dashes and newlines (UTF-16 / UTF-32 netlists can't be read).
+    Raises LookupError for unknown encodings.
+    """
+    ascii = bytes(range(128))
+    return ascii.decode('ascii').encode(encoding) == ascii
+
+
+def netlist_encoding(encoding: str) -> str:
+    """
+    argparse type of netlist encoding options
+    """
+    try:
+        if ascii_compatible(encoding):
+            return encoding
+    except LookupError:
+        raise argparse.ArgumentTypeError(f'unknown encoding {encoding}')
+    raise argparse.ArgumentTypeError(f'{encoding} is not ASCII compatible, netlists must be in an ASCII compatible encoding (eg. UTF-8, cp1252)')
+
+
+def detect_encoding(buf: Union[bytes, mmap.mmap]) -> str:
+    """
+    Encoding of a netlist read without one - UTF-8 if the whole file is valid UTF-8,
+    FALLBACK_ENCODING otherwise. Decided once per file, so that all fields are decoded alike.
+    """
+    # ASCII chunks are skipped, the rest is validated from the first non-ASCII chunk
+    # (which starts at a character boundary)
+    decoder = None
+    try:
+        for start in range(0, len(buf), _DETECT_CHUNK):
+            chunk = buf[start:start + _DETECT_CHUNK]
+            if decoder is None:
+                if chunk.isascii():
+                    continue
+                decoder = codecs.getincrementaldecoder('utf-8')()
+            decoder.decode(chunk)
+        if decoder is not None:
+            decoder.decode(b'', final=True)
+    except UnicodeDecodeError:
+        return FALLBACK_ENCODING
+    return 'utf-8'
+
+
+def read_protel(nl_file_path: str, encoding: Optional[str] = None) -> tuple[str, Iterator[tuple]]:
+    """
+    (encoding, scan_protel() tokens) over a read-only memory map of the netlist file,
+    so that it is parsed without being read into (or decoded in) memory first.
+    Without an encoding, the encoding of the file is detected (detect_encoding()).
+    """
+    if encoding and not ascii_compatible(encoding):
+        raise NetlistFormatError(nl_file_path, 1, f'can\'t read {encoding} netlists, the encoding must be ASCII compatible')
+
+    # No context managers, let it fail fast
+    nl_fd = open(nl_file_path, mode='rb')
+    try:
+        buf = mmap.mmap(nl_fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:
+        # Empty files can't be mapped
+        buf = b''
+    nl_fd.close()
+
+    encoding = encoding or detect_encoding(buf)
+    return encoding, _scan_mapped(buf, nl_file_path, encoding)
+
+
+def _scan_mapped(buf: Union[bytes, mmap.mmap], nl_file_path: str, encoding: str) -> Iterator[tuple]:
+    # scan_protel(), unmapping the file once done
+    try:
+        yield from scan_protel(buf, nl_file_path, encoding)
+    finally:
+        if isinstance(buf, mmap.mmap):
+            buf.close()
+
+
+# One section, with the blank lines before it - component (designator, footprint, value)
+# or net (name, node lines). The same grammar as parse_protel() accepts.
+_SECTION_RE = re.compile(
+    rb'((?:[ \t]*\r?\n)*)(?:'
+    rb'\[\r?\n([^\r\n]*)\r?\n([^\r\n]*)\r?\n([^\r\n]*)\r?\n(?:[ \t]*\r?\n)*\]|'
+    rb'\(\r?\n([^\r\n]*)\r?\n((?:[^\r\n]*\r?\n)*?)\)'
+    rb')(?:\r?\n|\Z)'
+)
+_TRAILING_BLANK_RE = re.compile(rb'(?:[ \t]*\r?\n)*[ \t]*\Z')
+_NODE_RE = re.compile(rb'([^\r\n-]+)-([^\r\n]+)\r?\n')
+
+
+def scan_protel(buf: Union[bytes, mmap.mmap], nl_file_path: str = '<netlist>', encoding: Optional[str] = None) -> Iterator[tuple]:
+    """
+    Bytes level Standard Protel netlist tokenizer.
+
+    Matches each section with one regex instead of going through the file line by line,
+    and yields undecoded (bytes) fields
+        (line_no, 'component', designator, footprint, value)
+        (line_no, 'net', net, [(designator, pin)])
+    in file order. Node i of a net is on line line_no + 2 + i.
+    encoding is only used to report errors.
+
+    On a malformed section, the rest of the file is run through parse_protel() for the
+    error it reports, so that both tokenizers fail the same way.
+    """
+    pos = 0
+    line_no = 1
+    end = len(buf)
+    section_match = _SECTION_RE.match
+    find_nodes = _NODE_RE.findall
+
+    while pos < end:
+        m = section_match(buf, pos)
+        if m is None:
+            if _TRAILING_BLANK_RE.match(buf, pos):
+                return
+            break
+
+        blank, designator, footprint, value, net, body = m.groups()
+        section_line = line_no + blank.count(b'\n') if blank else line_no
+
+        if designator is not None:
+            yield (section_line, 'component', designator, footprint, value)
+            line_no += m.group().count(b'\n')
+        else:
+            nodes = find_nodes(body)
+            no_lines = body.count(b'\n')
+            if not nodes or len(nodes) != no_lines:
+                break
+            yield (section_line, 'net', net, nodes)
+            line_no = section_line + no_lines + 3
+
+        pos = m.end()
+
+    if pos >= end:
+        return
+
+    # Malformed from here on, have the line tokenizer find what's wrong
+    text = decode_field(buf[pos:], encoding) if encoding else buf[pos:].decode('utf-8', errors='replace')
+    for _ in parse_protel(io.StringIO(text), nl_file_path, line_no):
+        pass
+
+    # Shouldn't get here, unless the tokenizers disagree
+    raise NetlistFormatError(nl_file_path, line_no, 'malformed section')
+
+
+def parse_protel(nl_fd: Iterable[str], nl_file_path: Optional[str] = None, first_line_no: int = 1) -> Iterator[tuple]:
+    """
+    Line oriented Standard Protel netlist tokenizer.
+
+    Consumes the netlist line by line and yields
+        (line_no, 'component', designator, footprint, value)
+        (line_no, 'node', net, designator, pin)
+    in file order, so that the caller can build its representation in one pass.
+
+    Malformed sections raise NetlistFormatError pointing to the offending line.
+
+    The netlists are loaded with scan_protel(), this is the reference tokenizer
+    it falls back to for reporting errors.
+    """
+    # Path is only used for error reporting
+    if nl_file_path is None:
+        nl_file_path = getattr(nl_fd, 'name', '<netlist>')
+
+    section = None      # None, '[' or '('
+    section_line = 0    # line where the current section was opened
+    fields = []         # component fields collected so far
+    net = None          # current net name
+    no_nodes = 0        # nodes in current net
+
+    for line_no, line in enumerate(nl_fd, first_line_no):
+        line = line.rstrip('\r\n')
+
+        if section is None:
+            if line == '[' or line == '(':
+                section = line
+                section_line = line_no
+                fields = []
+                net = None
+                no_nodes = 0
+            elif line.strip():
+                raise NetlistFormatError(nl_file_path, line_no, f'unexpected {line!r} outside of a section')
+
+        elif section == '[':
+            """
+            The first section describes each component.
+            Each component description is enclosed in square brackets.
+
+            - The first line of the description is the component designator.
+
+            - The second line is the footprint that was assigned to that component (in the Part dialog box).
+            There must be a matching component pattern in the PCB design file, which must have pin numbers
+            that match the pin numbers of the component in the schematic.
+
+            - The third line is the information in the Part Type field.
+
+            The three fields are followed by (unused) blank lines.
+            """
+            if len(fields) < 3:
+                fields.append(line)
+            elif line == ']':
+                yield (section_line, 'component', *fields)
+                section = None
+            elif line.strip():
+                raise NetlistFormatError(nl_file_path, line_no, f'unexpected {line!r} in component {fields[0]}')
+
+        else:
+            """
+            - The second section describes each net. Each net is enclosed in rounded brackets.
+
+            - The first line is the name of the net. If the net has no net label then a name will be assigned
+            during netlist creation.
+
+            - The following lines show each node in the net. The component designator and pin number will
+            define each node (eg. U7-3, component U7, pin 3).
+            """
+            if net is None:
+                net = line
+            elif line == ')':
+                if not no_nodes:
+                    raise NetlistFormatError(nl_file_path, section_line, f'net {net} has no nodes')
+                section = None
+            else:
+                designator, sep, pin = line.partition('-')
+                if not sep or not designator or not pin:
+                    raise NetlistFormatError(nl_file_path, line_no, f'malformed node {line!r} in net {net}')
+                no_nodes += 1
+                yield (line_no, 'node', net, designator, pin)
+
+    if section is not None:
+        raise NetlistFormatError(nl_file_path, section_line, f'unterminated section {section!r}')
+
+
 if __name__ == '__main__':
     # Quick test if netlist loading works
 
@@ -104,10 +727,21 @@ if __name__ == '__main__':
         'nl_path',
         help='Existing netlist in Protel format'
     )
+    parser.add_argument(
+        '--compact',
+        help='Load into CompactNetlist',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--encoding',
+        help='Netlist file encoding, by default UTF-8 with a fallback to cp1252',
+        type=netlist_encoding,
+        default=None
+    )
 
     args = parser.parse_args(sys.argv[1:])
 
-    nl = Netlist.loadFromFile(args.nl_path)
+    nl = (CompactNetlist if args.compact else Netlist).loadFromFile(args.nl_path, args.encoding)
 
     # Dump out in abbreviated form
     num_2pin = 0
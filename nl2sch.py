@@ -3,14 +3,56 @@
 Netlist to (very shitty) KiCad schematic converter
 """
 
-from collections import defaultdict
 import sys
 import os
 import argparse
-from typing import DefaultDict
+import time
+import traceback
+import warnings
+from typing import Optional
+
+from net import Netlist, netlist_encoding
+from placer import PLACERS
+from instrument import Profiler
+from watch import InputWatcher
+from cache import CacheWarning, MatchCache, RenderCache, TemplateCache, user_cache_path, warn_cache_write
+from grouping import Grouping
+from cluster import DEFAULT_MAX_FANOUT, ClusterStats, auto_grouping
+from verify import verify_sch
+from pipeline import (
+    Conversion, ConversionError, ConversionOptions, TemplateLibrary,
+    list_templates, load_component_grouping, load_netlist
+)
+
+def file_key(path: str, *extra) -> tuple:
+    """
+    Identifies the file contents a parsed input was made from
+    """
+    st = os.stat(path)
+    return (path, st.st_size, st.st_mtime_ns) + extra
+
+
+class WarmState:
+    """
+    Parsed inputs, kept in memory between generate() runs in watch mode.
+
+    Inputs are reused while their file is unchanged, caches carry over the entries
+    used in the last run (as their on-disk versions do between runs).
+    """
+
+    def __init__(self) -> None:
+        self.netlist : Optional[tuple[tuple, Netlist]] = None                         # (file_key, netlist)
+        self.grouping : Optional[tuple[tuple, Grouping]] = None                       # (file_key, grouping)
+        self.auto_grouping : Optional[tuple[tuple, Grouping]] = None                  # (input keys, grouping + clusters)
+
+        self.template_cache : Optional[TemplateCache] = None
+        self.match_cache : Optional[MatchCache] = None
+
+
+def show_warning(message, category, filename, lineno, file=None, line=None) -> None:
+    # Pipeline warnings (cache.CacheWarning, ...) as WARN: lines, like the Issues
+    print(f'WARN: {message}')
 
-from net import Netlist
-from comp import MatchedSchComponent, Text, PlacedSchComponent, SchComponent
 
 def main(arguments):
 
@@ -33,9 +75,22 @@ def main(arguments):
     )
     parser.add_argument(
         '-cg', '--component-grouping',
-        help='XLS/ODS file that provides lists of netlist components to group together (to split schematic into sections)',
+        help='File that provides lists of netlist components to group together (to split schematic into sections) - '
+            'CSV/TSV (designator, group rows), JSON (group : [designators]) or XLS/ODS (sheet per group)',
         default=None
     )
+    parser.add_argument(
+        '--auto-grouping',
+        help='Group the components not in the component grouping (all of them, without one) by connectivity - '
+             'components sharing signal nets are clustered into a group each',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--auto-grouping-max-fanout',
+        help=f'Nets with more nodes (power, ground, ...) are ignored by --auto-grouping, default {DEFAULT_MAX_FANOUT}',
+        type=int,
+        default=DEFAULT_MAX_FANOUT
+    )
     parser.add_argument(
         '-ac', '--allow-missing-components',
         help='Skip NetComponent with no SchComponent matches',
@@ -46,6 +101,103 @@ def main(arguments):
         help='Allow SchComponents with missing pins',
         action='store_true'
     )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='Number of processes used to parse SchComponents and write sub-sheets (0 = number of CPUs)',
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        '--template-cache',
+        help='File to cache parsed SchComponents in, defaults to a file per component_root in the user cache directory ($XDG_CACHE_HOME/nl2sch)',
+        default=None
+    )
+    parser.add_argument(
+        '--no-template-cache',
+        help='Always parse all SchComponents, don\'t read or write the template cache',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--no-grouping-cache',
+        help='Always read XLS/ODS component groupings, don\'t read or write their compiled grouping caches',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--sym-lib-table',
+        help='sym-lib-table resolving the library nicknames of symbols not embedded in templates (lib:name lib_id), '
+             'can be given multiple times. Libraries in component_root are found by file name, '
+             'and a sym-lib-table in component_root is used as well',
+        action='append',
+        default=[]
+    )
+    parser.add_argument(
+        '--no-symbol-index-cache',
+        help='Always scan symbol libraries, don\'t read or write their symbol index caches',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--match-cache',
+        help='File to persist SchComponent match results in between runs (invalidated when SchComponents change)',
+        default=None
+    )
+    parser.add_argument(
+        '--deterministic',
+        help='Derive symbol uuids from designators, so that same inputs produce the same schematic',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--render-cache',
+        help='File to cache rendered components in between runs, only changed components are re-rendered (implies --deterministic). '
+             'Rendered components are kept on disk, in <file>.blocks',
+        default=None
+    )
+    parser.add_argument(
+        '--netlist-backend',
+        help='In-memory netlist representation, compact interns strings and keeps connectivity in CSR arrays (for large netlists)',
+        choices=['dict', 'compact'],
+        default='dict'
+    )
+    parser.add_argument(
+        '--netlist-encoding',
+        help='Netlist file encoding, by default UTF-8 with a fallback to cp1252 (Altium exports in the Windows code page) for netlists which aren\'t valid UTF-8',
+        type=netlist_encoding,
+        default=None
+    )
+    parser.add_argument(
+        '--hierarchical',
+        help='Write one sub-sheet per component group (<kicad_sch_path stem>_<group>.kicad_sch), referenced from kicad_sch_path',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--compact',
+        help='Mark pins of single node nets (nothing to connect to) with no_connect flags instead of global labels',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--compact-local-labels',
+        help='Compact output (see --compact), also connecting two node nets with local instead of global labels '
+             '(with --hierarchical, only nets within a sub-sheet)',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--placer',
+        help='Placement engine, rows is the original greedy row placement, skyline packs components without overlaps (smaller sheets)',
+        choices=list(PLACERS.keys()),
+        default='rows'
+    )
+    parser.add_argument(
+        '--profile',
+        help='Print time, CPU, peak RSS and object counts of each phase, write a Chrome trace-event JSON (defaults to <kicad_sch_path stem>.trace.json)',
+        nargs='?',
+        const='',
+        default=None,
+        metavar='TRACE_JSON'
+    )
+    parser.add_argument(
+        '--verify',
+        help='Read the written schematic back and check its connectivity against the netlist, exit with 1 on mismatches',
+        action='store_true'
+    )
     parser.add_argument(
         '--width',
         help='Maximum width of a component group in schematic',
@@ -59,220 +211,290 @@ def main(arguments):
         default=7
     )
 
+    parser.add_argument(
+        '--watch',
+        help='Keep running, regenerate the schematic whenever the netlist, component grouping or a SchComponent changes. '
+            'Parsed inputs are kept in memory, only changed inputs are parsed again',
+        action='store_true'
+    )
+    parser.add_argument(
+        '--watch-interval',
+        help='Input poll interval of --watch in seconds',
+        type=float,
+        default=0.5
+    )
+
     args = parser.parse_args(arguments)
+    warnings.showwarning = show_warning
+    warnings.simplefilter('always', CacheWarning)
 
-    # Load netlist (get NetComponents)
-    netlist : Netlist = Netlist.loadFromFile(args.netlist_path)
-    print(f'Netlist parsed, {len(netlist.comps)} components, {len(netlist.nets)} nets')
+    if args.jobs < 1:
+        args.jobs = os.cpu_count() or 1
 
-    # Load netlist grouping, if available
-    net_comp_grouping = {}
-    net_comp_grouping_order = []
+    if not args.watch:
+        return generate(args)
 
-    if args.component_grouping:
-        import pyexcel
-        net_comp_grouping_list = pyexcel.get_book(file_name=args.component_grouping).to_dict()
-
-        # Ignore Info sheet, if it exists
-        if net_comp_grouping_list.get('Info', None):
-            del net_comp_grouping_list['Info']
-        
-        # Get order of groups, we will use same order for dumping into schematic
-        net_comp_grouping_order = list(net_comp_grouping_list.keys())
-
-        # Create net component designator -> group map
-        net_comp_grouping_list = [
-            tuple_list_item
-            for tuple_list in
-            [
-                [(net_comp_d[0], group) for net_comp_d in net_comp_list if len(net_comp_d[0])]
-                for group, net_comp_list in net_comp_grouping_list.items()
-            ]
-            for tuple_list_item in tuple_list
-        ]
+    return watch(args)
 
-        # We could just pass the list to the dict constructor but
-        # do a sanity check if there are any duplicates between sheets
-        for net_comp_grouping_comp in net_comp_grouping_list:
-            if net_comp_grouping_comp[0] in net_comp_grouping:
-                print(f'ERROR: component {net_comp_grouping_comp} was already defined in {net_comp_grouping[net_comp_grouping_comp[0]]}')
-                sys.exit(1)
-            net_comp_grouping[net_comp_grouping_comp[0]] = net_comp_grouping_comp[1]
 
-    
-    # Split netlist components into groups based on net_comp_grouping
-    unknown_key = 'Unknown / Unsorted'
+def generate(args: argparse.Namespace, warm: Optional[WarmState] = None) -> int:
+    """
+    Generate the schematic, returns the exit code.
+
+    warm keeps parsed inputs between calls (watch mode), unchanged inputs are reused from it.
+    """
+    try:
+        return convert(args, warm)
+    except ConversionError as e:
+        for issue in e.issues:
+            print(issue)
+        return 1
+
 
-    net_comps_grouped = DefaultDict(list)
-    for net_comp_d, net_comp in netlist.comps.items():
-        net_comps_grouped[net_comp_grouping.get(net_comp_d, unknown_key)].append(net_comp)
+def convert(args: argparse.Namespace, warm: Optional[WarmState] = None) -> int:
+    """
+    generate(), through the pipeline stages - prints the progress + results of each
+    """
+    profiler = Profiler(enabled=args.profile is not None)
 
-    if unknown_key in net_comps_grouped:
-        net_comp_grouping_order.append(unknown_key)
+    # Load netlist (get NetComponents)
+    profiler.begin('parse')
+    netlist_key = file_key(args.netlist_path, args.netlist_backend, args.netlist_encoding) if warm else None
+    if warm and warm.netlist and warm.netlist[0] == netlist_key:
+        netlist = warm.netlist[1]
+        print(f'Netlist unchanged, {len(netlist.comps)} components, {len(netlist.nets)} nets')
+    else:
+        netlist = load_netlist(args.netlist_path, args.netlist_backend, args.netlist_encoding)
+        print(f'Netlist parsed, {len(netlist.comps)} components, {len(netlist.nets)} nets')
+        if warm:
+            warm.netlist = (netlist_key, netlist)
+
+    # Load netlist grouping, if available
+    profiler.begin('group')
+    grouping = None
+    grouping_key = None
+
+    if args.component_grouping:
+        grouping_key = file_key(args.component_grouping) if warm else None
+        if warm and warm.grouping and warm.grouping[0] == grouping_key:
+            grouping = warm.grouping[1]
+        else:
+            grouping = load_component_grouping(args.component_grouping, not args.no_grouping_cache)
+            if warm:
+                warm.grouping = (grouping_key, grouping)
+
+    # Cluster the ungrouped components
+    if args.auto_grouping:
+        auto_grouping_key = (netlist_key, grouping_key, args.auto_grouping_max_fanout)
+        if warm and warm.auto_grouping and warm.auto_grouping[0] == auto_grouping_key:
+            grouping = warm.auto_grouping[1]
+        else:
+            start = time.perf_counter()
+            cluster_stats = ClusterStats()
+            grouping = auto_grouping(netlist, grouping, args.auto_grouping_max_fanout, stats=cluster_stats)
+            print(
+                f'Auto grouping: {cluster_stats.clusters} clusters, {cluster_stats.ungrouped} components left ungrouped, '
+                f'{len(cluster_stats.excluded_nets)} nets over {args.auto_grouping_max_fanout} nodes ignored, '
+                f'{cluster_stats.iterations} passes in {time.perf_counter() - start:.2f} s'
+            )
+            if warm:
+                warm.auto_grouping = (auto_grouping_key, grouping)
 
     # Load SchComponents
-    sch_comp_files = sorted([
-        os.path.join(dirpath, file)
-        for dirpath, dirname, files in os.walk(args.component_root)
-        for file in files if file.endswith('.kicad_sch')
-    ])
-    print(f'Found {len(sch_comp_files)} SchComponents, parsing...')
-    sch_comps : list[SchComponent] = []
-    for sch_comp_file in sch_comp_files:
-        print(f'  {sch_comp_file} : ', end='')
+    profiler.begin('load templates')
+    print(f'Found {len(list_templates(args.component_root))} SchComponents, parsing...')
+
+    # Unchanged SchComponents are loaded from the template cache
+    template_cache = None
+    template_cache_path = args.template_cache or user_cache_path(args.component_root, 'templates')
+    if warm and warm.template_cache:
+        # Templates of the last run, kept in memory
+        template_cache = TemplateCache(warm.template_cache.used)
+    elif not args.no_template_cache:
+        template_cache = TemplateCache.loadFromFile(template_cache_path)
+    elif warm:
+        template_cache = TemplateCache()
+
+    library = TemplateLibrary.load(
+        args.component_root,
+        template_cache,
+        args.jobs,
+        args.sym_lib_table,
+        not args.no_symbol_index_cache
+    )
+    for sch_comp_file, sch_comp in zip(library.sch_comp_files, library.sch_comps):
+        print(f'  {sch_comp_file} : {sch_comp}')
+
+    if template_cache:
+        print(f'Template cache: {template_cache.hits} cached, {template_cache.misses} parsed.')
+    if template_cache and not args.no_template_cache:
         try:
-            comp = SchComponent.loadFromFile(sch_comp_file)
-            print(comp)
-            sch_comps.append(comp)
-        except Exception as e:
-            print('FAILED\n')
-            raise e
+            template_cache.saveToFile(template_cache_path)
+        except OSError as e:
+            warn_cache_write('template cache', e)
+    if warm:
+        warm.template_cache = template_cache
 
 
     # Phase 1 - match & collect
-    no_skipped = 0
-    no_missing_pins = 0
-
-    # Map of netlist component group / schematic section ->
-    #   (Map of schematic component template -> netlist component instances)
-    #
-    # TODO - possibly rework the data structures
-    #
-    used_symbols : set[SchComponent] = set()
-    all_matched_comps : dict[str, dict[SchComponent, list[MatchedSchComponent]]] = {}
-
-    for group_name, net_comps in net_comps_grouped.items():
-        group = all_matched_comps[group_name] = DefaultDict(list)
-        
-        for net_comp in net_comps:
-            net_comp_str = f'[{net_comp.designator} {net_comp.footprint} {net_comp.value}]'
-
-            # Find first SchComponent that can match the D, F, V of net_comp
-            for sch_comp in sch_comps:
-                match = sch_comp.match(net_comp)
-                if match:
-
-                    # Check if the matched SchComponent has all pins referenced by the netlist
-                    for net_pin in match.net_comp.connections.keys():
-                        if net_pin not in sch_comp.label_tpls:
-                            msg = (
-                                f'{match.sch_comp.symbol_lib_name} ' +
-                                f'is missing pin {net_pin} for instance {match.net_comp.designator}'
-                            )
-                            if args.allow_missing_pins:
-                                print(f'WARN: {msg}')
-                                no_missing_pins += 1
-                            else:
-                                print(f'ERROR: {msg}')
-                                sys.exit(1)
-
-                    used_symbols.add(sch_comp)
-                    group[sch_comp].append(match)
-                    break
-            else:
-                # We didn't match any sch_comp
-                if args.allow_missing_components:
-                    print(f'WARN: SKIPPING {net_comp_str}')
-                    no_skipped += 1
-                else:
-                    print(f'ERROR: {net_comp_str} could not be mapped to any SchComponent')
-                    sys.exit(1)
+    profiler.begin('match')
+
+    # Repeated parts (same footprint + value, designator matched by same rules) reuse the match
+    matcher = library.matcher.fork()
+    if warm and warm.match_cache and warm.match_cache.fingerprint == library.fingerprint:
+        # Templates unchanged since the last run, so are the rule indices
+        match_cache = MatchCache(matcher, library.fingerprint, warm.match_cache.entries)
+    elif args.match_cache:
+        match_cache = MatchCache.loadFromFile(args.match_cache, matcher, library.fingerprint)
+    else:
+        match_cache = MatchCache(matcher, library.fingerprint)
+    if warm:
+        warm.match_cache = match_cache
+
+    # Rendered blocks stay on disk, so the render cache is loaded again in watch mode too
+    # (only its index is read)
+    render_cache = None
+    if args.render_cache:
+        render_cache = RenderCache.loadFromFile(args.render_cache)
+
+    options = ConversionOptions(
+        allow_missing_components = args.allow_missing_components,
+        allow_missing_pins = args.allow_missing_pins,
+        placer = args.placer,
+        width = args.width,
+        spacing = args.spacing,
+        deterministic = args.deterministic,
+        hierarchical = args.hierarchical,
+        jobs = args.jobs,
+        compact = args.compact or args.compact_local_labels,
+        local_labels = args.compact_local_labels
+    )
+    conversion = Conversion(library, netlist, grouping, options, match_cache, render_cache, profiler)
+    stats = conversion.stats
 
-    if args.allow_missing_components:
-        print(f'Skipped {no_skipped} netlist components.')
-    
-    if args.allow_missing_pins:
-        print(f'Found {no_missing_pins} missing pins.')
-    
-    # Phase 2 - place
-    
-    all_placed_comps : list[PlacedSchComponent] = []
+    for _ in conversion.match():
+        pass
 
-    x, y = 0,0
-    max_x = 0
+    for issue in conversion.issues:
+        print(issue)
 
-    # Dump the groups in order specified in component_grouping
-    for group_name in net_comp_grouping_order:
+    print(f'Matched {stats.matched} netlist components, {stats.rule_evaluations} rule evaluations, {stats.regex_evaluations} regex evaluations.')
 
-        # Place text describing the group
-        x = 0
-        all_placed_comps.append(Text(group_name).place((x,y)))
-        y += args.spacing
+    if args.allow_missing_components:
+        print(f'Skipped {len(stats.skipped)} netlist components.')
+    print(f'Match cache: {stats.match_cache_hits} hits, {stats.match_cache_misses} misses.')
 
-        # Dump the components by descending pin count
-        group_comps = sorted(
-            all_matched_comps[group_name].items(),
-            key = lambda m : len(m[0].label_tpls),
-            reverse=True
-        )
-        for sch_comp, matched_comps in group_comps:
-            for matched_comp in matched_comps:
-
-                all_placed_comps.append(matched_comp.place((x,y)))
-
-                new_x = x + sch_comp.bounds[0]
-                new_y = y + sch_comp.bounds[1]
-
-                # If the next component would be outside specified bounds,
-                # we will place it in the next row
-                if new_x > args.width:
-                    x = 0
-                    y = new_y
-                else:
-                    # otherwise move within the row
-                    x = new_x
-                
-                # Expand schematic bounds, if necessary
-                if new_x > max_x:
-                    max_x = new_x
-
-            else:
-                if x:
-                    # If we're currently in a non-empty row, move into new row
-                    y = y + sch_comp.bounds[1]
-                x = 0
-                y += args.spacing
-        else:
-            # Spacing between groups
-            y += args.spacing*2
+    if args.match_cache:
+        try:
+            match_cache.saveToFile(args.match_cache)
+        except OSError as e:
+            warn_cache_write('match cache', e)
 
-    # Render placed components into KiCad schematic
+    if args.allow_missing_pins:
+        print(f'Found {stats.missing_pins} missing pins.')
 
-    print(f'Writing schematic to {args.kicad_sch_path}')
+    profiler.set_counter('netlist_components', stats.netlist_components)
+    profiler.set_counter('rule_evaluations', stats.rule_evaluations)
+    profiler.set_counter('regex_evaluations', stats.regex_evaluations)
+    profiler.set_counter('match_cache_hits', stats.match_cache_hits)
 
-    rendered_lib_symbol = '\n'.join([p.lib_symbol for p in used_symbols])
+    # Phase 2 - place & write
+    profiler.begin('place+render+write')
 
-    rendered_labels = '\n'.join([p.rendered_labels for p in all_placed_comps])
-    rendered_symbol = '\n'.join([p.rendered_symbol for p in all_placed_comps])
-    rendered_symbol_instance = '\n'.join([p.rendered_symbol_inst for p in all_placed_comps])
+    if args.hierarchical:
+        print(f'Writing hierarchical schematic to {args.kicad_sch_path}')
+        sheets = conversion.write(args.kicad_sch_path)
 
-    kicad_sch = open(args.kicad_sch_path, 'w')
-    kicad_sch.write(
-f'''
-(kicad_sch (version 20201015) (generator eeschema)
+        for sheet in sheets:
+            print(f'  {os.path.basename(sheet.kicad_sch_path)} : {sheet.no_comps} components, sheet {sheet.paper[0]:.1f} x {sheet.paper[1]:.1f} mm, fill ratio {sheet.fill_ratio:.1%}')
+        print(f'Wrote root sheet + {len(sheets)} sub-sheets, {stats.bytes_written} bytes.')
+    else:
+        print(f'Writing schematic to {args.kicad_sch_path}')
+        sheet, = conversion.write(args.kicad_sch_path)
 
-  (paper "User" {max_x} {y})
+        print(f'Sheet {sheet.paper[0]:.1f} x {sheet.paper[1]:.1f} mm, {sheet.paper[0] * sheet.paper[1] / 1e6:.3f} m^2, fill ratio {sheet.fill_ratio:.1%}')
 
-  (lib_symbols
-{rendered_lib_symbol}
-  )
+    if options.compact:
+        print(
+            f'Compact output: {stats.no_connects} no_connect flags, {stats.local_labels} local labels instead of global labels, '
+            f'{stats.compact_bytes_saved} bytes saved ({stats.compact_bytes_saved / (stats.bytes_written + stats.compact_bytes_saved):.1%}).'
+        )
 
-{rendered_labels}
-{rendered_symbol}
+    if render_cache:
+        print(f'Render cache: {render_cache.reused} reused, {render_cache.rendered} rendered.')
+        try:
+            render_cache.saveToFile()
+        except OSError as e:
+            warn_cache_write('render cache', e)
+
+    # Round trip check - symbol pins are mapped to netlist pins through the templates' labels
+    verified = True
+    if args.verify:
+        profiler.begin('verify')
+        verified = verify_sch(netlist, args.kicad_sch_path, conversion.pin_maps(), stats.skipped)
+
+    profiler.end()
+    if profiler.enabled:
+        print(f'\n{profiler.summary()}\n')
+        trace_path = args.profile or f'{os.path.splitext(args.kicad_sch_path)[0]}.trace.json'
+        profiler.write_trace(trace_path)
+        print(f'Trace written to {trace_path}')
 
-  (sheet_instances
-    (path "/" (page ""))
-  )
+    print("Done.")
+    return 0 if verified else 1
+
+def watch(args: argparse.Namespace) -> int:
+    """
+    Generate the schematic, then regenerate it on every input change until interrupted
+    """
+    def lib_inputs() -> list[str]:
+        # Libraries outside component_root, that templates were resolved from
+        if not warm.template_cache:
+            return []
+        return [
+            lib_path
+            for entry in warm.template_cache.used.values()
+            for lib_path in entry[3].lib_sources
+        ]
 
-  (symbol_instances
-{rendered_symbol_instance}
-  )
-)
-'''
-    )
-    kicad_sch.close()
+    def list_inputs() -> list[str]:
+        inputs = [args.netlist_path]
+        if args.component_grouping:
+            inputs.append(args.component_grouping)
+        inputs.extend(
+            os.path.join(dirpath, file)
+            for dirpath, dirname, files in os.walk(args.component_root)
+            for file in files if file.endswith(('.kicad_sch', '.kicad_sym')) or file == 'sym-lib-table'
+        )
+        inputs.extend(args.sym_lib_table)
+        inputs.extend(lib_inputs())
+        return inputs
+
+    warm = WarmState()
+
+    # Snapshot the inputs before the first run, so that changes made while it runs aren't missed
+    watcher = InputWatcher(list_inputs, args.watch_interval)
+
+    try:
+        while True:
+            start = time.perf_counter()
+            # Keep watching on errors, the input will likely be fixed next
+            try:
+                exit_code = generate(args, warm)
+            except SystemExit as e:
+                exit_code = e.code
+            except Exception:
+                traceback.print_exc()
+                exit_code = 1
+            print(f'Generated in {time.perf_counter() - start:.2f} s{"" if not exit_code else " (FAILED)"}, watching for changes...')
+
+            watcher.track(lib_inputs())
+
+            changed = watcher.wait()
+            print(f'\nChanged: {", ".join(sorted(changed))}')
+    except KeyboardInterrupt:
+        return 0
 
-    print("Done.")
 
 if __name__ == '__main__':
     sys.exit(main(sys.argv[1:]))
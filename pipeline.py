@@ -0,0 +1,725 @@
+"""
+Netlist to schematic conversion pipeline
+
+The stages behind nl2sch.py, usable as a library - e.g. by a service converting
+many boards in one process
+
+    library = TemplateLibrary.load('./ebaz4205/components/')
+    netlist = load_netlist('./ebaz4205/ebit_ad.Net')
+
+    conversion = Conversion(library, netlist, options=ConversionOptions(allow_missing_pins=True))
+    result = conversion.run('./ebaz4205.kicad_sch')
+
+or stage by stage - match() yields the matched groups, place() / render() stream
+the placements of a group, write() consumes them into the schematic file.
+
+Nothing is printed and nothing exits - problems are collected as Issues, and the
+stages raise ConversionError (carrying the Issues) when the conversion can't go on.
+Cache write failures (grouping, symbol index caches) don't stop a stage, they are
+issued as cache.CacheWarning warnings (see the warnings module).
+
+A TemplateLibrary is not modified once loaded, so one instance can be shared by
+conversions running in threads. Everything a conversion changes (matcher statistics,
+caches, placers, counters) belongs to its Conversion.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import repeat
+import os
+import re
+import uuid
+from typing import Any, Callable, DefaultDict, Iterable, Iterator, Optional, Union
+
+from net import CompactNetlist, Netlist, NetlistFormatError
+from comp import LOCAL_LABEL, NO_CONNECT, MatchedSchComponent, PlacedSchComponent, Text, SchComponent, UUID_NAMESPACE
+from writer import SchWriter, SchWriterError
+from placer import PLACERS, Placer
+from instrument import Profiler
+from match import SchComponentMatcher
+from cache import MatchCache, RenderCache, TemplateCache, files_fingerprint
+from grouping import Grouping, GroupingFormatError, load_grouping
+from cluster import connectivity
+from verify import Mismatch, read_sch_connectivity, template_pin_map, verify
+from symlib import SymbolLibraries, SymbolLibraryError
+
+# Group of netlist components without a group in the component grouping
+UNKNOWN_GROUP = 'Unknown / Unsorted'
+
+Placeable = Union[Text, MatchedSchComponent]
+
+# Matched components of a group, by template (in order of first match)
+MatchedGroup = dict[SchComponent, list[MatchedSchComponent]]
+
+
+@dataclass
+class Issue:
+    """
+    Problem found by a pipeline stage
+    """
+    stage       : str                   # netlist, grouping, templates, match, write
+    kind        : str                   # eg. missing_component, missing_pin, format, io
+    message     : str
+    designator  : Optional[str] = None  # netlist component concerned, if any
+    fatal       : bool = False          # conversion can't go on (otherwise a warning)
+
+    def __str__(self) -> str:
+        return f'{"ERROR" if self.fatal else "WARN"}: {self.message}'
+
+
+class ConversionError(Exception):
+    """
+    Raised by a stage that can't go on, issues are all the issues of the stage
+    (warnings included), in the order they were found
+    """
+    def __init__(self, issues: list[Issue]) -> None:
+        super().__init__('\n'.join(str(issue) for issue in issues if issue.fatal))
+        self.issues = issues
+
+
+@dataclass
+class ConversionOptions:
+
+    allow_missing_components    : bool = False      # Skip netlist components no template matches
+    allow_missing_pins          : bool = False      # Allow templates without some of the netlist pins
+    placer                      : str = 'rows'      # PLACERS entry
+    width                       : int = 450         # Maximum width of a component group
+    spacing                     : int = 7           # Spacing between groups
+    deterministic               : bool = False      # uuids derived from designators
+    hierarchical                : bool = False      # Sub-sheet per component group
+    jobs                        : int = 1           # Processes writing sub-sheets
+    compact                     : bool = False      # no_connect flags instead of labels on single node nets
+    local_labels                : bool = False      # (compact) local labels on two node nets within a sheet
+
+
+@dataclass
+class ConversionStats:
+    """
+    Counters of one conversion
+    """
+    netlist_components  : int = 0
+    matched             : int = 0
+    skipped             : list[str] = field(default_factory=list)   # designators without a template
+    missing_pins        : int = 0
+    rule_evaluations    : int = 0
+    regex_evaluations   : int = 0
+    match_cache_hits    : int = 0
+    match_cache_misses  : int = 0
+    place_calls         : int = 0                                   # components rendered (not taken from the render cache)
+    bytes_written       : int = 0
+    no_connects         : int = 0                                   # compact output - global labels replaced by no_connect flags
+    local_labels        : int = 0                                   # compact output - global labels replaced by local labels
+    compact_bytes_saved : int = 0                                   # compact output - bytes less than with global labels
+
+
+@dataclass
+class SheetResult:
+    """
+    Written schematic sheet
+    """
+    kicad_sch_path  : str
+    group_name      : Optional[str]     # None for the sheet with all groups
+    no_comps        : int
+    paper           : tuple[float, float]
+    fill_ratio      : float
+    bytes_written   : int
+
+
+@dataclass
+class ConversionResult:
+
+    kicad_sch_path  : str
+    sheets          : list[SheetResult]     # sub-sheets of a hierarchical schematic, or the one sheet
+    stats           : ConversionStats
+    issues          : list[Issue]           # warnings
+    verified        : Optional[bool] = None # None if not verified
+
+
+def load_netlist(nl_file_path: str, backend: str = 'dict', encoding: Optional[str] = None) -> Netlist:
+    """
+    Netlist stage - backend is dict (Netlist) or compact (CompactNetlist)
+    """
+    netlist_cls = CompactNetlist if backend == 'compact' else Netlist
+    try:
+        return netlist_cls.loadFromFile(nl_file_path, encoding)
+    except NetlistFormatError as e:
+        raise ConversionError([Issue('netlist', 'format', str(e), fatal=True)]) from e
+    except OSError as e:
+        raise ConversionError([Issue('netlist', 'io', str(e), fatal=True)]) from e
+
+
+def compact_nets(
+    netlist         : Netlist,
+    local_labels    : bool = False,
+    comp_sheet      : Optional[Callable[[str], str]] = None    # designator -> sheet, all in one sheet if None
+) -> dict[str, int]:
+    """
+    Nets which need no global label - net -> NO_CONNECT for single node nets, and
+    LOCAL_LABEL for two node nets with both nodes in the same sheet (if local_labels)
+    """
+    designators, net_names, net_offsets, node_comp = connectivity(netlist)
+
+    nets = {}
+    for net_id in range(len(net_offsets) - 1):
+        start = net_offsets[net_id]
+        fanout = net_offsets[net_id + 1] - start
+        if fanout == 1:
+            nets[net_names[net_id]] = NO_CONNECT
+        elif fanout == 2 and local_labels and (
+            comp_sheet is None or
+            comp_sheet(designators[node_comp[start]]) == comp_sheet(designators[node_comp[start + 1]])
+        ):
+            nets[net_names[net_id]] = LOCAL_LABEL
+
+    return nets
+
+
+def load_component_grouping(grouping_path: str, use_cache: bool = True) -> Grouping:
+    """
+    Grouping stage, see grouping.load_grouping()
+    """
+    try:
+        return load_grouping(grouping_path, use_cache)
+    except GroupingFormatError as e:
+        raise ConversionError([Issue('grouping', 'format', str(e), fatal=True)]) from e
+    except OSError as e:
+        raise ConversionError([Issue('grouping', 'io', str(e), fatal=True)]) from e
+
+
+def list_templates(component_root: str) -> list[str]:
+    """
+    SchComponent files under component_root, in rule priority order
+    """
+    return sorted([
+        os.path.join(dirpath, file)
+        for dirpath, dirname, files in os.walk(component_root)
+        for file in files if file.endswith('.kicad_sch')
+    ])
+
+
+def parse_sch_comp(sch_comp_file: str, symbol_libs: Optional[SymbolLibraries] = None) -> Union[tuple, Exception]:
+    """
+    Template cache entry for the SchComponent file, or the exception raised while parsing it
+    (returned, so that a worker process failure can be reported with its path)
+    """
+    try:
+        return TemplateCache.parse(sch_comp_file, symbol_libs)
+    except Exception as e:
+        return e
+
+
+def load_sch_comps(
+    sch_comp_files  : list[str],
+    template_cache  : Optional[TemplateCache],
+    jobs            : int,
+    symbol_libs     : Optional[SymbolLibraries] = None  # Resolves symbols not embedded in templates
+) -> list[SchComponent]:
+    """
+    Load SchComponents in sch_comp_files order (which is the rule priority).
+
+    Templates not in the template cache are parsed, in a pool of worker processes if jobs > 1.
+    """
+    sch_comps : list[Optional[SchComponent]] = [
+        template_cache.lookup(sch_comp_file) if template_cache else None
+        for sch_comp_file in sch_comp_files
+    ]
+    to_parse = [sch_comp_file for sch_comp_file, comp in zip(sch_comp_files, sch_comps) if comp is None]
+
+    if jobs > 1 and len(to_parse) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            parsed = iter(list(executor.map(
+                parse_sch_comp, to_parse, repeat(symbol_libs),
+                chunksize=max(1, len(to_parse) // (4 * jobs))
+            )))
+    else:
+        parsed = map(parse_sch_comp, to_parse, repeat(symbol_libs))
+
+    for i, sch_comp_file in enumerate(sch_comp_files):
+        if sch_comps[i] is None:
+            entry = next(parsed)
+            if isinstance(entry, Exception):
+                raise ConversionError([Issue('templates', 'template', f'{sch_comp_file}: {entry}', fatal=True)]) from entry
+            sch_comps[i] = template_cache.store(sch_comp_file, entry) if template_cache else entry[3]
+
+    return sch_comps
+
+
+class TemplateLibrary:
+    """
+    Loaded SchComponents (templates) + their rule matcher.
+
+    Read-only once loaded - conversions fork the matcher (which keeps statistics),
+    so that a library can be shared by conversions in threads.
+    """
+
+    def __init__(
+        self,
+
+        sch_comp_files  : list[str],            # Template files, in rule priority order
+        sch_comps       : list[SchComponent],   # Templates, in sch_comp_files order
+        fingerprint     : str = ''              # Fingerprint of the template files, keys match caches
+    ) -> None:
+        self.sch_comp_files = sch_comp_files
+        self.sch_comps = sch_comps
+        self.fingerprint = fingerprint
+
+        self.matcher = SchComponentMatcher(sch_comps)
+
+    @classmethod
+    def load(
+        cls,
+        component_root      : str,
+        template_cache      : Optional[TemplateCache] = None,
+        jobs                : int = 1,
+        sym_lib_tables      : Optional[list[str]] = None,   # see SymbolLibraries.fromComponentRoot
+        symbol_index_cache  : bool = True
+    ) -> Any:
+        """
+        Templates stage - load all templates under component_root
+        """
+        sch_comp_files = list_templates(component_root)
+
+        # Libraries are only indexed once a template needs one of their symbols
+        try:
+            symbol_libs = SymbolLibraries.fromComponentRoot(component_root, sym_lib_tables, symbol_index_cache)
+        except SymbolLibraryError as e:
+            raise ConversionError([Issue('templates', 'symbol_library', str(e), fatal=True)]) from e
+
+        sch_comps = load_sch_comps(sch_comp_files, template_cache, jobs, symbol_libs)
+
+        return cls(sch_comp_files, sch_comps, files_fingerprint(sch_comp_files))
+
+
+def write_sheet(job: tuple) -> tuple[str, int, list[tuple[int, tuple[str, str, str]]]]:
+    """
+    Render and write one sub-sheet, runs in a worker process.
+
+    job is (kicad_sch_path, lib_symbols, items, paper, deterministic, path_prefix, compact_nets),
+    items being (Text / MatchedSchComponent, pos, rendered) - rendered is the render
+    cache entry, or None if the component needs to be rendered.
+
+    Returns (symbol instances file, bytes written, [(item index, rendered)] of rendered components)
+    """
+    kicad_sch_path, lib_symbols, items, paper, deterministic, path_prefix, compact_nets = job
+
+    sch_writer = SchWriter(kicad_sch_path, lib_symbols, root=False)
+    rendered_items = []
+
+    try:
+        for i, (placeable, pos, rendered) in enumerate(items):
+            if isinstance(placeable, Text):
+                placed = placeable.place(pos)
+            elif rendered is not None:
+                placed = PlacedSchComponent(
+                    placeable,
+                    rendered_labels=rendered[0],
+                    rendered_symbol=rendered[1],
+                    rendered_symbol_inst=rendered[2],
+                    pos=pos
+                )
+            else:
+                placed = placeable.place(pos, deterministic=deterministic, path_prefix=path_prefix, compact_nets=compact_nets)
+                rendered_items.append((i, (placed.rendered_labels, placed.rendered_symbol, placed.rendered_symbol_inst)))
+            sch_writer.add(placed)
+
+        symbol_insts_path = sch_writer.close(paper)
+    except BaseException:
+        # Don't leave the symbol instances file behind
+        sch_writer.discard()
+        raise
+
+    return symbol_insts_path, sch_writer.bytes_written, rendered_items
+
+
+class Conversion:
+    """
+    Conversion of one netlist with a TemplateLibrary.
+
+    Stages are run in order - match(), then write() (which places and renders),
+    optionally verify(). run() does all of them.
+    """
+
+    def __init__(
+        self,
+
+        library         : TemplateLibrary,
+        netlist         : Netlist,
+        grouping        : Optional[Grouping] = None,            # (designator -> group, group order), see grouping.py
+        options         : Optional[ConversionOptions] = None,
+        match_cache     : Optional[MatchCache] = None,          # Defaults to an empty one, over a fork of the library matcher
+        render_cache    : Optional[RenderCache] = None,         # Cached rendered components (implies deterministic uuids)
+        profiler        : Optional[Profiler] = None             # Times the place / render / write sub-phases
+    ) -> None:
+        self.library = library
+        self.netlist = netlist
+        self.options = options if options is not None else ConversionOptions()
+        self.match_cache = match_cache if match_cache is not None else MatchCache(library.matcher.fork(), library.fingerprint)
+        self.render_cache = render_cache
+        self.profiler = profiler if profiler is not None else Profiler(enabled=False)
+
+        self.stats = ConversionStats(netlist_components=len(netlist.comps))
+        self.issues : list[Issue] = []
+
+        # Split netlist components into groups, the unknown group goes last
+        component_grouping, group_order = grouping if grouping is not None else ({}, [])
+
+        self.grouped : DefaultDict[str, list] = defaultdict(list)
+        for designator, net_comp in netlist.comps.items():
+            self.grouped[component_grouping.get(designator, UNKNOWN_GROUP)].append(net_comp)
+
+        # Grouping entries the netlist doesn't have (eg. a grouping of another board revision)
+        # are reported, groups left without components are dropped
+        for designator, group_name in component_grouping.items():
+            if designator not in netlist.comps:
+                self._issue(Issue('grouping', 'unknown_component', f'component {designator} of group {group_name} is not in the netlist', designator))
+
+        self.group_order = [group_name for group_name in group_order if group_name in self.grouped]
+        if UNKNOWN_GROUP in self.grouped:
+            self.group_order.append(UNKNOWN_GROUP)
+
+        # Compact output - nets which get no global label. Local labels only connect
+        # within a sheet, so both nodes must be in the same group for sub-sheets.
+        self.compact_nets : dict[str, int] = {}
+        if self.options.compact:
+            self.compact_nets = compact_nets(
+                netlist,
+                self.options.local_labels,
+                (lambda designator: component_grouping.get(designator, UNKNOWN_GROUP)) if self.options.hierarchical else None
+            )
+
+        # Filled by match()
+        self.matched : dict[str, MatchedGroup] = {}
+        self.used_symbols : dict[SchComponent, None] = {}   # in order of first use, keeps lib_symbols order stable
+
+    def _issue(self, issue: Issue) -> None:
+        self.issues.append(issue)
+
+    def match(self) -> Iterator[tuple[str, MatchedGroup]]:
+        """
+        Match stage - yields (group name, matched components) of each group once matched.
+        Raises ConversionError after the last group if a component could not be matched.
+        """
+        options = self.options
+        stats = self.stats
+
+        for group_name, net_comps in self.grouped.items():
+            group = self.matched[group_name] = defaultdict(list)
+
+            for net_comp in net_comps:
+                net_comp_str = f'[{net_comp.designator} {net_comp.footprint} {net_comp.value}]'
+
+                # Find first SchComponent that can match the D, F, V of net_comp
+                match = self.match_cache.match(net_comp)
+                if not match:
+                    if options.allow_missing_components:
+                        self._issue(Issue('match', 'missing_component', f'SKIPPING {net_comp_str}', net_comp.designator))
+                        stats.skipped.append(net_comp.designator)
+                    else:
+                        self._issue(Issue('match', 'missing_component', f'{net_comp_str} could not be mapped to any SchComponent', net_comp.designator, fatal=True))
+                    continue
+
+                sch_comp = match.sch_comp
+
+                # Check if the matched SchComponent has all pins referenced by the netlist
+                for net_pin in net_comp.connections.keys():
+                    if net_pin not in sch_comp.label_tpls:
+                        msg = f'{sch_comp.symbol_lib_name} is missing pin {net_pin} for instance {net_comp.designator}'
+                        self._issue(Issue('match', 'missing_pin', msg, net_comp.designator, fatal=not options.allow_missing_pins))
+                        stats.missing_pins += 1
+
+                self.used_symbols[sch_comp] = None
+                group[sch_comp].append(match)
+
+            yield group_name, group
+
+        matcher = self.match_cache.matcher
+        stats.matched = stats.netlist_components - len(stats.skipped)
+        stats.rule_evaluations = matcher.rule_evaluations
+        stats.regex_evaluations = matcher.regex_evaluations
+        stats.match_cache_hits = self.match_cache.hits
+        stats.match_cache_misses = self.match_cache.misses
+
+        if any(issue.fatal for issue in self.issues):
+            raise ConversionError(self.issues)
+
+    def new_placer(self) -> Placer:
+        return PLACERS[self.options.placer](self.options.width, self.options.spacing)
+
+    def place(self, group_name: str, placer: Placer) -> Iterator[tuple[Placeable, tuple[float, float]]]:
+        """
+        Place stage - streams the (component / group title, position) placements of a matched group
+        """
+        return self.profiler.iter('place', placer.place_group(group_name, list(self.matched[group_name].items())))
+
+    def render(self, placements: Iterable[tuple[Placeable, tuple[float, float]]]) -> Iterator[PlacedSchComponent]:
+        """
+        Render stage - streams the placements rendered into schematic entries
+        """
+        render_cache = self.render_cache
+        deterministic = self.options.deterministic
+        compact_nets = self.compact_nets
+
+        def render(placeable: Placeable, pos: tuple[float, float]) -> PlacedSchComponent:
+            if isinstance(placeable, Text):
+                return placeable.place(pos)
+
+            if compact_nets:
+                self._count_compact(placeable, pos)
+            if render_cache:
+                return render_cache.place(placeable, pos, compact_nets=compact_nets)
+            else:
+                return placeable.place(pos, deterministic=deterministic, compact_nets=compact_nets)
+
+        # Interleaved per component, the time of each is accumulated when profiling
+        render = self.profiler.wrap('render', render)
+
+        for placeable, pos in placements:
+            yield render(placeable, pos)
+
+    def _count_compact(self, match: MatchedSchComponent, pos: tuple[float, float]) -> None:
+        """
+        Count the global labels of a component that compact output replaces, and
+        the bytes saved by it (the global label rendered for comparison)
+        """
+        stats = self.stats
+        sch_comp = match.sch_comp
+        for pin, net in match.net_comp.connections.items():
+            kind = self.compact_nets.get(net)
+            if kind is None or pin not in sch_comp.label_segs:
+                continue
+
+            if kind == NO_CONNECT:
+                stats.no_connects += 1
+                seg = sch_comp.no_connect_segs[pin]
+            else:
+                stats.local_labels += 1
+                seg = sch_comp.local_label_segs[pin]
+            stats.compact_bytes_saved += (
+                len(sch_comp.label_segs[pin].render(pos, net=net).encode('utf-8')) -
+                len(seg.render(pos, net=net).encode('utf-8'))
+            )
+
+    def write(self, kicad_sch_path: str) -> list[SheetResult]:
+        """
+        Write stage - place, render and write the matched groups, in group order
+        """
+        try:
+            if self.options.hierarchical:
+                return self._write_hierarchical(kicad_sch_path)
+            return self._write_flat(kicad_sch_path)
+        except OSError as e:
+            raise ConversionError([Issue('write', 'io', str(e), fatal=True)]) from e
+        except SchWriterError as e:
+            raise ConversionError([Issue('write', 'format', str(e), fatal=True)]) from e
+
+    def _write_flat(self, kicad_sch_path: str) -> list[SheetResult]:
+        # Placed components are streamed to the schematic file right away,
+        # nothing is kept around once it is written
+        profiler = self.profiler
+
+        sch_writer = SchWriter(kicad_sch_path, [p.lib_symbol for p in self.used_symbols])
+        placer = self.new_placer()
+        write = profiler.wrap('write', sch_writer.add)
+
+        try:
+            # Dump the groups in order specified in component_grouping
+            for group_name in self.group_order:
+                for placed in self.render(self.place(group_name, placer)):
+                    write(placed)
+                profiler.set_counter('bytes_written', sch_writer.bytes_written)
+
+            profiler.wrap('write', sch_writer.close)(placer.paper)
+        except BaseException:
+            # Don't leave a half-written schematic behind
+            sch_writer.discard()
+            raise
+        profiler.set_counter('bytes_written', sch_writer.bytes_written)
+
+        # Text placements aren't place() calls, cached renders don't call place()
+        no_placed = sch_writer.no_placed - len(self.group_order)
+        self.stats.place_calls = self.render_cache.rendered if self.render_cache else no_placed
+        self.stats.bytes_written = sch_writer.bytes_written
+        profiler.set_counter('place_calls', self.stats.place_calls)
+
+        return [SheetResult(
+            kicad_sch_path,
+            None,
+            sum(len(matches) for group in self.matched.values() for matches in group.values()),
+            placer.paper,
+            placer.fill_ratio,
+            sch_writer.bytes_written
+        )]
+
+    def _write_hierarchical(self, kicad_sch_path: str) -> list[SheetResult]:
+        """
+        Write one sub-sheet per group, next to a root sheet that references them.
+
+        Placement is done here (it is cheap), rendering + writing of the sub-sheets
+        is spread over a pool of worker processes.
+        """
+        options = self.options
+        render_cache = self.render_cache
+
+        root_dir, root_file = os.path.split(kicad_sch_path)
+        stem = os.path.splitext(root_file)[0]
+        deterministic = options.deterministic or render_cache is not None
+
+        sheets = []         # (group name, file name, sheet uuid, number of components, placer)
+        sheet_jobs = []
+        sheet_keys = []     # render cache keys of sheet items
+        file_names = set()
+
+        for group_name in self.group_order:
+            # File name from group name, kept unique
+            file_name = f'{stem}_{re.sub(r"[^A-Za-z0-9_.-]+", "_", group_name).strip("_")}'
+            while f'{file_name}.kicad_sch'.lower() in file_names:
+                file_name += '_'
+            file_name += '.kicad_sch'
+            file_names.add(file_name.lower())
+
+            if deterministic:
+                sheet_uuid = uuid.uuid5(UUID_NAMESPACE, f'sheet/{group_name}')
+            else:
+                sheet_uuid = uuid.uuid4()
+            path_prefix = f'/{sheet_uuid}'
+
+            group = self.matched[group_name]
+            placer = self.new_placer()
+
+            # Compact nets of the sheet's components only, they're sent along with the sheet
+            sheet_compact_nets = {
+                net : self.compact_nets[net]
+                for matches in group.values()
+                for match in matches
+                for net in match.net_comp.connections.values()
+                if net in self.compact_nets
+            }
+
+            items = []
+            keys = []
+            for placeable, pos in self.place(group_name, placer):
+                rendered = None
+                if not isinstance(placeable, Text) and sheet_compact_nets:
+                    self._count_compact(placeable, pos)
+                if render_cache and not isinstance(placeable, Text):
+                    key = render_cache.key(placeable, pos, path_prefix, sheet_compact_nets)
+                    rendered = render_cache.get(key)
+                    keys.append(key)
+                else:
+                    keys.append(None)
+                items.append((placeable, pos, rendered))
+
+            sheets.append((group_name, file_name, sheet_uuid, sum(len(m) for m in group.values()), placer))
+            sheet_keys.append(keys)
+            sheet_jobs.append((
+                os.path.join(root_dir, file_name),
+                [sch_comp.lib_symbol for sch_comp in group],
+                items,
+                placer.paper,
+                deterministic,
+                path_prefix,
+                sheet_compact_nets
+            ))
+
+        # Symbol instances files of the written sub-sheets, merged (and removed) by the root
+        # sheet writer - whatever is left when something fails is removed here
+        symbol_insts_paths = []
+        root_writer = None
+
+        try:
+            if options.jobs > 1 and len(sheet_jobs) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=min(options.jobs, len(sheet_jobs))) as executor:
+                    futures = [executor.submit(write_sheet, sheet_job) for sheet_job in sheet_jobs]
+                # All jobs are finished once the executor shut down, failed or not
+                symbol_insts_paths.extend(future.result()[0] for future in futures if future.exception() is None)
+                results = [future.result() for future in futures]
+            else:
+                results = []
+                for sheet_job in sheet_jobs:
+                    results.append(write_sheet(sheet_job))
+                    symbol_insts_paths.append(results[-1][0])
+
+            # Root sheet, with the sheet references laid out in a grid
+            root_writer = SchWriter(kicad_sch_path, [])
+            root_written = False
+            root_writer.sheet_instances = [('/', '1')]
+            sheet_size = (50.8, 12.7)
+            sheet_columns = 4
+            bytes_written = 0
+            sheet_results = []
+
+            for i, ((group_name, file_name, sheet_uuid, no_comps, placer), result, keys) in enumerate(zip(sheets, results, sheet_keys)):
+                symbol_insts_path, sheet_bytes, rendered_items = result
+                bytes_written += sheet_bytes
+                self.stats.place_calls += len(rendered_items)
+
+                if render_cache:
+                    for item_no, rendered in rendered_items:
+                        render_cache.put(keys[item_no], rendered)
+
+                pos = (
+                    25.4 + (i % sheet_columns) * (sheet_size[0] + 25.4),
+                    25.4 + (i // sheet_columns) * (sheet_size[1] + 12.7)
+                )
+                root_writer.add_sheet(sheet_uuid, group_name, file_name, pos, sheet_size, str(i + 2))
+                root_writer.add_symbol_insts(symbol_insts_path)
+
+                sheet_results.append(SheetResult(os.path.join(root_dir, file_name), group_name, no_comps, placer.paper, placer.fill_ratio, sheet_bytes))
+
+            rows = (len(sheets) + sheet_columns - 1) // sheet_columns
+            root_writer.close((
+                50.8 + min(len(sheets), sheet_columns) * (sheet_size[0] + 25.4),
+                50.8 + rows * (sheet_size[1] + 12.7)
+            ))
+            root_written = True
+            bytes_written += root_writer.bytes_written
+        finally:
+            if root_writer is not None and not root_written:
+                root_writer.discard()
+            for symbol_insts_path in symbol_insts_paths:
+                if os.path.exists(symbol_insts_path):
+                    os.remove(symbol_insts_path)
+
+        self.stats.bytes_written = bytes_written
+        self.profiler.set_counter('bytes_written', bytes_written)
+
+        return sheet_results
+
+    def pin_maps(self) -> dict[str, dict[str, str]]:
+        """
+        Designator -> (symbol pin -> netlist pin) of the matched components,
+        through the templates' labels (see verify.template_pin_map)
+        """
+        template_pin_maps = {sch_comp : template_pin_map(sch_comp) for sch_comp in self.used_symbols}
+        return {
+            match.net_comp.designator : template_pin_maps[sch_comp]
+            for group in self.matched.values()
+            for sch_comp, matches in group.items()
+            for match in matches
+        }
+
+    def verify(self, kicad_sch_path: str) -> tuple[list[Mismatch], list[tuple[str, int, int]]]:
+        """
+        Verify stage - read the written schematic back, returns the
+        (pin / component mismatches, net mismatches) against the netlist
+        """
+        conn = read_sch_connectivity(kicad_sch_path)
+        return verify(self.netlist, conn, self.pin_maps(), self.stats.skipped)
+
+    def run(self, kicad_sch_path: str, verify: bool = False) -> ConversionResult:
+        """
+        All stages - match, place + render + write, and verify if asked to
+        """
+        for _ in self.match():
+            pass
+
+        sheets = self.write(kicad_sch_path)
+
+        verified = None
+        if verify:
+            mismatches, net_mismatches = self.verify(kicad_sch_path)
+            verified = not mismatches and not net_mismatches
+
+        return ConversionResult(kicad_sch_path, sheets, self.stats, self.issues, verified)
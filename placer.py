@@ -0,0 +1,211 @@
+"""
+Schematic placement engines
+
+A placer is fed the matched components group by group (in schematic section order)
+and yields the position of every component, plus a text heading for each group.
+It keeps track of the sheet size and of the area taken by components, so that the
+placement quality (fill ratio) can be reported.
+"""
+
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Iterator, Union
+
+from comp import MatchedSchComponent, SchComponent, Text
+
+# (SchComponent template, its matched instances) in placement order
+GroupComps = list[tuple[SchComponent, list[MatchedSchComponent]]]
+
+
+class Placer(ABC):
+    """
+    Placer interface
+    """
+
+    def __init__(self, width: float, spacing: float) -> None:
+        self.width = width          # maximum width of a component group
+        self.spacing = spacing      # spacing between groups
+
+        self.max_x = 0              # sheet size
+        self.y = 0
+        self.comp_area = 0          # sum of placed component bounds
+
+    @abstractmethod
+    def place_group(self, group_name: str, group_comps: GroupComps) -> Iterator[tuple[Union[Text, MatchedSchComponent], tuple[float, float]]]:
+        """
+        Yields (Text / MatchedSchComponent, position) for the group heading and components
+        """
+
+    @property
+    def paper(self) -> tuple[float, float]:
+        return (self.max_x, self.y)
+
+    @property
+    def fill_ratio(self) -> float:
+        area = self.max_x * self.y
+        return self.comp_area / area if area else 0
+
+
+class RowPlacer(Placer):
+    """
+    Greedy row placement - components are placed left to right, in descending pin count,
+    a new row is started once the group width is exceeded.
+
+    The row advances by the height of the last component in the row, so taller
+    components placed earlier in the row can overlap the next row.
+    """
+
+    def place_group(self, group_name, group_comps):
+        # Place text describing the group
+        x = 0
+        yield Text(group_name), (x, self.y)
+        self.y += self.spacing
+
+        # Dump the components by descending pin count
+        group_comps = sorted(
+            group_comps,
+            key = lambda m : len(m[0].label_tpls),
+            reverse=True
+        )
+        for sch_comp, matched_comps in group_comps:
+            for matched_comp in matched_comps:
+
+                yield matched_comp, (x, self.y)
+                self.comp_area += sch_comp.bounds[0] * sch_comp.bounds[1]
+
+                new_x = x + sch_comp.bounds[0]
+                new_y = self.y + sch_comp.bounds[1]
+
+                # If the next component would be outside specified bounds,
+                # we will place it in the next row
+                if new_x > self.width:
+                    x = 0
+                    self.y = new_y
+                else:
+                    # otherwise move within the row
+                    x = new_x
+
+                # Expand schematic bounds, if necessary
+                if new_x > self.max_x:
+                    self.max_x = new_x
+
+            else:
+                if x:
+                    # If we're currently in a non-empty row, move into new row
+                    self.y = self.y + sch_comp.bounds[1]
+                x = 0
+                self.y += self.spacing
+        else:
+            # Spacing between groups
+            self.y += self.spacing*2
+
+
+class SkylinePlacer(Placer):
+    """
+    Skyline bin packing - each group is packed into a strip of the group width.
+
+    The skyline (top edge of everything placed so far) is kept as a list of
+    [x, width, top] segments. Each component, tallest first, goes to the lowest
+    position where it fits (leftmost on ties), which never overlaps anything placed.
+
+    Finding the position is a sliding window maximum over the skyline segments, so
+    placing n components is O(n log n) for the sort + O(n * segments), the number of
+    segments being bounded by group width / narrowest component.
+    """
+
+    def place_group(self, group_name, group_comps):
+        yield Text(group_name), (0, self.y)
+        top = self.y + self.spacing
+
+        # Tallest first, then widest, keeping instances of a template together
+        comps = sorted(
+            [
+                (sch_comp.bounds, matched_comp)
+                for sch_comp, matched_comps in group_comps
+                for matched_comp in matched_comps
+            ],
+            key = lambda c : (c[0][1], c[0][0]),
+            reverse=True
+        )
+
+        # Group strip is at least as wide as its widest component
+        width = max([self.width] + [bounds[0] for bounds, _ in comps])
+
+        skyline = [[0, width, top]]
+        group_bottom = top
+
+        for (w, h), matched_comp in comps:
+            i, x, y = self._find(skyline, w, width)
+            self._add(skyline, i, x, w, y + h)
+
+            yield matched_comp, (x, y)
+            self.comp_area += w * h
+
+            group_bottom = max(group_bottom, y + h)
+            self.max_x = max(self.max_x, x + w)
+
+        # Spacing between groups
+        self.y = group_bottom + self.spacing*2
+
+    @staticmethod
+    def _find(skyline: list[list[float]], w: float, width: float) -> tuple[int, float, float]:
+        """
+        Lowest (then leftmost) position for a component of width w.
+        Returns (first covered segment index, x, y)
+        """
+        best = None
+
+        # Window of segments [i, j) covering [x_i, x_i + w), with a
+        # monotonic deque of segment indexes holding the window maximum top
+        window_max : deque[int] = deque()
+        j = 0
+        for i, (x, _, _) in enumerate(skyline):
+            if x + w > width:
+                break
+
+            while j < len(skyline) and skyline[j][0] < x + w:
+                while window_max and skyline[window_max[-1]][2] <= skyline[j][2]:
+                    window_max.pop()
+                window_max.append(j)
+                j += 1
+
+            while window_max[0] < i:
+                window_max.popleft()
+
+            y = skyline[window_max[0]][2]
+            if best is None or y < best[2]:
+                best = (i, x, y)
+
+        return best
+
+    @staticmethod
+    def _add(skyline: list[list[float]], i: int, x: float, w: float, top: float) -> None:
+        """
+        Raise the skyline to top over [x, x + w), starting at segment i
+        """
+        end = x + w
+
+        # Remove segments fully covered, trim the one partly covered
+        j = i
+        while j < len(skyline) and skyline[j][0] + skyline[j][1] <= end:
+            j += 1
+        if j < len(skyline) and skyline[j][0] < end:
+            seg_end = skyline[j][0] + skyline[j][1]
+            skyline[j][0] = end
+            skyline[j][1] = seg_end - end
+
+        skyline[i:j] = [[x, w, top]]
+
+        # Merge with neighbours of same height
+        if i + 1 < len(skyline) and skyline[i + 1][2] == top:
+            skyline[i][1] += skyline[i + 1][1]
+            del skyline[i + 1]
+        if i > 0 and skyline[i - 1][2] == top:
+            skyline[i - 1][1] += skyline[i][1]
+            del skyline[i]
+
+
+PLACERS : dict[str, type[Placer]] = {
+    'rows' : RowPlacer,
+    'skyline' : SkylinePlacer
+}
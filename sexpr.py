@@ -0,0 +1,218 @@
+"""
+KiCad s-expression reader / writer
+
+The file is tokenized and built into a tree once, structural queries are then done
+on the tree instead of running (indentation sensitive) regexes over the whole text.
+
+Node representation is kept compact - a node is a plain list [head, child, ...],
+where head is the node name (eg. 'symbol') and children are atoms (str) or nodes.
+Quoted strings keep their quotes, so that the tree serializes back exactly as read.
+"""
+
+import re
+from typing import Iterator, Optional, Union
+
+Node = list
+Atom = str
+
+# One of: ( ) "quoted \" string" atom
+_TOKEN_RE = re.compile(r'[()]|"[^"\\]*(?:\\.[^"\\]*)*"|[^\s()"]+')
+
+_UNESCAPE = {'n': '\n', 't': '\t', 'r': '\r'}
+_ESCAPE_RE = re.compile(r'\\(.)')
+
+
+def loads(text: str) -> Node:
+    """
+    Parse the (first) s-expression in text into a node tree
+    """
+    # Tokenize in one go, the tree is then built from the token list
+    tokens = _TOKEN_RE.findall(text)
+
+    stack : list[Node] = []
+    node : Node = None
+    for token in tokens:
+        if token == '(':
+            child : Node = []
+            if node is not None:
+                node.append(child)
+                stack.append(node)
+            node = child
+        elif token == ')':
+            if node is None:
+                raise ValueError('Unbalanced )')
+            if not stack:
+                return node
+            node = stack.pop()
+        elif node is None:
+            raise ValueError(f'Atom {token!r} outside of an expression')
+        else:
+            node.append(token)
+
+    raise ValueError('Unterminated s-expression')
+
+
+# Parens and quoted strings (which may contain parens)
+_PAREN_RE = re.compile(r'[()]|"[^"\\]*(?:\\.[^"\\]*)*"')
+
+
+def span_end(text: str, start: int) -> int:
+    """
+    End (exclusive) of the s-expression starting with the ( at text[start],
+    without building the tree - so that only the nodes of interest need to be parsed
+    """
+    depth = 0
+    for m in _PAREN_RE.finditer(text, start):
+        token = m.group()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if not depth:
+                return m.end()
+
+    raise ValueError('Unterminated s-expression')
+
+
+def load(path: str) -> Node:
+    # No context managers, let it fail fast
+    fd = open(path, mode='r')
+    text = fd.read()
+    fd.close()
+    return loads(text)
+
+
+def dumps(node: Union[Node, Atom], indent: int = 0) -> str:
+    """
+    Serialize node in KiCad-like layout (first line not indented).
+
+    Short nodes (eg. (at 1 2 0), (pts (xy 0 0) (xy 1 1))) are written on one line,
+    larger nodes put each large child node on its own, indented, line.
+    """
+    if not isinstance(node, list):
+        return node
+    if _is_flat(node):
+        return _dumps_inline(node)
+
+    # Leading atoms and short nodes stay on the first line: (symbol "name" (in_bom yes) ...
+    # the rest goes to indented lines, short nodes sharing a line
+    pad = ' ' * (indent + 2)
+    lines = ['(']
+    for child in node:
+        if isinstance(child, list) and not _is_flat(child):
+            if lines[-1] == pad:
+                lines.pop()
+            lines.append(pad + dumps(child, indent + 2))
+            lines.append(pad)
+            continue
+
+        text = dumps(child)
+        if len(lines[-1]) + len(text) > _LINE_LEN and len(lines[-1]) > len(pad):
+            lines.append(pad)
+        lines[-1] += text if lines[-1] in ('(', pad) else ' ' + text
+
+    if lines[-1] == pad:
+        lines.pop()
+    if len(lines) == 1:
+        return lines[0] + ')'
+    return '\n'.join(lines) + '\n' + ' ' * indent + ')'
+
+
+# Longest line of short nodes
+_LINE_LEN = 100
+
+# Longest node written on one line
+_FLAT_LEN = 72
+
+
+def _is_flat(node: Node) -> bool:
+    return _inline_len(node, _FLAT_LEN) <= _FLAT_LEN
+
+
+def _inline_len(node: Node, limit: int) -> int:
+    # Length of the one line serialization, stops counting once past limit
+    length = len(node) + 1
+    for child in node:
+        length += _inline_len(child, limit - length) if isinstance(child, list) else len(child)
+        if length > limit:
+            break
+    return length
+
+
+def _dumps_inline(node: Node) -> str:
+    return '(' + ' '.join(
+        _dumps_inline(child) if isinstance(child, list) else child
+        for child in node
+    ) + ')'
+
+
+def unquote(atom: Atom) -> str:
+    """
+    Value of a (possibly quoted) atom, with KiCad escapes resolved
+    """
+    if len(atom) < 2 or atom[0] != '"':
+        return atom
+    if '\\' not in atom:
+        return atom[1:-1]
+    return _ESCAPE_RE.sub(lambda m: _UNESCAPE.get(m.group(1), m.group(1)), atom[1:-1])
+
+
+def quote(s: str) -> Atom:
+    """
+    Quoted atom for a string value
+    """
+    return '"' + s.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+
+
+def children(node: Node, head: str) -> Iterator[Node]:
+    """
+    Child nodes named head, eg. children(kicad_sch, 'global_label')
+    """
+    return (child for child in node if isinstance(child, list) and child and child[0] == head)
+
+
+def child(node: Node, head: str) -> Optional[Node]:
+    """
+    First child node named head, None if there is none
+    """
+    return next(children(node, head), None)
+
+
+def find(node: Node, path: str) -> list[Node]:
+    """
+    All nodes at a slash separated path relative to node, eg. find(kicad_sch, 'symbol_instances/path')
+    """
+    nodes = [node]
+    for head in path.split('/'):
+        nodes = [c for n in nodes for c in children(n, head)]
+    return nodes
+
+
+if __name__ == '__main__':
+    # Quick test - round trip and time the parser on all given files
+
+    import sys
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'paths',
+        help='KiCad s-expression files',
+        nargs='+'
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    for path in args.paths:
+        start = time.perf_counter()
+        tree = load(path)
+        parsed = time.perf_counter()
+
+        if loads(dumps(tree)) != tree:
+            print(f'{path}: round trip FAILED')
+            sys.exit(1)
+
+        print(f'{path}: {(parsed - start) * 1000:.2f} ms')
@@ -0,0 +1,297 @@
+"""
+KiCad symbol library (.kicad_sym) reader
+
+Templates may leave out the lib_symbols entry of a placed symbol, which is then
+resolved by its lib_id (lib:name) from a symbol library, as KiCad does.
+
+Libraries can be large (tens of thousands of lines), while a template needs one
+symbol - so each library is scanned once into a symbol name -> byte span index,
+which is persisted (in the per-user cache directory) until the library changes.
+A lookup maps the library and parses only the span of the requested symbol.
+
+Library nicknames are resolved through sym-lib-table files, and otherwise by
+file name (Connector -> Connector.kicad_sym), for libraries in the component root.
+"""
+
+import mmap
+import os
+import re
+from typing import Any, Optional
+
+import sexpr
+from cache import files_fingerprint, load_pickle, save_pickle, user_cache_path, warn_cache_write
+
+# Symbol name -> (start, end) byte offsets of its (symbol ...) expression
+Index = dict[str, tuple[int, int]]
+
+# Parens (an opening one possibly starting a symbol) and quoted strings (which may contain parens)
+_SPAN_RE = re.compile(rb'\((?:symbol\s+("[^"\\]*(?:\\.[^"\\]*)*"))?|\)|"[^"\\]*(?:\\.[^"\\]*)*"')
+
+# A derived symbol may extend a derived symbol, but not endlessly
+_MAX_EXTENDS = 8
+
+
+class SymbolLibraryError(Exception):
+    """
+    Missing library / symbol, or a malformed library
+    """
+    def __init__(self, lib_path: str, msg: str) -> None:
+        super().__init__(f'{lib_path}: {msg}')
+
+
+def index_symbols(buf: bytes) -> Index:
+    """
+    Byte spans of the top level symbols of a library
+    """
+    index : Index = {}
+
+    depth = 0
+    symbol = None
+    for m in _SPAN_RE.finditer(buf):
+        token = m.group()
+        if token[0] == 0x28:    # (
+            depth += 1
+            if depth == 2 and m.group(1):
+                symbol = (m.group(1), m.start())
+        elif token[0] == 0x29:  # )
+            if depth == 2 and symbol:
+                # Derived symbols of older libraries are named lib:name, index by name
+                name = sexpr.unquote(symbol[0].decode()).split(':')[-1]
+                index[name] = (symbol[1], m.end())
+                symbol = None
+            depth -= 1
+
+    return index
+
+
+def index_cache_path(lib_path: str) -> str:
+    # Not next to the library, which may be shared, see cache.py
+    return user_cache_path(lib_path, 'index')
+
+
+def flatten(symbol: sexpr.Node, parent: sexpr.Node) -> sexpr.Node:
+    """
+    Derived symbol merged with the symbol it extends - the parent graphics, pins and
+    options, with properties overridden by the derived symbol (as KiCad embeds them)
+    """
+    name = sexpr.unquote(symbol[1]).split(':')[-1]
+    parent_name = sexpr.unquote(parent[1]).split(':')[-1]
+
+    properties = {
+        sexpr.unquote(prop[1]) : prop
+        for prop in sexpr.children(parent, 'property')
+    }
+    properties.update(
+        (sexpr.unquote(prop[1]), prop)
+        for prop in sexpr.children(symbol, 'property')
+    )
+
+    flat = ['symbol', sexpr.quote(name)]
+    for child in parent[2:]:
+        if not isinstance(child, list) or child[0] not in ('property', 'symbol'):
+            flat.append(child)
+    flat.extend(properties.values())
+
+    # Units are named <symbol>_<unit>_<style>
+    for unit in sexpr.children(parent, 'symbol'):
+        unit_name = sexpr.unquote(unit[1])
+        if unit_name.startswith(parent_name):
+            unit_name = name + unit_name[len(parent_name):]
+        flat.append(['symbol', sexpr.quote(unit_name)] + unit[2:])
+
+    return flat
+
+
+class SymbolLibrary:
+    """
+    Symbol library, read through its symbol span index
+    """
+
+    def __init__(
+        self,
+
+        lib_path    : str,
+        index       : Index     # symbol name -> byte span, see index_symbols()
+    ) -> None:
+        self.lib_path = lib_path
+        self.index = index
+
+    def read(self, name: str) -> sexpr.Node:
+        """
+        Symbol as written in the library (not flattened)
+        """
+        span = self.index.get(name, None)
+        if span is None:
+            raise SymbolLibraryError(self.lib_path, f'no symbol {name}')
+
+        # No context managers, let it fail fast
+        fd = open(self.lib_path, mode='rb')
+        buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        text = buf[span[0]:span[1]]
+        buf.close()
+        fd.close()
+
+        return sexpr.loads(text.decode().replace('\r\n', '\n'))
+
+    def symbol(self, name: str) -> sexpr.Node:
+        """
+        Symbol, with extends resolved
+        """
+        symbol = self.read(name)
+
+        chain = [symbol]
+        while (extends := sexpr.child(chain[-1], 'extends')) is not None:
+            if len(chain) > _MAX_EXTENDS:
+                raise SymbolLibraryError(self.lib_path, f'symbol {name} extends too deep (circular?)')
+            chain.append(self.read(sexpr.unquote(extends[1]).split(':')[-1]))
+
+        # Merge from the base symbol down
+        symbol = chain.pop()
+        while chain:
+            symbol = flatten(chain.pop(), symbol)
+        return symbol
+
+    @classmethod
+    def loadFromFile(cls, lib_path: str, use_cache: bool = True) -> Any:
+        """
+        Library with its index - read from the index cache, or built by scanning the
+        library (and cached) if the library changed since
+        """
+        cache_path = index_cache_path(lib_path)
+        fingerprint = files_fingerprint([lib_path])
+
+        index = load_pickle(cache_path, fingerprint) if use_cache else None
+        if index is None:
+            fd = open(lib_path, mode='rb')
+            if os.fstat(fd.fileno()).st_size:
+                buf = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+                index = index_symbols(buf)
+                buf.close()
+            else:
+                index = {}
+            fd.close()
+
+            if use_cache:
+                try:
+                    save_pickle(cache_path, fingerprint, index)
+                except OSError as e:
+                    warn_cache_write('symbol index cache', e)
+
+        return cls(lib_path, index)
+
+
+def read_sym_lib_table(table_path: str) -> dict[str, str]:
+    """
+    Library nickname -> library path of a sym-lib-table.
+    ${KIPRJMOD} is the table directory, other variables are taken from the environment.
+    """
+    table_dir = os.path.dirname(os.path.abspath(table_path))
+
+    libs = {}
+    for lib in sexpr.find(sexpr.load(table_path), 'lib'):
+        name = sexpr.child(lib, 'name')
+        uri = sexpr.child(lib, 'uri')
+        if name is None or uri is None:
+            raise SymbolLibraryError(table_path, f'lib entry without name / uri: {sexpr.dumps(lib)}')
+
+        path = sexpr.unquote(uri[1]).replace('${KIPRJMOD}', table_dir)
+        libs[sexpr.unquote(name[1])] = os.path.join(table_dir, os.path.expandvars(path))
+
+    return libs
+
+
+class SymbolLibraries:
+    """
+    lib_id -> symbol resolution over a set of libraries.
+
+    Libraries are indexed on first use, so that templates which embed their symbols
+    don't cost a library read.
+    """
+
+    def __init__(
+        self,
+
+        lib_paths   : dict[str, str],   # Library nickname -> library path
+        sources     : list[str] = None, # sym-lib-tables lib_paths was read from
+        use_cache   : bool = True       # Persist library indices
+    ) -> None:
+        self.lib_paths = lib_paths
+        self.sources = sources if sources is not None else []
+        self.use_cache = use_cache
+
+        self.libs : dict[str, SymbolLibrary] = {}
+
+    def library(self, nickname: str) -> SymbolLibrary:
+        lib = self.libs.get(nickname, None)
+        if lib is None:
+            lib_path = self.lib_paths.get(nickname, None)
+            if lib_path is None:
+                raise SymbolLibraryError(nickname, f'unknown symbol library (known: {", ".join(sorted(self.lib_paths)) or "none"})')
+            lib = self.libs[nickname] = SymbolLibrary.loadFromFile(lib_path, self.use_cache)
+        return lib
+
+    def resolve(self, lib_id: str) -> tuple[sexpr.Node, list[str]]:
+        """
+        Flattened symbol for a lib:name lib_id, named lib_id as in a schematic lib_symbols,
+        + the files it was resolved from
+        """
+        nickname, sep, name = lib_id.partition(':')
+        if not sep:
+            raise SymbolLibraryError(lib_id, 'expected a lib:name symbol reference')
+
+        lib = self.library(nickname)
+        symbol = lib.symbol(name)
+        return ['symbol', sexpr.quote(lib_id)] + symbol[2:], self.sources + [lib.lib_path]
+
+    @classmethod
+    def fromComponentRoot(cls, component_root: str, table_paths: Optional[list[str]] = None, use_cache: bool = True) -> Any:
+        """
+        Libraries in the component root (by file name), overridden by the sym-lib-table
+        in the component root (if any) and then by the given sym-lib-tables
+        """
+        lib_paths = {}
+        for dirpath, dirnames, files in sorted(os.walk(component_root)):
+            for file in sorted(files):
+                if file.endswith('.kicad_sym'):
+                    lib_paths.setdefault(file[:-len('.kicad_sym')], os.path.join(dirpath, file))
+
+        sources = []
+        root_table = os.path.join(component_root, 'sym-lib-table')
+        for table_path in ([root_table] if os.path.exists(root_table) else []) + (table_paths or []):
+            lib_paths.update(read_sym_lib_table(table_path))
+            sources.append(table_path)
+
+        return cls(lib_paths, sources, use_cache)
+
+
+if __name__ == '__main__':
+    # Quick test - index the given libraries and print their symbols
+
+    import sys
+    import time
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'paths',
+        help='KiCad symbol libraries',
+        nargs='+'
+    )
+    parser.add_argument(
+        '-s', '--symbol',
+        help='Print this (flattened) symbol instead of the symbol list'
+    )
+    args = parser.parse_args(sys.argv[1:])
+
+    for path in args.paths:
+        start = time.perf_counter()
+        lib = SymbolLibrary.loadFromFile(path)
+        print(f'{path}: {len(lib.index)} symbols, indexed in {(time.perf_counter() - start) * 1000:.2f} ms')
+
+        if args.symbol:
+            print(sexpr.dumps(lib.symbol(args.symbol)))
+        else:
+            print('\n'.join(f'  {name}' for name in sorted(lib.index)))
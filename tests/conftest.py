@@ -0,0 +1,9 @@
+"""
+The modules are flat in the repository root (run as scripts), make them importable
+"""
+
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
@@ -0,0 +1,68 @@
+"""
+Indexed SchComponentMatcher vs trying SchComponent.match for each rule in order
+"""
+
+import os
+
+import pytest
+
+import bench
+from match import SchComponentMatcher
+from net import NetComponent, Netlist
+from pipeline import TemplateLibrary
+
+from conftest import ROOT
+
+
+def first_match(sch_comps, net_comp):
+    """
+    Index of the first matching rule, the way nl2sch matched before the matcher
+    """
+    for rule_no, sch_comp in enumerate(sch_comps):
+        if sch_comp.match(net_comp):
+            return rule_no
+    return None
+
+
+def variants(net_comps):
+    """
+    The netlist components + near misses of them - other footprint decorations,
+    designators of other components, other values
+    """
+    designators = [net_comp.designator for net_comp in net_comps]
+    for i, net_comp in enumerate(net_comps):
+        d, f, v = net_comp.designator, net_comp.footprint, net_comp.value
+        yield net_comp
+        yield NetComponent(d, f + '_1', v)
+        yield NetComponent(d, 'PKG1_' + f, v)
+        yield NetComponent(d, f[:-1], v)
+        yield NetComponent(d, f, 'X' + v)
+        yield NetComponent(designators[(i * 7 + 3) % len(designators)], f, v)
+
+
+def assert_same_matches(sch_comps, net_comps):
+    matcher = SchComponentMatcher(sch_comps)
+    classes = {}
+    for net_comp in variants(net_comps):
+        expected = first_match(sch_comps, net_comp)
+        assert matcher.match_rule(net_comp) == expected, (net_comp.designator, net_comp.footprint, net_comp.value)
+
+        designator_class = classes.setdefault(net_comp.designator, matcher.designator_class(net_comp.designator))
+        assert matcher.match_class_rule(designator_class, net_comp.footprint, net_comp.value) == expected
+
+
+@pytest.mark.parametrize('rule_style', ['exact', 'prefix', 'wild', 'mixed'])
+def test_bench_rules(tmp_path, rule_style):
+    bench.generate(str(tmp_path), 400, 60, 16, 3, 2, 0.2, rule_style, 1)
+
+    library = TemplateLibrary.load(str(tmp_path / 'components'), symbol_index_cache=False)
+    netlist = Netlist.loadFromFile(str(tmp_path / 'bench.Net'))
+
+    assert_same_matches(library.sch_comps, list(netlist.comps.values()))
+
+
+def test_ebaz4205_rules():
+    library = TemplateLibrary.load(os.path.join(ROOT, 'ebaz4205', 'components'), symbol_index_cache=False)
+    netlist = Netlist.loadFromFile(os.path.join(ROOT, 'ebaz4205', 'ebit_ad.Net'))
+
+    assert_same_matches(library.sch_comps, list(netlist.comps.values()))
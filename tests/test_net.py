@@ -0,0 +1,219 @@
+"""
+Protel netlist tokenizers and loading
+"""
+
+import argparse
+import io
+import os
+import pickle
+
+import pytest
+
+import bench
+from net import (
+    FALLBACK_ENCODING, CompactNetlist, NetComponent, Netlist, NetlistFormatError,
+    decode_field, detect_encoding, netlist_encoding, parse_protel, read_protel, scan_protel
+)
+
+from conftest import ROOT
+
+EBAZ4205_NETLIST = os.path.join(ROOT, 'ebaz4205', 'ebit_ad.Net')
+
+NETLIST = '''
+[
+R1
+0603
+10k
+
+
+
+]
+[
+U1
+SOIC-8
+LM358
+
+
+
+]
+
+(
+VCC
+U1-8
+R1-1
+)
+(
+OUT
+U1-1
+R1-2
+)
+'''
+
+NETLIST_TOKENS = [
+    (2, 'component', 'R1', '0603', '10k'),
+    (10, 'component', 'U1', 'SOIC-8', 'LM358'),
+    (21, 'node', 'VCC', 'U1', '8'),
+    (22, 'node', 'VCC', 'R1', '1'),
+    (26, 'node', 'OUT', 'U1', '1'),
+    (27, 'node', 'OUT', 'R1', '2'),
+]
+
+
+def parsed(text):
+    return list(parse_protel(io.StringIO(text), '<netlist>'))
+
+
+def test_parse_protel():
+    assert parsed(NETLIST) == NETLIST_TOKENS
+    assert parsed(NETLIST.replace('\n', '\r\n')) == NETLIST_TOKENS
+
+
+@pytest.mark.parametrize('netlist, line_no', [
+    (NETLIST.replace('U1-8', 'U18'), 21),
+    (NETLIST.replace('LM358\n', 'LM358\nX\n'), 14),
+    (NETLIST.replace('(\nOUT\nU1-1\nR1-2\n)', '(\nOUT\n)'), 24),
+    (NETLIST.replace('(\nVCC', 'VCC'), 19),
+    (NETLIST.rstrip().rstrip(')'), 24),
+])
+def test_malformed(netlist, line_no):
+    with pytest.raises(NetlistFormatError, match=f'^<netlist>:{line_no}: '):
+        parsed(netlist)
+
+
+def test_load():
+    netlist = Netlist.loadFromFile(EBAZ4205_NETLIST)
+
+    # Connections are the nets, seen from the components
+    no_nodes = 0
+    for net, nodes in netlist.nets.items():
+        for net_comp, pin in nodes:
+            assert net_comp.connections[pin] == net
+        no_nodes += len(nodes)
+    assert sum(len(net_comp.connections) for net_comp in netlist.comps.values()) == no_nodes
+
+
+def scanned(buf, encoding=None):
+    """
+    scan_protel() tokens as the parse_protel() tokens they stand for
+    """
+    def decode(field):
+        return decode_field(field, encoding)
+
+    for token in scan_protel(buf, '<netlist>', encoding):
+        if token[1] == 'component':
+            line_no, _, designator, footprint, value = token
+            yield (line_no, 'component', decode(designator), decode(footprint), decode(value))
+        else:
+            line_no, _, net, nodes = token
+            for i, (designator, pin) in enumerate(nodes):
+                yield (line_no + 2 + i, 'node', decode(net), decode(designator), decode(pin))
+
+
+def assert_same_tokens(buf, encoding=None):
+    tokens = parsed(decode_field(buf, encoding))
+    assert tokens
+    assert list(scanned(buf, encoding)) == tokens
+
+
+def test_scan_protel():
+    assert list(scanned(NETLIST.encode())) == NETLIST_TOKENS
+
+
+def test_scan_ebaz4205():
+    with open(EBAZ4205_NETLIST, 'rb') as f:
+        assert_same_tokens(f.read())
+
+
+def test_scan_bench(tmp_path):
+    bench.generate(str(tmp_path), 500, 40, 32, 3, 3, 0.2, 'mixed', 2)
+    with open(tmp_path / 'bench.Net', 'rb') as f:
+        assert_same_tokens(f.read())
+
+
+@pytest.mark.parametrize('netlist', [
+    NETLIST,
+    NETLIST.replace('\n', '\r\n'),
+    NETLIST.lstrip() + '\n\n',
+    NETLIST.replace('(\nVCC\n', '\n\n(\nVCC\n'),
+    NETLIST.replace('OUT', 'OUT-A').replace('U1-1', 'U1-A-1'),
+    NETLIST.replace('\n\n\n\n]', '\n\n\n\n\n]'),
+])
+def test_scan_layouts(netlist):
+    assert_same_tokens(netlist.encode())
+
+
+@pytest.mark.parametrize('encoding', ['utf-8', 'cp1252'])
+def test_scan_encodings(encoding):
+    netlist = NETLIST.replace('10k', '10kΩ' if encoding == 'utf-8' else '10k±5%').replace('OUT', 'OUT_µ')
+    assert_same_tokens(netlist.encode(encoding), encoding)
+
+
+@pytest.mark.parametrize('netlist, line_no', [
+    (NETLIST.replace('U1-8', 'U18'), 21),
+    (NETLIST.replace('LM358\n', 'LM358\nX\n'), 14),
+    (NETLIST.replace('(\nOUT\nU1-1\nR1-2\n)', '(\nOUT\n)'), 24),
+    (NETLIST.replace('(\nVCC', 'VCC'), 19),
+    (NETLIST.rstrip().rstrip(')'), 24),
+])
+def test_scan_malformed(netlist, line_no):
+    with pytest.raises(NetlistFormatError, match=f'^<netlist>:{line_no}: '):
+        list(scanned(netlist.encode()))
+
+
+@pytest.mark.parametrize('netlist_cls', [Netlist, CompactNetlist])
+def test_unknown_component_line(tmp_path, netlist_cls):
+    # The second (repeated) R1-1 node is the one referencing a missing component
+    path = tmp_path / 'unknown.Net'
+    path.write_text(NETLIST.replace('U1-1\nR1-2', 'R1-1\nR1-1\nR2-1'))
+    with pytest.raises(NetlistFormatError, match=':28: node references unknown component R2$'):
+        netlist_cls.loadFromFile(str(path))
+
+
+def test_backends():
+    """
+    Both netlist representations, loaded through scan_protel(), have the same connectivity
+    """
+    netlist, compact = Netlist.loadFromFile(EBAZ4205_NETLIST), CompactNetlist.loadFromFile(EBAZ4205_NETLIST)
+
+    assert list(compact.nets) == list(netlist.nets)
+    for net, nodes in netlist.nets.items():
+        assert [(net_comp.designator, pin) for net_comp, pin in compact.nets[net]] == \
+               [(net_comp.designator, pin) for net_comp, pin in nodes]
+
+
+def test_detect_encoding():
+    assert detect_encoding(b'') == 'utf-8'
+    assert detect_encoding(NETLIST.encode()) == 'utf-8'
+    assert detect_encoding(NETLIST.replace('10k', '10kΩ').encode()) == 'utf-8'
+    assert detect_encoding(NETLIST.replace('10k', '10k±5%').encode('cp1252')) == FALLBACK_ENCODING
+
+
+@pytest.mark.parametrize('netlist_cls', [Netlist, CompactNetlist])
+def test_one_encoding_per_file(tmp_path, netlist_cls):
+    # 'Â°' in cp1252 is valid UTF-8 ('°'), but the file as a whole isn't
+    path = tmp_path / 'mixed.Net'
+    path.write_bytes(NETLIST.replace('10k', '10k±5%').replace('LM358', 'LM358Â°').encode('cp1252'))
+
+    netlist = netlist_cls.loadFromFile(str(path))
+    assert netlist.comps['R1'].value == '10k±5%'
+    assert netlist.comps['U1'].value == 'LM358Â°'
+
+
+def test_pickled_components():
+    netlist = Netlist.loadFromFile(EBAZ4205_NETLIST)
+    for net_comp in list(netlist.comps.values())[:10]:
+        detached = pickle.loads(pickle.dumps(net_comp))
+        assert type(detached) is NetComponent
+        assert (detached.designator, detached.footprint, detached.value, detached.connections) == \
+               (net_comp.designator, net_comp.footprint, net_comp.value, net_comp.connections)
+
+
+def test_ascii_incompatible_encodings(tmp_path):
+    path = tmp_path / 'utf16.Net'
+    path.write_text(NETLIST, encoding='utf-16')
+
+    with pytest.raises(NetlistFormatError):
+        read_protel(str(path), 'utf-16')
+    with pytest.raises(argparse.ArgumentTypeError):
+        netlist_encoding('utf-16')
+    assert netlist_encoding('cp1252') == 'cp1252'
@@ -0,0 +1,81 @@
+"""
+SkylinePlacer never overlaps components, whatever their sizes and the group width
+"""
+
+import os
+
+import pytest
+
+import bench
+from comp import Text
+from net import Netlist
+from pipeline import TemplateLibrary
+from placer import PLACERS
+
+from conftest import ROOT
+
+
+def matched_groups(component_root, netlist_path, no_groups):
+    """
+    Matched components, in no_groups groups of (template, matched instances)
+    """
+    library = TemplateLibrary.load(component_root, symbol_index_cache=False)
+    netlist = Netlist.loadFromFile(netlist_path)
+
+    groups = [{} for _ in range(no_groups)]
+    for i, net_comp in enumerate(netlist.comps.values()):
+        matched_comp = library.matcher.match(net_comp)
+        if matched_comp:
+            groups[i % no_groups].setdefault(matched_comp.sch_comp, []).append(matched_comp)
+    return [list(group.items()) for group in groups]
+
+
+def place(placer, groups):
+    """
+    Component rectangles (x0, y0, x1, y1), each component placed once
+    """
+    rects = {}
+    for group_no, group_comps in enumerate(groups):
+        for placeable, (x, y) in placer.place_group(f'Group {group_no}', group_comps):
+            if isinstance(placeable, Text):
+                continue
+            assert id(placeable) not in rects
+            w, h = placeable.sch_comp.bounds
+            rects[id(placeable)] = (x, y, x + w, y + h)
+
+    assert len(rects) == sum(len(matched_comps) for group_comps in groups for _, matched_comps in group_comps)
+    return list(rects.values())
+
+
+def assert_no_overlap(rects):
+    # Sweep along x - only rectangles starting before the current one ends can overlap it
+    rects = sorted(rects)
+    for i, (x0, y0, x1, y1) in enumerate(rects):
+        for other_x0, other_y0, other_x1, other_y1 in rects[i + 1:]:
+            if other_x0 >= x1:
+                break
+            assert other_y0 >= y1 or other_y1 <= y0, ((x0, y0, x1, y1), (other_x0, other_y0, other_x1, other_y1))
+
+
+@pytest.mark.parametrize('width', [50, 450, 2000])
+def test_skyline_bench(tmp_path, width):
+    bench.generate(str(tmp_path), 600, 40, 64, 3, 2, 0.2, 'mixed', 3)
+    groups = matched_groups(str(tmp_path / 'components'), str(tmp_path / 'bench.Net'), 4)
+
+    placer = PLACERS['skyline'](width, 7)
+    rects = place(placer, groups)
+    assert_no_overlap(rects)
+
+    # Everything is on the sheet
+    max_x, max_y = placer.paper
+    assert all(x1 <= max_x and y1 <= max_y for _, _, x1, y1 in rects)
+    assert 0 < placer.fill_ratio <= 1
+
+
+def test_skyline_ebaz4205():
+    groups = matched_groups(
+        os.path.join(ROOT, 'ebaz4205', 'components'),
+        os.path.join(ROOT, 'ebaz4205', 'ebit_ad.Net'),
+        8
+    )
+    assert_no_overlap(place(PLACERS['skyline'](450, 7), groups))
@@ -0,0 +1,497 @@
+#!/usr/bin/env python3
+"""
+Round-trip connectivity verification of generated schematics
+
+Reads a generated KiCad schematic back (following sub-sheets), rebuilds the
+pin -> net connectivity and compares it with the netlist it was generated from.
+
+Labels are placed directly on the pin endpoints (there are no wires), so a pin is
+connected to the net of the label(s) at its endpoint. Pin endpoints are computed from
+the lib_symbols pin positions and the placed symbol position / rotation / mirroring.
+
+The schematic is scanned for the few node types we need instead of parsing the whole
+tree, only lib_symbols and sheet references (small) are parsed, so verification
+stays linear and cheap for large schematics.
+"""
+
+import argparse
+from dataclasses import dataclass, field
+import math
+import os
+import re
+import sys
+import time
+from typing import Iterable, Iterator, Optional
+
+from comp import SchComponent
+import sexpr
+from net import Netlist, netlist_encoding
+
+_QUOTED = r'("(?:[^"\\]|\\.)*")'
+_NUM = r'(-?[\d.]+)'
+
+# Placed symbol - lib_id, position, rotation, mirror, unit ... uuid
+_SYMBOL_RE = re.compile(
+    r'\(symbol\s+\(lib_id\s+' + _QUOTED + r'\)\s+\(at\s+' + _NUM + r'\s+' + _NUM + r'(?:\s+' + _NUM + r')?\)\s*'
+    r'(?:\(mirror\s+([xy])\)\s*)?\(unit\s+(\d+)\)'
+    r'(?:\s*\((?:in_bom|on_board|convert|fields_autoplaced)[^()]*\))*'
+    r'\s*\(uuid\s+"?([^")\s]+)"?\)'
+)
+# Global / local label - kind, name, position
+_LABEL_RE = re.compile(
+    r'\((global_label|label)\s+' + _QUOTED + r'(?:\s+\(shape\s+[^()]*\))?\s+\(at\s+' + _NUM + r'\s+' + _NUM
+)
+_NO_CONNECT_RE = re.compile(r'\(no_connect\s+\(at\s+' + _NUM + r'\s+' + _NUM)
+# symbol_instances entry - path, reference
+_INSTANCE_RE = re.compile(r'\(path\s+' + _QUOTED + r'\s+\(reference\s+' + _QUOTED + r'\)')
+_LIB_SYMBOLS_RE = re.compile(r'\(lib_symbols\b')
+_SHEET_RE = re.compile(r'\(sheet\s+\(at\b')
+
+# Positions are compared on the KiCad resolution grid (0.1 um)
+_RESOLUTION = 10000
+
+# Net of pins marked with a no_connect - matches single node nets of the netlist
+NO_CONNECT = None
+
+
+def _pos_key(sheet: int, x: float, y: float) -> tuple[int, int, int]:
+    return (sheet, round(x * _RESOLUTION), round(y * _RESOLUTION))
+
+
+def lib_symbol_pins(lib_symbols: sexpr.Node) -> dict[tuple[str, int], list[tuple[str, float, float]]]:
+    """
+    (lib_id, unit) -> [(pin number, x, y)] pin endpoints in symbol coordinates.
+    Unit 0 pins are common to all units.
+    """
+    pins = {}
+    for lib_symbol in sexpr.children(lib_symbols, 'symbol'):
+        lib_id = sexpr.unquote(lib_symbol[1])
+        base = lib_id.split(':')[-1]
+
+        for unit_symbol in sexpr.children(lib_symbol, 'symbol'):
+            # Unit symbols are named <name>_<unit>_<body style>
+            unit_name = sexpr.unquote(unit_symbol[1])
+            if not unit_name.startswith(base + '_'):
+                continue
+            unit = int(unit_name[len(base) + 1:].split('_')[0])
+
+            unit_pins = pins.setdefault((lib_id, unit), [])
+            for pin in sexpr.children(unit_symbol, 'pin'):
+                at = sexpr.child(pin, 'at')
+                number = sexpr.child(pin, 'number')
+                unit_pins.append((sexpr.unquote(number[1]), float(at[1]), float(at[2])))
+
+    return pins
+
+
+def pin_position(
+    pos     : tuple[float, float],
+    angle   : float,
+    mirror  : Optional[str],
+    lx      : float,
+    ly      : float
+) -> tuple[float, float]:
+    """
+    Schematic position of a symbol pin at (lx, ly) in symbol coordinates (y up)
+    """
+    # Symbol y axis points up, schematic y axis points down
+    x, y = lx, -ly
+
+    # Rotation is counter clockwise on screen
+    if angle:
+        a = math.radians(angle)
+        cos, sin = round(math.cos(a)), round(math.sin(a))
+        x, y = x * cos + y * sin, -x * sin + y * cos
+
+    if mirror == 'x':
+        y = -y
+    elif mirror == 'y':
+        x = -x
+
+    return pos[0] + x, pos[1] + y
+
+
+def symbol_pin_keys(
+    lib_pins    : dict[tuple[str, int], list[tuple[str, float, float]]],
+    sheet       : int,
+    lib_id      : str,
+    unit        : int,
+    pos         : tuple[float, float],
+    angle       : float,
+    mirror      : Optional[str]
+) -> Iterator[tuple[str, tuple[int, int, int]]]:
+    """
+    (pin number, position key) of each pin of a placed symbol unit
+    """
+    for number, lx, ly in lib_pins.get((lib_id, unit), []) + lib_pins.get((lib_id, 0), []):
+        yield number, _pos_key(sheet, *pin_position(pos, angle, mirror, lx, ly))
+
+
+def template_pin_map(sch_comp: SchComponent) -> dict[str, str]:
+    """
+    Symbol pin number -> netlist pin name of a SchComponent template.
+
+    The template labels are named after the netlist pins and connect to the symbol pin they
+    sit on, which doesn't need to have the same number (e.g. diodes with swapped anode / cathode).
+    """
+    lib_pins = lib_symbol_pins(sexpr.loads(f'(lib_symbols\n{sch_comp.lib_symbol})'))
+
+    labels = {}
+    for pin, label in sch_comp.label_tpls.items():
+        at = sexpr.child(label, 'at')
+        labels[_pos_key(0, float(at[1]), float(at[2]))] = pin
+
+    pin_map = {}
+    for symbol in sch_comp.symbol_tpls.values():
+        at = sexpr.child(symbol, 'at')
+        mirror = sexpr.child(symbol, 'mirror')
+        keys = symbol_pin_keys(
+            lib_pins, 0,
+            sexpr.unquote(sexpr.child(symbol, 'lib_id')[1]),
+            int(sexpr.child(symbol, 'unit')[1]),
+            (float(at[1]), float(at[2])),
+            float(at[3]) if len(at) > 3 else 0,
+            mirror[1] if mirror else None
+        )
+        for number, key in keys:
+            if key in labels:
+                pin_map[number] = labels[key]
+
+    return pin_map
+
+
+@dataclass
+class SchConnectivity:
+    """
+    Connectivity rebuilt from the schematic
+    """
+    # designator -> pin -> net (NO_CONNECT for no_connect marked pins)
+    connections : dict[str, dict[str, Optional[str]]] = field(default_factory=dict)
+
+    # Inconsistencies found while rebuilding - (designator, pin, message)
+    errors : list[tuple[str, str, str]] = field(default_factory=list)
+
+    no_sheets : int = 0
+    no_symbols : int = 0
+    no_labels : int = 0
+
+
+def read_sch_connectivity(kicad_sch_path: str) -> SchConnectivity:
+    """
+    Rebuild designator -> pin -> net from the schematic and its sub-sheets
+    """
+    conn = SchConnectivity()
+
+    # Per sheet: label / no_connect positions, placed symbols
+    labels : dict[tuple[int, int, int], set[str]] = {}
+    local_nets : dict[str, set[int]] = {}           # local label name -> sheets it is used in
+    no_connects : set[tuple[int, int, int]] = set()
+    symbols : list[tuple[int, str, str, tuple[float, float], float, Optional[str], int]] = []
+    lib_pins : dict[tuple[str, int], list[tuple[str, float, float]]] = {}
+
+    # (sheet index, path prefix) of sheets to read, path -> reference of all symbol instances
+    sheet_paths : dict[int, str] = {}
+    references : dict[str, str] = {}
+
+    def read_sheet(path: str, path_prefix: str) -> None:
+        sheet = conn.no_sheets
+        conn.no_sheets += 1
+        sheet_paths[sheet] = path_prefix
+
+        # No context managers, let it fail fast
+        fd = open(path, mode='r', encoding='utf-8')
+        text = fd.read()
+        fd.close()
+
+        m = _LIB_SYMBOLS_RE.search(text)
+        if m:
+            lib_pins.update(lib_symbol_pins(sexpr.loads(text[m.start():sexpr.span_end(text, m.start())])))
+
+        for m in _SYMBOL_RE.finditer(text):
+            lib_id, x, y, angle, mirror, unit, uuid = m.groups()
+            symbols.append((sheet, sexpr.unquote(lib_id), uuid, (float(x), float(y)), float(angle or 0), mirror, int(unit)))
+
+        for m in _LABEL_RE.finditer(text):
+            kind, name, x, y = m.groups()
+            name = sexpr.unquote(name)
+            labels.setdefault(_pos_key(sheet, float(x), float(y)), set()).add(name)
+            if kind == 'label':
+                local_nets.setdefault(name, set()).add(sheet)
+            conn.no_labels += 1
+
+        for m in _NO_CONNECT_RE.finditer(text):
+            no_connects.add(_pos_key(sheet, float(m.group(1)), float(m.group(2))))
+
+        for m in _INSTANCE_RE.finditer(text):
+            references[sexpr.unquote(m.group(1))] = sexpr.unquote(m.group(2))
+
+        # Sub-sheets, relative to this sheet
+        for m in _SHEET_RE.finditer(text):
+            sheet_node = sexpr.loads(text[m.start():sexpr.span_end(text, m.start())])
+            sheet_uuid = sexpr.unquote(sexpr.child(sheet_node, 'uuid')[1])
+            sheet_file = next(
+                sexpr.unquote(prop[2])
+                for prop in sexpr.children(sheet_node, 'property')
+                if sexpr.unquote(prop[1]) in ('Sheet file', 'Sheetfile')
+            )
+            read_sheet(os.path.join(os.path.dirname(path), sheet_file), f'{path_prefix}/{sheet_uuid}')
+
+    read_sheet(kicad_sch_path, '')
+
+    # Local labels only connect within their sheet
+    for name, sheets in local_nets.items():
+        if len(sheets) > 1:
+            conn.errors.append(('', '', f'local label {name} used in {len(sheets)} sheets, nets are not connected'))
+
+    # Pins of placed symbols -> nets of labels on their endpoints
+    for sheet, lib_id, uuid, pos, angle, mirror, unit in symbols:
+        conn.no_symbols += 1
+        designator = references.get(f'{sheet_paths[sheet]}/{uuid}')
+        if designator is None:
+            conn.errors.append((lib_id, '', f'symbol {uuid} has no symbol instance'))
+            continue
+
+        pin_nets = conn.connections.setdefault(designator, {})
+        for number, key in symbol_pin_keys(lib_pins, sheet, lib_id, unit, pos, angle, mirror):
+            nets = labels.get(key)
+            if nets:
+                if len(nets) > 1:
+                    conn.errors.append((designator, number, f'shorted nets {", ".join(sorted(nets))}'))
+                net = min(nets)
+            elif key in no_connects:
+                net = NO_CONNECT
+            else:
+                continue
+
+            # Same pin can be drawn in several units (unit 0 pins)
+            if pin_nets.get(number, net) != net:
+                conn.errors.append((designator, number, f'connected to both {pin_nets[number]} and {net}'))
+            pin_nets[number] = net
+
+    return conn
+
+
+@dataclass
+class Mismatch:
+    designator  : str
+    pin         : str
+    expected    : Optional[str]     # netlist net
+    found       : Optional[str]     # schematic net
+    msg         : str
+
+    def __str__(self) -> str:
+        where = f'{self.designator} pin {self.pin}' if self.pin else self.designator
+        return f'{where}: {self.msg}'
+
+
+def verify(
+    netlist     : Netlist,
+    conn        : SchConnectivity,
+    pin_maps    : Optional[dict[str, dict[str, str]]] = None,  # designator -> template_pin_map() of its template
+        # Without a pin map, symbol pin numbers are expected to be the netlist pin names.
+        # Netlist pins missing in the template (see --allow-missing-pins) are not checked.
+    skip        : Iterable[str] = ()    # designators not placed on purpose (e.g. -ac skipped components)
+) -> tuple[list[Mismatch], list[tuple[str, int, int]]]:
+    """
+    Compare schematic connectivity with the netlist.
+
+    Returns (component mismatches by designator and pin, [(net, netlist nodes, schematic nodes)]
+    of nets whose node sets differ)
+    """
+    skip = set(skip)
+    pin_maps = pin_maps or {}
+    mismatches = [Mismatch(d, pin, None, None, msg) for d, pin, msg in conn.errors]
+
+    # Node set hash of each net, on both sides - a sum of the node hashes is independent
+    # of the order the nodes are seen in, so the nets don't need to be collected
+    net_hashes : dict[str, list[int]] = {}  # net -> [netlist hash, netlist nodes, sch hash, sch nodes]
+
+    def add_node(side: int, net: str, designator: str, pin: str) -> None:
+        h = net_hashes.get(net)
+        if h is None:
+            h = net_hashes[net] = [0, 0, 0, 0]
+        h[side] = (h[side] + hash((designator, pin))) & 0xFFFFFFFFFFFFFFFF
+        h[side + 1] += 1
+
+    # Pins marked no_connect are fine for single node nets
+    fanout = netlist.fanout
+
+    for designator, net_comp in netlist.comps.items():
+        if designator in skip:
+            continue
+
+        found = conn.connections.get(designator)
+        if found is None:
+            mismatches.append(Mismatch(designator, '', None, None, 'not in schematic'))
+            found = {}
+
+        expected = net_comp.connections
+        pin_map = pin_maps.get(designator)
+        if pin_map is not None:
+            # Symbol pin numbers -> netlist pins
+            mapped = {}
+            for number, sch_net in found.items():
+                pin = pin_map.get(number)
+                if pin is not None:
+                    mapped[pin] = sch_net
+                elif sch_net is not NO_CONNECT:
+                    mismatches.append(Mismatch(designator, number, None, sch_net, f'connected to {sch_net}, not a template pin'))
+            found = mapped
+
+            template_pins = set(pin_map.values())
+            expected = {pin : net for pin, net in expected.items() if pin in template_pins}
+
+        for pin, net in expected.items():
+            add_node(0, net, designator, pin)
+            if pin not in found:
+                mismatches.append(Mismatch(designator, pin, net, None, f'expected {net}, unconnected'))
+                continue
+
+            sch_net = found[pin]
+            if sch_net is NO_CONNECT:
+                if fanout(net) > 1:
+                    mismatches.append(Mismatch(designator, pin, net, None, f'expected {net}, marked no_connect'))
+                    continue
+                # Stands for the (single node) netlist net
+                sch_net = net
+            elif sch_net != net:
+                mismatches.append(Mismatch(designator, pin, net, sch_net, f'expected {net}, connected to {sch_net}'))
+            add_node(2, sch_net, designator, pin)
+
+        for pin, sch_net in found.items():
+            if pin not in expected and sch_net is not NO_CONNECT:
+                mismatches.append(Mismatch(designator, pin, None, sch_net, f'not connected in netlist, connected to {sch_net}'))
+                add_node(2, sch_net, designator, pin)
+
+    for designator, found in conn.connections.items():
+        if designator not in netlist.comps:
+            mismatches.append(Mismatch(designator, '', None, None, 'not in netlist'))
+            for pin, sch_net in found.items():
+                if sch_net is not NO_CONNECT:
+                    add_node(2, sch_net, designator, pin)
+
+    net_mismatches = [
+        (net, h[1], h[3])
+        for net, h in net_hashes.items()
+        if h[0] != h[2] or h[1] != h[3]
+    ]
+
+    return mismatches, net_mismatches
+
+
+def report(mismatches: list[Mismatch], net_mismatches: list[tuple[str, int, int]], max_report: int) -> None:
+    for mismatch in mismatches[:max_report]:
+        print(f'ERROR: {mismatch}')
+    if len(mismatches) > max_report:
+        print(f'... {len(mismatches) - max_report} more')
+
+    for net, netlist_nodes, sch_nodes in net_mismatches[:max_report]:
+        print(f'ERROR: net {net}: {netlist_nodes} nodes in netlist, {sch_nodes} in schematic' +
+              (' (same count, different nodes)' if netlist_nodes == sch_nodes else ''))
+    if len(net_mismatches) > max_report:
+        print(f'... {len(net_mismatches) - max_report} more nets')
+
+
+def verify_sch(
+    netlist         : Netlist,
+    kicad_sch_path  : str,
+    pin_maps        : Optional[dict[str, dict[str, str]]] = None,
+    skip            : Iterable[str] = (),
+    max_report      : int = 50
+) -> bool:
+    """
+    Read the schematic back, verify it against the netlist and report the mismatches.
+    Returns True if the schematic is equivalent to the netlist.
+    """
+    start = time.perf_counter()
+    conn = read_sch_connectivity(kicad_sch_path)
+    mismatches, net_mismatches = verify(netlist, conn, pin_maps, skip)
+
+    report(mismatches, net_mismatches, max_report)
+    print(
+        f'Verified {conn.no_symbols} symbols, {conn.no_labels} labels in {conn.no_sheets} sheet(s) '
+        f'in {time.perf_counter() - start:.2f} s: '
+        f'{len(mismatches)} pin / component mismatches, {len(net_mismatches)} net mismatches'
+    )
+    return not mismatches and not net_mismatches
+
+
+def main(arguments):
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        'netlist_path',
+        help='Protel netlist the schematic was generated from'
+    )
+    parser.add_argument(
+        'kicad_sch_path',
+        help='Generated KiCad schematic (root sheet)'
+    )
+    parser.add_argument(
+        '-c', '--component-root',
+        help='SchComponent templates the schematic was generated with - maps the symbol pins to netlist pins '
+            'and skips components no template matches. Without it, symbol pin numbers must be the netlist pin names'
+    )
+    parser.add_argument(
+        '--sym-lib-table',
+        help='sym-lib-table resolving the symbols not embedded in templates, see nl2sch.py',
+        action='append',
+        default=[]
+    )
+    parser.add_argument(
+        '--netlist-encoding',
+        help='Netlist file encoding, by default UTF-8 with a fallback to cp1252',
+        type=netlist_encoding,
+        default=None
+    )
+    parser.add_argument(
+        '--skip',
+        help='Designators which are expected to be missing from the schematic',
+        nargs='*',
+        default=[]
+    )
+    parser.add_argument(
+        '--max-report',
+        help='Maximum number of reported mismatches (of each kind)',
+        type=int,
+        default=50
+    )
+    args = parser.parse_args(arguments)
+
+    netlist = Netlist.loadFromFile(args.netlist_path, args.netlist_encoding)
+    print(f'Netlist parsed, {len(netlist.comps)} components, {len(netlist.nets)} nets')
+
+    pin_maps = None
+    skip = list(args.skip)
+    if args.component_root:
+        # Imported here, the pipeline verifies through this module
+        from pipeline import ConversionError, TemplateLibrary
+
+        # Same templates (and symbol libraries) as the conversion
+        try:
+            library = TemplateLibrary.load(args.component_root, sym_lib_tables=args.sym_lib_table)
+        except ConversionError as e:
+            for issue in e.issues:
+                print(issue)
+            return 1
+        matcher = library.matcher
+
+        pin_maps = {}
+        template_pin_maps = {}
+        for designator, net_comp in netlist.comps.items():
+            match = matcher.match(net_comp)
+            if match is None:
+                skip.append(designator)
+                continue
+            sch_comp = match.sch_comp
+            if sch_comp not in template_pin_maps:
+                template_pin_maps[sch_comp] = template_pin_map(sch_comp)
+            pin_maps[designator] = template_pin_maps[sch_comp]
+
+    return 0 if verify_sch(netlist, args.kicad_sch_path, pin_maps, skip, args.max_report) else 1
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
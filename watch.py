@@ -0,0 +1,93 @@
+"""
+Input change polling for watch mode
+
+Inputs are polled (size + mtime), which works the same on every platform and
+filesystem (network shares, editors replacing files on save) and costs one stat()
+per input per poll.
+"""
+
+import os
+import time
+from typing import Callable, Optional
+
+# path -> (size, mtime_ns)
+Snapshot = dict[str, tuple[int, int]]
+
+
+def snapshot(paths: list[str]) -> Snapshot:
+    """
+    Size + mtime of each existing path
+    """
+    snap = {}
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            # Removed, or being replaced - shows up as a change
+            continue
+        snap[path] = (st.st_size, st.st_mtime_ns)
+    return snap
+
+
+def changed_paths(old: Snapshot, new: Snapshot) -> set[str]:
+    """
+    Paths added, removed or modified between two snapshots
+    """
+    return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
+
+class InputWatcher:
+    """
+    Waits for changes of a set of input files.
+
+    The set of inputs is re-listed on each poll (list_inputs), so that added / removed
+    files (e.g. a new template) are picked up as well.
+    """
+
+    def __init__(
+        self,
+
+        list_inputs : Callable[[], list[str]],  # Returns the paths of all inputs
+        interval    : float = 0.5,              # Poll interval in seconds
+        settle      : float = 0.1               # Quiet time after a change, editors may write files in several steps
+    ) -> None:
+        self.list_inputs = list_inputs
+        self.interval = interval
+        self.settle = settle
+
+        self.last = snapshot(list_inputs())
+
+    def track(self, paths: list[str]) -> None:
+        """
+        Watch inputs found while running (not listed before) from their current state,
+        so that they don't show up as added
+        """
+        self.last.update(snapshot([path for path in paths if path not in self.last]))
+
+    def wait(self, timeout: Optional[float] = None) -> set[str]:
+        """
+        Block until an input changes, return the changed paths
+        (empty set if timeout seconds passed without a change)
+        """
+        start = time.monotonic()
+        while True:
+            time.sleep(self.interval)
+
+            current = snapshot(self.list_inputs())
+            changed = changed_paths(self.last, current)
+            if changed:
+                # Let the writes settle, then take the state we will be working from
+                while True:
+                    time.sleep(self.settle)
+                    settled = snapshot(self.list_inputs())
+                    if settled == current:
+                        break
+                    current = settled
+
+                changed = changed_paths(self.last, current)
+                self.last = current
+                if changed:
+                    return changed
+
+            if timeout is not None and time.monotonic() - start >= timeout:
+                return set()
@@ -0,0 +1,182 @@
+"""
+Streaming KiCad schematic writer
+
+Placed components are written out as they are placed, so memory use doesn't grow
+with the size of the schematic.
+
+The schematic sections can't be interleaved - the labels are written straight to the
+target file, while symbols and symbol instances are spooled to temporary files and
+appended on close(). The paper size is only known once everything is placed, so it is
+written as a fixed width placeholder and patched in on close().
+
+For hierarchical schematics, sub-sheets are written without the instance sections -
+KiCad keeps all sheet_instances / symbol_instances in the root sheet. A sub-sheet
+writer hands its symbol instances over in a file, which is merged into the root
+sheet by add_symbol_insts() (sub-sheets can be written in other processes).
+"""
+
+import os
+import shutil
+import tempfile
+from typing import Iterable, Optional
+import uuid
+
+from comp import PlacedSchComponent
+from sexpr import quote
+
+# Room for the paper size - "User" paper is limited to a few meters, this is plenty
+_PAPER_PLACEHOLDER = ' ' * 32
+
+
+class SchWriterError(Exception):
+    """
+    Schematic that can't be written, e.g. a paper size that doesn't fit its placeholder
+    """
+    def __init__(self, kicad_sch_path: str, msg: str) -> None:
+        super().__init__(f'{kicad_sch_path}: {msg}')
+
+
+class SchWriter:
+
+    def __init__(
+        self,
+
+        kicad_sch_path  : str,
+        lib_symbols     : Iterable[str],    # lib_symbol entries of all used SchComponents
+        root            : bool = True       # root sheet (write instance sections) or sub-sheet
+    ) -> None:
+        self.kicad_sch_path = kicad_sch_path
+        self.root = root
+
+        # (path, page) of the root + sub-sheets
+        self.sheet_instances : list[tuple[str, str]] = [('/', '')]
+
+        # Statistics
+        self.bytes_written = 0
+        self.no_placed = 0
+
+        # No context managers, the file stays open until close()
+        # KiCad files are UTF-8, whatever the locale
+        self.kicad_sch = open(kicad_sch_path, 'w', encoding='utf-8')
+        self.symbols = tempfile.TemporaryFile('w+', encoding='utf-8')
+        if root:
+            self.symbol_insts = tempfile.TemporaryFile('w+', encoding='utf-8')
+        else:
+            self.symbol_insts = tempfile.NamedTemporaryFile('w+', encoding='utf-8', suffix='.symbol_instances', delete=False)
+
+        self._write(self.kicad_sch, '\n(kicad_sch (version 20201015) (generator eeschema)\n\n  (paper "User" ')
+        self.paper_offset = self.kicad_sch.tell()
+        self._write(self.kicad_sch, f'{_PAPER_PLACEHOLDER})\n\n  (lib_symbols\n')
+
+        for lib_symbol in lib_symbols:
+            self._write(self.kicad_sch, lib_symbol + '\n')
+
+        self._write(self.kicad_sch, '  )\n\n')
+
+    def _write(self, fd, s: str) -> None:
+        fd.write(s)
+        # Encoded size, mostly ASCII - which is checked without encoding
+        self.bytes_written += len(s) if s.isascii() else len(s.encode('utf-8'))
+
+    def add(self, placed: PlacedSchComponent) -> None:
+        """
+        Write out placed component
+        """
+        if placed.rendered_labels:
+            self._write(self.kicad_sch, placed.rendered_labels + '\n')
+        if placed.rendered_symbol:
+            self._write(self.symbols, placed.rendered_symbol + '\n')
+        if placed.rendered_symbol_inst:
+            if self.root:
+                self._write(self.symbol_insts, placed.rendered_symbol_inst + '\n')
+            else:
+                # Not part of this sheet, counted by the root sheet writer that merges them
+                self.symbol_insts.write(placed.rendered_symbol_inst + '\n')
+        self.no_placed += 1
+
+    def add_sheet(
+        self,
+
+        sheet_uuid  : uuid.UUID,
+        name        : str,                  # sheet name
+        file        : str,                  # sub-sheet file, relative to this one
+        pos         : tuple[float, float],
+        size        : tuple[float, float],
+        page        : str
+    ) -> None:
+        """
+        Write out a (sheet ...) reference to a sub-sheet
+        """
+        x, y = round(pos[0], 4), round(pos[1], 4)
+        w, h = size
+        self._write(self.symbols, f"""
+  (sheet (at {x} {y}) (size {w} {h})
+    (stroke (width 0.001) (type solid) (color 0 0 0 0))
+    (fill (color 0 0 0 0.0000))
+    (uuid {sheet_uuid})
+    (property "Sheet name" {quote(name)} (id 0) (at {x} {round(y - 0.7116, 4)} 0)
+      (effects (font (size 1.27 1.27)) (justify left bottom))
+    )
+    (property "Sheet file" {quote(file)} (id 1) (at {x} {round(y + h + 0.5846, 4)} 0)
+      (effects (font (size 1.27 1.27)) (justify left top))
+    )
+  )
+""")
+        self.sheet_instances.append((f'/{sheet_uuid}/', page))
+
+    def add_symbol_insts(self, symbol_insts_path: str) -> None:
+        """
+        Merge (and remove) the symbol instances file returned by close() of a sub-sheet writer
+        """
+        with open(symbol_insts_path, 'r', encoding='utf-8') as symbol_insts:
+            for block in iter(lambda: symbol_insts.read(1 << 16), ''):
+                self._write(self.symbol_insts, block)
+        os.remove(symbol_insts_path)
+
+    def discard(self) -> None:
+        """
+        Close the files of a failed write, and remove the half-written schematic
+        (+ the symbol instances file of a sub-sheet)
+        """
+        for fd in (self.kicad_sch, self.symbols, self.symbol_insts):
+            fd.close()
+        if os.path.exists(self.kicad_sch_path):
+            os.remove(self.kicad_sch_path)
+        if not self.root and os.path.exists(self.symbol_insts.name):
+            os.remove(self.symbol_insts.name)
+
+    def close(self, paper: tuple[float, float]) -> Optional[str]:
+        """
+        Finish the schematic, with the given paper size (width, height)
+
+        For a sub-sheet, returns the path of the file holding its symbol instances
+        """
+        self.symbols.seek(0)
+        shutil.copyfileobj(self.symbols, self.kicad_sch)
+        self.symbols.close()
+
+        symbol_insts_path = None
+        if self.root:
+            self._write(self.kicad_sch, '\n  (sheet_instances\n')
+            for path, page in self.sheet_instances:
+                self._write(self.kicad_sch, f'    (path "{path}" (page "{page}"))\n')
+            self._write(self.kicad_sch, '  )\n\n  (symbol_instances\n')
+            self.symbol_insts.seek(0)
+            shutil.copyfileobj(self.symbol_insts, self.kicad_sch)
+            self.symbol_insts.close()
+            self._write(self.kicad_sch, '  )\n')
+        else:
+            symbol_insts_path = self.symbol_insts.name
+            self.symbol_insts.close()
+
+        self._write(self.kicad_sch, ')\n')
+
+        paper = f'{round(paper[0], 4)} {round(paper[1], 4)}'
+        if len(paper) > len(_PAPER_PLACEHOLDER):
+            raise SchWriterError(self.kicad_sch_path, f'paper size {paper} too large')
+        self.kicad_sch.seek(self.paper_offset)
+        self.kicad_sch.write(paper)
+
+        self.kicad_sch.close()
+
+        return symbol_insts_path